@@ -20,6 +20,7 @@ a = Analysis(
         'pytubefix',
         'moviepy',
         'pydub',
+        'numpy',
         'dotenv',
         'flask_cors',
     ],
@@ -1,15 +1,16 @@
 import base64
 import os
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-import pytubefix
 import json
 from io import StringIO
 import re
 from search import get_youtube_url
 
 def generate(prompt="create a parody of honey singh songs", json_path="audio_data.json"):
+    # The Gemini SDK is imported on first use to keep app startup fast
+    from google import genai
+    from google.genai import types
+
     # Load environment variables from backend/.env (or current working directory)
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     dotenv_path = os.path.join(base_dir, ".env")
@@ -15,12 +15,29 @@ if project_root not in sys.path:
 from ai.ai import generate  # Use fully qualified module paths
 from ai.analyze_json import analyze_mix
 from ai.search import get_youtube_url
-from features.audio_download import download_audio
-from features.audio_split import split_audio
-from features.audio_merge import merge_audio
+from features.mix_pipeline import build_mix, cached_mix, mix_cache_key
+from features.mix_plan import PlanError, plan_mix
+from metrics import stage
+from render_cache import render_cache
 
 
-def generate_ai(prompt, session_dir=None):
+def name_songs(diagnostics, songs):
+    """Label plan diagnostics with the song each one is about"""
+    for diagnostic in diagnostics:
+        title, artist = songs[diagnostic["index"]][:2]
+        diagnostic["song"] = f"{title} by {artist}" if artist else title
+
+
+def generate_ai(prompt, session_dir=None, formats=("mp3",)):
+    """
+    Have the model pick songs for a prompt, then find, validate and mix them.
+
+    Returns:
+        tuple: (path of the merged MP3, plan diagnostics per song as in plan_mix)
+
+    Raises:
+        PlanError: If none of the songs can be mixed
+    """
     # If session_dir is provided, set up session-specific paths
     if session_dir:
         temp_dir = os.path.join(session_dir, "temp")
@@ -34,8 +51,10 @@ def generate_ai(prompt, session_dir=None):
         json_path = "audio_data.json"
     
     # Generate the AI response and save to session-specific JSON file
-    generate(prompt, json_path=json_path)
-    title_artist_start_end = analyze_mix(file_path=json_path)
+    with stage("ai_plan"):
+        generate(prompt, json_path=json_path)
+    # Times stay as the model wrote them; plan_mix rejects the ones it can't read
+    title_artist_start_end = analyze_mix(file_path=json_path, raw_times=True)
 
     url_start_end = []
 
@@ -45,26 +64,27 @@ def generate_ai(prompt, session_dir=None):
         start_time = i[2]
         end_time = i[3]
 
-        url = get_youtube_url(title, artist)
+        with stage("search"):
+            url = get_youtube_url(title, artist)
         url_start_end.append([url, start_time, end_time])
 
-    # Download audio and store filenames
-    names = []
-    for data in url_start_end:
-        url = data[0]
-        download_audio(url, name=str(url_start_end.index(data)), output_dir=temp_dir)
-        names.append(str(url_start_end.index(data)))
-
-    # Split audio files based on start and end times
-    for name in names:
-        index = int(name)
-        start = url_start_end[index][1]
-        end = url_start_end[index][2]
-        split_audio(f"{temp_dir}/{name}.m4a", start, end, output_dir=temp_split_dir)
+    # Drop songs that weren't found or got impossible times, and clamp ends
+    # past the video, before anything is downloaded
+    try:
+        url_start_end, plan = plan_mix(url_start_end)
+    except PlanError as e:
+        name_songs(e.diagnostics, title_artist_start_end)
+        raise
+    name_songs(plan, title_artist_start_end)
 
-    # Merge audio files
-    split_files = [f"{temp_split_dir}/{name}.mp3" for name in names]
-    merged_file_path = merge_audio(split_files, output_dir=output_dir)
+    # The same plan may already have been rendered for someone else
+    key = mix_cache_key(url_start_end)
+    merged_file_path = cached_mix(key, output_dir, formats)
+    if merged_file_path is None:
+        # Download, split and merge the selected segments
+        merged_file_path = build_mix(url_start_end, temp_dir=temp_dir, temp_split_dir=temp_split_dir,
+                                     output_dir=output_dir, formats=formats)
+        render_cache.put(key, merged_file_path)
 
     print(merged_file_path)
-    return merged_file_path
\ No newline at end of file
+    return merged_file_path, plan
\ No newline at end of file
@@ -1,10 +1,11 @@
 import json
 import re
 
-def parse_mix_json(json_str):
+def parse_mix_json(json_str, raw_times=False):
     """
     Parse the JSON string and extract title, artist, start time, and end time for each song.
-    Returns a list of [title, artist, start_time_seconds, end_time_seconds]
+    Returns a list of [title, artist, start_time_seconds, end_time_seconds], or with
+    raw_times the times exactly as the model wrote them, for mix_plan to validate
     """
     try:
         # Handle potential JSON errors
@@ -16,9 +17,12 @@ def parse_mix_json(json_str):
             title = song.get("title", "")
             artist = song.get("artist", "")
             
-            # Convert start time and end time from "HH:MM:SS" format to seconds
-            start_time = convert_time_to_seconds(song.get("startTime", "00:00:00"))
-            end_time = convert_time_to_seconds(song.get("endTime", "00:00:00"))
+            start_time = song.get("startTime", "00:00:00")
+            end_time = song.get("endTime", "00:00:00")
+            if not raw_times:
+                # Convert start time and end time from "HH:MM:SS" format to seconds
+                start_time = convert_time_to_seconds(start_time)
+                end_time = convert_time_to_seconds(end_time)
             
             url_start_end.append([title, artist, start_time, end_time])
             
@@ -31,7 +35,7 @@ def parse_mix_json(json_str):
         fixed_json = fix_json(json_str)
         if fixed_json:
             try:
-                return parse_mix_json(fixed_json)
+                return parse_mix_json(fixed_json, raw_times)
             except Exception as e2:
                 print(f"Failed to fix JSON: {e2}")
                 return []
@@ -101,13 +105,14 @@ def load_json_from_file(file_path='audio_data.json'):
         print(f"{file_path} not found.")
         return None
 
-def analyze_mix(json_str=None, file_path='audio_data.json'):
+def analyze_mix(json_str=None, file_path='audio_data.json', raw_times=False):
     """
     Main function to analyze audio mix data
     
     Args:
         json_str (str, optional): JSON string to parse directly
         file_path (str, optional): Path to JSON file to load
+        raw_times (bool, optional): Keep the times as written instead of converting them
         
     Returns:
         list: List of [title, artist, start_time, end_time] for each song
@@ -118,7 +123,7 @@ def analyze_mix(json_str=None, file_path='audio_data.json'):
         
     
     # Parse JSON and get song information
-    result = parse_mix_json(json_str)
+    result = parse_mix_json(json_str, raw_times)
     
     return result
 
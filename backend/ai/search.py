@@ -1,10 +1,7 @@
-import pytubefix
-from pytubefix import Search
-
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from proxies import proxies
+from proxy_pool import proxy_pool
 
 def get_youtube_url(title, artist):
     """
@@ -17,11 +14,15 @@ def get_youtube_url(title, artist):
     Returns:
         str: URL of the first search result, or None if no results found
     """
+    # pytubefix is imported on first use to keep app startup fast
+    from pytubefix import Search
+
     try:
         # Create a search query combining title and artist
         query = f"{title} {artist} official"
         
-        search_results = Search(query, proxies=proxies).results
+        with proxy_pool.lease():
+            search_results = Search(query).results
         
         # Check if we have any results
         if not search_results:
@@ -30,7 +31,6 @@ def get_youtube_url(title, artist):
         # Get the first result's URL
         first_result = search_results[0]
         video_url = f"https://www.youtube.com/watch?v={first_result.video_id}"
-        print(proxies)
         
         return video_url
     
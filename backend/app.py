@@ -1,20 +1,41 @@
-from flask import Flask, request, jsonify, url_for, session
+from flask import Flask, g, request, jsonify, url_for, session
 from flask_cors import CORS
 import os
 import time
 import json
+import uuid
+import itertools
+from contextlib import contextmanager
 from functools import wraps
-from features.audio_download import download_audio
-from features.audio_split import split_audio
-from features.audio_merge import merge_audio
-from features.read_csv import read_csv
+from features.mix_pipeline import build_mix, cached_mix, mix_cache_key, render_mix
+from features.audio_merge import format_path, validate_formats
+from features.read_csv import iter_csv_rows
+from features.mix_plan import PlanError, iter_plan, plan_mix
+from features.incremental_render import RenderManifest
+from features.waveform import get_peaks, pick_level
+from features.track_analysis import analysis_cache
 from ai.ai_main import generate_ai
 from features.download_video import download_highest_quality
 from features.download_audio import download_highest_quality_audio
+from features.video_clip import CLIP_MAX_SECONDS, clip_video
+from features.stream_policy import StreamPolicy, StreamRejected
 from session_manager import SessionManager
+from single_flight import SingleFlight, make_key
+from server import in_flight
+from manifest_cache import manifest_cache
+from render_cache import link_or_copy, render_cache
+from scratch import scratch
+from proxy_pool import proxy_pool
+from transport import connection_pool
+from cancellation import Cancelled, jobs
+from scheduler import SchedulerBusy, download_scheduler, scheduled_job, transcode_scheduler
+import metrics
+import profiling
+import warmup
 from flask import send_file
 
 app = Flask(__name__)
+app_started = time.time()
 # Use a fixed secret key instead of a random one to ensure consistency across restarts
 app.secret_key = 'intellimix-fixed-secret-key'  # Replace with a strong fixed key in production
 app.config['SESSION_TYPE'] = 'filesystem'
@@ -28,11 +49,61 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True
 CORS(app, 
      supports_credentials=True,
      resources={r"/*": {"origins": "*"}},  # Replace with your frontend domain in production 
-     expose_headers=["Content-Disposition"],
-     allow_headers=["Content-Type", "Authorization"])
+     expose_headers=["Content-Disposition", "X-IntelliMix-Profile-Url", "X-IntelliMix-Profile-Exclusive"],
+     allow_headers=["Content-Type", "Authorization", profiling.PROFILE_HEADER])
+
+# Track in-flight requests so a graceful shutdown can drain them
+in_flight.install(app)
+
+# Time every request for /metrics
+metrics.install(app)
 
 # Initialize session manager
 session_manager = SessionManager()
+# Jobs are recorded in the shared registry, so any worker can supersede or cancel them
+jobs.shared = session_manager
+
+# Identical requests that arrive while one is still running share its result.
+# Only requests handled by this worker process are coalesced.
+job_flights = SingleFlight()
+
+# Load pydub, pytubefix, moviepy and the Gemini SDK in the background
+warmup.prewarm()
+
+@app.errorhandler(SchedulerBusy)
+def scheduler_busy(e):
+    """Tell clients to back off when the transcode queue is full"""
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(Cancelled)
+def job_cancelled(e):
+    """Tell the client its job was stopped (superseded, cancelled or abandoned)"""
+    return jsonify({"error": str(e), "reason": e.token.reason}), 409
+
+@app.errorhandler(StreamRejected)
+def stream_rejected(e):
+    """Report a download refused by the stream policy, with what it would have cost"""
+    return jsonify({"error": str(e), "selection": e.details}), 400
+
+def requested_policy():
+    """
+    The stream policy of a download request: the defaults with the request's "policy" overrides.
+
+    Returns:
+        dict: The policy's fields, for the downloader and the coalescing key
+
+    Raises:
+        ValueError: If the overrides aren't valid
+    """
+    data = request.get_json(silent=True) or {}
+    return StreamPolicy.from_dict(data.get("policy")).to_dict()
+
+def plan_rejected(e):
+    """Report a mix plan that can't be rendered, with what is wrong with each item"""
+    return jsonify({"error": str(e), "plan": e.diagnostics}), 400
 
 # Session management middleware
 def with_session(f):
@@ -65,18 +136,145 @@ def get_session_path(session_id, relative_path):
         raise Exception("Invalid session")
     return os.path.join(session_dir, relative_path)
 
-def time_to_seconds(time_str):
-    """Convert MM:SS or SS format to seconds."""
-    if ':' in time_str:
-        minutes, seconds = map(int, time_str.split(':'))
-        return minutes * 60 + seconds
-    return int(time_str)
+def requested_formats():
+    """
+    Output formats the request asked for, as a JSON list or a comma-separated form field.
+
+    Returns:
+        list: The formats, MP3 (always made) first
+
+    Raises:
+        ValueError: If the formats aren't a list of known formats
+    """
+    data = request.get_json(silent=True) or {}
+    formats = data.get("formats") or request.form.get("formats") or []
+    if isinstance(formats, str):
+        formats = formats.split(",")
+    if not isinstance(formats, list) or not all(isinstance(f, str) for f in formats):
+        raise ValueError("formats must be a list of format names")
+    return validate_formats([f.strip().lower() for f in formats if f.strip()])
+
+def format_urls(session_id, merged_file_path, formats):
+    """URL of the mix in each format, all served by serve_file"""
+    return {
+        format: f"{get_base_url()}/files/{session_id}/{os.path.basename(format_path(merged_file_path, format))}"
+        for format in formats
+    }
+
+def profile_requested():
+    """Whether the request asked for its job to be profiled, by header or job flag"""
+    if request.headers.get(profiling.PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    data = request.get_json(silent=True) or {}
+    return data.get("profile") is True or request.form.get("profile") in ("1", "true")
+
+@contextmanager
+def profiled_job(session_id, label):
+    """Profile the enclosed job into the session if the request asked for it"""
+    directory = get_session_path(session_id, profiling.PROFILE_DIR)
+    with profiling.job_profile(directory, label, profile_requested()) as profile:
+        if profile is not None:
+            g.profile = profile
+            g.profile_url = f"{get_base_url()}/api/debug/profiles/{session_id}/{profile.id}.json"
+        yield profile
+
+@app.after_request
+def add_profile_url(response):
+    """Point a profiled request at its profile, and say whether other jobs shared the process with it"""
+    if "profile_url" in g:
+        exclusive = g.profile.exclusive
+        response.headers["X-IntelliMix-Profile-Url"] = g.profile_url
+        response.headers["X-IntelliMix-Profile-Exclusive"] = "true" if exclusive else "false"
+        body = response.get_json(silent=True) if response.is_json else None
+        if isinstance(body, dict):
+            body["profile"] = {
+                "url": g.profile_url,
+                "exclusive": exclusive,
+                "overlapping_jobs": g.profile.overlapping_jobs,
+            }
+            response.set_data(json.dumps(body))
+    return response
+
+def coalesced_download(session_id, url, subdir, downloader, options=None, label=None):
+    """
+    Download a URL into the session, sharing one download across sessions.
+
+    Downloads are only shared between requests handled by the same worker
+    process. Single-file downloads are interactive work and go ahead of bulk
+    batches.
+
+    Args:
+        options (dict, optional): Keyword arguments for the downloader; only
+            downloads with the same options are shared
+        label (str, optional): Name of the job in profiles, the subdirectory by default
+
+    Returns:
+        str: Absolute path of the downloaded file inside this session
+    """
+    output_dir = get_session_path(session_id, subdir)
+    options = options or {}
+    holding_dir = os.path.join(session_manager.base_dir, ".coalesced")
+
+    def job():
+        # Cancel the session's previous job before clearing its files
+        with jobs.job(session_id, request.environ):
+            # Clear previous files for this session
+            session_manager.clear_session_temp(session_id)
+            session_manager.clear_session_output(session_id)
+
+            with scheduled_job(session_id, "interactive"), profiled_job(session_id, label or subdir):
+                path = downloader(url, output_dir, **options)
+        if not path:
+            raise Exception(f"Download failed for {url}")
+        source = os.path.join(output_dir, os.path.basename(path))
+        # Sessions that joined link from a reference outside this session, which
+        # a newer job here can't clear before they have their copy
+        os.makedirs(holding_dir, exist_ok=True)
+        held = os.path.join(holding_dir, f"{uuid.uuid4().hex}-{os.path.basename(source)}")
+        link_or_copy(source, held)
+        return source, held
+
+    def release(result):
+        try:
+            os.remove(result[1])
+        except OSError:
+            pass
+
+    key = make_key(label or subdir, dict(options, url=url))
+    for attempt in range(2):
+        try:
+            with job_flights.hold(key, job, release) as ((source, held), shared):
+                if not shared or os.path.dirname(source) == output_dir:
+                    return source
+                # Another session ran the download, bring the result into this session
+                with jobs.job(session_id):
+                    session_manager.clear_session_temp(session_id)
+                    session_manager.clear_session_output(session_id)
+                    destination = os.path.join(output_dir, os.path.basename(source))
+                    link_or_copy(held, destination)
+                return destination
+        except Cancelled as e:
+            if attempt or e.token.session_id == session_id:
+                raise
+            # The session running the shared download cancelled it; this one still wants it
 
 @app.route("/api/", methods=["GET"])
 def home():
     return jsonify({"message": "Welcome to the Audio Processing API!"})
 
 
+@app.route("/api/health", methods=["GET"])
+def health():
+    """Readiness probe: answers as soon as the server can take requests"""
+    modules = warmup.status()
+    return jsonify({
+        "status": "ok",
+        "uptime_seconds": round(time.time() - app_started, 3),
+        "warm": all(info["loaded"] for info in modules.values()),
+        "modules": modules
+    })
+
+
 @app.route("/api/process-array", methods=["POST"])
 @with_session
 def process_array(session_id):
@@ -85,45 +283,47 @@ def process_array(session_id):
     if not data:
         return jsonify({"error": "No JSON data provided"}), 400
     
-    # Extract parameters from JSON body and convert times to seconds
+    # Extract parameters from JSON body; times are converted to seconds while planning
     urls = data.get("urls", [])
-    url_start_end = [
-        [item.get("url"), time_to_seconds(item.get("start")), time_to_seconds(item.get("end"))] 
-        for item in urls
-    ]
+    url_start_end = [[item.get("url"), item.get("start"), item.get("end")] for item in urls]
     
     # Validate the input
     if not url_start_end:
         return jsonify({"error": "No URLs provided"}), 400
+    try:
+        formats = requested_formats()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Clear previous temp files for this session
-    session_manager.clear_session_temp(session_id)
-    session_manager.clear_session_output(session_id)
-    
-    # Get session-specific paths
-    temp_dir = get_session_path(session_id, "temp")
-    temp_split_dir = get_session_path(session_id, "temp/split")
+    # Check every segment against its video's metadata before downloading anything
+    try:
+        url_start_end, plan = plan_mix(url_start_end, strict=bool(data.get("strict")))
+    except PlanError as e:
+        return plan_rejected(e)
     
-    # Download audio and store filenames
-    names = []
-    for i, item in enumerate(url_start_end):
-        url = item[0]
-        # Use session-specific temp directory
-        download_audio(url, name=str(i), output_dir=temp_dir)
-        names.append(str(i))
-
-    # Split audio files based on start and end times
-    for name in names:
-        index = int(name)
-        start = url_start_end[index][1]
-        end = url_start_end[index][2]
-        # Use session-specific temp directory
-        split_audio(f"{temp_dir}/{name}.m4a", start, end, output_dir=temp_split_dir)
-
-    # Merge audio files with session-specific paths
-    split_files = [f"{temp_split_dir}/{name}.mp3" for name in names]
-    output_dir = get_session_path(session_id, "static/output")
-    merged_file_path = merge_audio(split_files, output_dir=output_dir)
+    def reset():
+        # Clear previous temp files for this session
+        session_manager.clear_session_temp(session_id)
+        session_manager.clear_session_output(session_id)
+
+    def job():
+        # Download, split and merge with session-specific paths; an edit to a
+        # single entry of the previous mix only re-renders that entry. The
+        # session's previous job is cancelled first.
+        with jobs.job(session_id, request.environ), scheduled_job(session_id, "normal"), \
+                profiled_job(session_id, "process-array"):
+            return render_mix(
+                url_start_end,
+                temp_dir=get_session_path(session_id, "temp"),
+                temp_split_dir=get_session_path(session_id, "temp/split"),
+                output_dir=get_session_path(session_id, "static/output"),
+                reset=reset,
+                formats=formats,
+            )
+
+    # Double submits of the same mix join the run already in progress
+    key = make_key("process-array", {"items": url_start_end, "formats": formats}, session_id)
+    merged_file_path, _ = job_flights.do(key, job)
     
     # Generate a URL that includes the session ID for retrieval
     file_url = f"{get_base_url()}/files/{session_id}/{os.path.basename(merged_file_path)}"
@@ -131,7 +331,9 @@ def process_array(session_id):
     return jsonify({
         "message": "Audio processing complete! Merged file is ready.",
         "merged_file_path": file_url,
-        "session_id": session_id
+        "files": format_urls(session_id, merged_file_path, formats),
+        "session_id": session_id,
+        "plan": plan
     })
 
 @app.route("/api/process-csv", methods=["POST"])
@@ -146,56 +348,87 @@ def process_csv(session_id):
     # Check if user submitted an empty file
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
+    try:
+        formats = requested_formats()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Supersede this session's running job before touching its files, and
+    # stop if the client goes away
+    with jobs.job(session_id, request.environ):
+        # Clear previous files for this session
+        session_manager.clear_session_temp(session_id)
+        session_manager.clear_session_output(session_id)
     
-    # Clear previous files for this session
-    session_manager.clear_session_temp(session_id)
-    session_manager.clear_session_output(session_id)
+        # Get session-specific paths
+        csv_dir = get_session_path(session_id, "csv")
+        temp_dir = get_session_path(session_id, "temp")
+        temp_split_dir = get_session_path(session_id, "temp/split")
     
-    # Get session-specific paths
-    csv_dir = get_session_path(session_id, "csv")
-    temp_dir = get_session_path(session_id, "temp")
-    temp_split_dir = get_session_path(session_id, "temp/split")
+        # Save the uploaded file to session's CSV directory
+        temp_csv_path = os.path.join(csv_dir, "temp_upload.csv")
+        file.save(temp_csv_path)
     
-    # Save the uploaded file to session's CSV directory
-    temp_csv_path = os.path.join(csv_dir, "temp_upload.csv")
-    file.save(temp_csv_path)
+        # The file is read twice, a row at a time: once here, and again by the
+        # render as it goes. A template many users upload is rendered once, so
+        # this pass hashes its key, needing no requests and no memory. It also
+        # collects the bad rows, which are skipped and reported, and counts the
+        # valid ones
+        skipped_rows = []
+        valid_rows = itertools.count()
+        try:
+            # zip stops when the rows run out, before it takes another number
+            key = mix_cache_key(row for row, _ in zip(iter_csv_rows(temp_csv_path, errors=skipped_rows), valid_rows))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if next(valid_rows) == 0:
+            return jsonify({"error": "CSV has no valid rows", "skipped_rows": skipped_rows}), 400
+        rows = iter_csv_rows(temp_csv_path)
     
-    try:
-        url_start_end = read_csv(temp_csv_path)
+        try:
+            output_dir = get_session_path(session_id, "static/output")
+            merged_file_path = cached_mix(key, output_dir, formats)
+            # Rows that were fixed or rejected against their video's metadata
+            plan = []
+            if merged_file_path is not None:
+                # As found when the cached mix was rendered from the same rows
+                plan = (render_cache.meta(key) or {}).get("plan", [])
+            else:
+                # CSV playlists are batch work; sessions with single requests go first
+                with scheduled_job(session_id, "bulk"), profiled_job(session_id, "process-csv"):
+                    # Rows are read, checked and downloaded a window at a time,
+                    # so the first segments start before the rest is parsed
+                    merged_file_path = build_mix(
+                        iter_plan(rows, plan),
+                        temp_dir=temp_dir,
+                        temp_split_dir=temp_split_dir,
+                        output_dir=output_dir,
+                        formats=formats,
+                    )
+                # Planning is deterministic for the same rows, unless a video was unavailable
+                if not any(d["status"] == "rejected" for d in plan):
+                    render_cache.put(key, merged_file_path, meta={"plan": plan})
         
-        # Download audio and store filenames
-        names = []
-        for data in url_start_end:
-            url = data[0]
-            idx = url_start_end.index(data)
-            # Use session-specific temp directory
-            download_audio(url, name=str(idx), output_dir=temp_dir)
-            names.append(str(idx))
-
-        # Split audio files based on start and end times
-        for name in names:
-            index = int(name)
-            start = url_start_end[index][1]
-            end = url_start_end[index][2]
-            # Use session-specific paths
-            split_audio(f"{temp_dir}/{name}.m4a", start, end, output_dir=temp_split_dir)
-
-        # Merge audio files with session-specific paths
-        split_files = [f"{temp_split_dir}/{name}.mp3" for name in names]
-        output_dir = get_session_path(session_id, "static/output")
-        merged_file_path = merge_audio(split_files, output_dir=output_dir)
+            # Generate a URL that includes the session ID for retrieval
+            file_url = f"{get_base_url()}/files/{session_id}/{os.path.basename(merged_file_path)}"
         
-        # Generate a URL that includes the session ID for retrieval
-        file_url = f"{get_base_url()}/files/{session_id}/{os.path.basename(merged_file_path)}"
-        
-        return jsonify({
-            "message": "Audio processing complete! Merged file is ready.",
-            "merged_file_path": file_url,
-            "session_id": session_id
-        })
+            return jsonify({
+                "message": "Audio processing complete! Merged file is ready.",
+                "merged_file_path": file_url,
+                "files": format_urls(session_id, merged_file_path, formats),
+                "session_id": session_id,
+                "skipped_rows": skipped_rows,
+                "plan": plan
+            })
     
-    except Exception as e:
-        return jsonify({"error": f"Error processing CSV: {str(e)}"}), 500
+        except PlanError as e:
+            return plan_rejected(e)
+        except Cancelled as e:
+            return job_cancelled(e)
+        except SchedulerBusy as e:
+            return scheduler_busy(e)
+        except Exception as e:
+            return jsonify({"error": f"Error processing CSV: {str(e)}"}), 500
 
 @app.route("/api/generate-ai", methods=["POST"])
 @with_session
@@ -203,18 +436,29 @@ def ai_generation(session_id):
     data = request.get_json()
     if not data or not data.get("prompt"):
         return jsonify({"error": "Invalid input. Expected a prompt."}), 400
+    try:
+        formats = requested_formats()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
-        # Clear previous files for this session
-        session_manager.clear_session_temp(session_id)
-        session_manager.clear_session_output(session_id)
-        
-        # Get session directory
-        session_dir = session_manager.get_session_dir(session_id)
-        
         prompt = data["prompt"]
-        # Pass session directory to generate_ai for session-specific work
-        filepath = generate_ai(prompt, session_dir=session_dir)
+
+        def job():
+            # Cancel the session's previous job before clearing its files
+            with jobs.job(session_id, request.environ):
+                # Clear previous files for this session
+                session_manager.clear_session_temp(session_id)
+                session_manager.clear_session_output(session_id)
+
+                # Pass session directory to generate_ai for session-specific work
+                session_dir = session_manager.get_session_dir(session_id)
+                with scheduled_job(session_id, "normal"), profiled_job(session_id, "generate-ai"):
+                    return generate_ai(prompt, session_dir=session_dir, formats=formats)
+
+        # A retried prompt joins the generation already in progress
+        key = make_key("generate-ai", {"prompt": prompt, "formats": formats}, session_id)
+        (filepath, plan), _ = job_flights.do(key, job)
         
         # Generate a URL that includes the session ID for retrieval
         file_url = f"{get_base_url()}/files/{session_id}/{os.path.basename(filepath)}"
@@ -222,9 +466,17 @@ def ai_generation(session_id):
         return jsonify({
             "message": "AI content generated successfully!",
             "filepath": file_url,
-            "session_id": session_id
+            "files": format_urls(session_id, filepath, formats),
+            "session_id": session_id,
+            "plan": plan
         })
         
+    except PlanError as e:
+        return plan_rejected(e)
+    except Cancelled as e:
+        return job_cancelled(e)
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
     except Exception as e:
         return jsonify({"error": f"Error generating AI content: {str(e)}"}), 500
 
@@ -236,15 +488,15 @@ def download_video(session_id):
         return jsonify({"error": "Invalid input. Expected a URL."}), 400
     
     url = data["url"]
-    output_dir = get_session_path(session_id, "static/video_dl")
+    try:
+        policy = requested_policy()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
-        # Clear previous files for this session
-        session_manager.clear_session_temp(session_id)
-        session_manager.clear_session_output(session_id)
-        
-        # Download video to session-specific directory
-        path = download_highest_quality(url, output_dir)
+        # Download video to session-specific directory, shared across sessions
+        path = coalesced_download(session_id, url, "static/video_dl", download_highest_quality,
+                                  options={"policy": policy})
         
         # Generate URL for accessing the file
         filename = os.path.basename(path)
@@ -256,9 +508,70 @@ def download_video(session_id):
             "session_id": session_id
         })
     
+    except Cancelled as e:
+        return job_cancelled(e)
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+    except StreamRejected as e:
+        return stream_rejected(e)
     except Exception as e:
         return jsonify({"error": f"Error downloading video: {str(e)}"}), 500
 
+@app.route("/api/clip-video", methods=["POST"])
+@with_session
+def clip_video_range(session_id):
+    """
+    Cut a clip of a video, fetching only the part of the streams it covers.
+
+    JSON body: url, start and end in seconds, and exact (optional) to cut
+    precisely at start by re-encoding the partial GOPs at the edges instead
+    of starting at the keyframe before it. policy (optional) overrides the
+    stream policy, its size limit applying to the clip.
+    """
+    data = request.get_json()
+    if not data or not data.get("url"):
+        return jsonify({"error": "Invalid input. Expected a URL."}), 400
+    try:
+        start = float(data.get("start", 0))
+        end = float(data["end"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid input. Expected start and end in seconds."}), 400
+    if not 0 <= start < end:
+        return jsonify({"error": "start must be at least 0 and before end"}), 400
+    if end - start > CLIP_MAX_SECONDS:
+        return jsonify({"error": f"Clips can be at most {CLIP_MAX_SECONDS:g} seconds long"}), 400
+
+    try:
+        policy = requested_policy()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    url = data["url"]
+    options = {"start": start, "end": end, "exact": data.get("exact") is True, "policy": policy}
+
+    try:
+        # Clip into the session's video directory, shared across sessions
+        path = coalesced_download(session_id, url, "static/video_dl", clip_video, options=options, label="clip")
+
+        # Generate URL for accessing the file
+        filename = os.path.basename(path)
+        file_url = f"{get_base_url()}/files/{session_id}/{filename}"
+
+        return jsonify({
+            "message": "Video clipped successfully!",
+            "filepath": file_url,
+            "session_id": session_id
+        })
+
+    except Cancelled as e:
+        return job_cancelled(e)
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+    except StreamRejected as e:
+        return stream_rejected(e)
+    except Exception as e:
+        return jsonify({"error": f"Error clipping video: {str(e)}"}), 500
+
 @app.route("/api/download-audio", methods=["POST"])
 @with_session
 def audio_download(session_id):
@@ -267,15 +580,15 @@ def audio_download(session_id):
         return jsonify({"error": "Invalid input. Expected a URL."}), 400
     
     url = data["url"]
-    output_dir = get_session_path(session_id, "static/audio_dl")
+    try:
+        policy = requested_policy()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
-        # Clear previous files for this session
-        session_manager.clear_session_temp(session_id)
-        session_manager.clear_session_output(session_id)
-        
-        # Download audio to session-specific directory
-        path = download_highest_quality_audio(url, output_dir)
+        # Download audio to session-specific directory, shared across sessions
+        path = coalesced_download(session_id, url, "static/audio_dl", download_highest_quality_audio,
+                                  options={"policy": policy})
         
         # Generate URL for accessing the file
         filename = os.path.basename(path)
@@ -287,16 +600,24 @@ def audio_download(session_id):
             "session_id": session_id
         })
     
+    except Cancelled as e:
+        return job_cancelled(e)
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+    except StreamRejected as e:
+        return stream_rejected(e)
     except Exception as e:
         return jsonify({"error": f"Error downloading audio: {str(e)}"}), 500
 
-# Serve files from session directories
-@app.route("/files/<session_id>/<filename>")
-def serve_file(session_id, filename):
-    session_dir = session_manager.get_session_dir(session_id)
-    if not session_dir:
-        return jsonify({"error": "Invalid session"}), 404
-    
+@app.route("/api/cancel", methods=["POST"])
+@with_session
+def cancel_job(session_id):
+    """Stop the session's running job; its partial files are removed"""
+    cancelled = jobs.cancel(session_id)
+    return jsonify({"cancelled": cancelled, "session_id": session_id})
+
+def find_session_file(session_dir, filename):
+    """Path of a file served from one of the session's output directories, or None"""
     # Look for the file in various output directories
     possible_paths = [
         os.path.join(session_dir, "static", "output", filename),
@@ -306,21 +627,127 @@ def serve_file(session_id, filename):
     
     for path in possible_paths:
         if os.path.exists(path):
-            return send_file(path)
+            return path
+    return None
+
+# Serve files from session directories
+@app.route("/files/<session_id>/<filename>")
+def serve_file(session_id, filename):
+    session_dir = session_manager.get_session_dir(session_id)
+    if not session_dir:
+        return jsonify({"error": "Invalid session"}), 404
+    
+    path = find_session_file(session_dir, filename)
+    if path:
+        # send_file resolves relative paths against the app root, not the working directory
+        return send_file(os.path.abspath(path))
     
     return jsonify({"error": "File not found"}), 404
 
+def waveform_response(session_id, audio_file):
+    """
+    Waveform peaks of a file, at the zoom level the query asks for.
 
-
-
-
-
-
-
-
-
-
-
+    Query args: pixels (buckets wanted; the coarsest level with at least
+    that many is served) or level (0 is the finest), and format (json or dat).
+    """
+    try:
+        # Files without cached peaks are decoded now, ahead of batch work
+        with scheduled_job(session_id, "interactive"):
+            levels = get_peaks(audio_file)
+        level = pick_level(levels, pixels=request.args.get("pixels", type=int),
+                           level=request.args.get("level", type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": f"Error reading waveform: {str(e)}"}), 500
+    if request.args.get("format") == "dat":
+        return app.response_class(level.to_dat(), mimetype="application/octet-stream")
+    return jsonify(level.to_json())
+
+@app.route("/api/waveform/<session_id>/<filename>", methods=["GET"])
+def output_waveform(session_id, filename):
+    """Waveform peaks of a mix or download, cached beside the file"""
+    session_dir = session_manager.get_session_dir(session_id)
+    if not session_dir:
+        return jsonify({"error": "Invalid session"}), 404
+    path = find_session_file(session_dir, filename)
+    if not path:
+        return jsonify({"error": "File not found"}), 404
+    return waveform_response(session_id, path)
+
+@app.route("/api/waveform/<session_id>/sources/<int:index>", methods=["GET"])
+def source_waveform(session_id, index):
+    """Waveform peaks of the whole source of a segment of the session's last mix, for picking times"""
+    session_dir = session_manager.get_session_dir(session_id)
+    if not session_dir:
+        return jsonify({"error": "Invalid session"}), 404
+    temp_dir = os.path.join(session_dir, "temp")
+    path = scratch.locate(os.path.join(temp_dir, f"{index}.m4a"))
+    # Segments re-rendered after an edit have their own source
+    manifest = RenderManifest.load(os.path.join(temp_dir, "render", "manifest.json"))
+    if manifest is not None and index < len(manifest.segments):
+        path = manifest.segments[index].get("source") or path
+    if not os.path.exists(path):
+        return jsonify({"error": "Source not found"}), 404
+    return waveform_response(session_id, path)
+
+
+
+
+
+
+
+
+
+
+
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Counters and latency histograms for Prometheus to scrape"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@metrics.registry.collector
+def collect_state():
+    """Report what the caches, schedulers and session manager already count"""
+    manifests = manifest_cache.stats()
+    renders = render_cache.stats()
+    analyses = analysis_cache.stats()
+    scratch_stats = scratch.stats()
+    schedulers = [download_scheduler.stats(), transcode_scheduler.stats()]
+    job_stats = jobs.stats()
+    return [
+        ("intellimix_cache_hits_total", "counter", "Cache lookups that hit",
+         [({"cache": "manifest"}, manifests["hits"]), ({"cache": "render"}, renders["hits"]),
+          ({"cache": "analysis"}, analyses["hits"]), ({"cache": "video_info"}, manifests["info_hits"])]),
+        ("intellimix_cache_misses_total", "counter", "Cache lookups that missed",
+         [({"cache": "manifest"}, manifests["misses"]), ({"cache": "render"}, renders["misses"]),
+          ({"cache": "analysis"}, analyses["misses"]), ({"cache": "video_info"}, manifests["info_misses"])]),
+        ("intellimix_cache_entries", "gauge", "Entries held by a cache",
+         [({"cache": "manifest"}, manifests["entries"]), ({"cache": "render"}, renders["entries"]),
+          ({"cache": "analysis"}, analyses["entries"]), ({"cache": "video_info"}, manifests["info_entries"])]),
+        ("intellimix_render_cache_bytes", "gauge", "Bytes held by the render cache", [({}, renders["bytes"])]),
+        ("intellimix_render_cache_evictions_total", "counter", "Mixes evicted from the render cache",
+         [({}, renders["evictions"])]),
+        ("intellimix_scratch_bytes", "gauge", "Bytes of intermediates kept in memory",
+         [({}, scratch_stats["ram_bytes"])]),
+        ("intellimix_scratch_files_total", "counter", "Intermediate files placed, by where they went",
+         [({"area": "ram"}, scratch_stats["ram_files"]), ({"area": "disk"}, scratch_stats["disk_files"])]),
+        ("intellimix_scheduler_active", "gauge", "Slots in use",
+         [({"scheduler": s["name"]}, s["active"]) for s in schedulers]),
+        ("intellimix_scheduler_queued", "gauge", "Work waiting for a slot",
+         [({"scheduler": s["name"]}, s["queued"]) for s in schedulers]),
+        ("intellimix_scheduler_rejected_total", "counter", "Work turned away because the queue was full",
+         [({"scheduler": s["name"]}, s["rejected"]) for s in schedulers]),
+        ("intellimix_jobs_running", "gauge", "Jobs running", [({}, job_stats["running"])]),
+        ("intellimix_jobs_cancelled_total", "counter", "Jobs cancelled", [({}, job_stats["cancelled"])]),
+        ("intellimix_requests_in_flight", "gauge", "Requests being handled", [({}, in_flight.count)]),
+        ("intellimix_active_sessions", "gauge", "Registered sessions", [({}, len(session_manager.list_sessions()))]),
+        ("intellimix_session_bytes", "gauge", "Bytes on disk in session directories",
+         [({}, session_manager.disk_usage())]),
+    ]
 
 @app.route("/api/debug/session", methods=["GET"])
 def debug_session():
@@ -356,12 +783,75 @@ def debug_new_session():
         "new_session_id": session['session_id']
     })
 
+@app.route("/api/debug/scheduler", methods=["GET"])
+def debug_scheduler():
+    """Report slot usage, queue depth and wait times for downloads and transcodes"""
+    return jsonify({
+        "download": download_scheduler.stats(),
+        "transcode": transcode_scheduler.stats()
+    })
+
+@app.route("/api/debug/proxies", methods=["GET"])
+def debug_proxies():
+    """Report health, latency and load of each proxy in the pool"""
+    return jsonify(proxy_pool.stats())
+
+@app.route("/api/debug/transport", methods=["GET"])
+def debug_transport():
+    """Report connection reuse and DNS cache hits of the shared HTTP transport"""
+    return jsonify(connection_pool.stats())
+
+@app.route("/api/debug/manifests", methods=["GET"])
+def debug_manifests():
+    """Report hit rate and size of the stream-manifest cache"""
+    return jsonify(manifest_cache.stats())
+
+@app.route("/api/debug/jobs", methods=["GET"])
+def debug_jobs():
+    """Report running and cancelled jobs"""
+    return jsonify(jobs.stats())
+
+@app.route("/api/debug/render-cache", methods=["GET"])
+def debug_render_cache():
+    """Report size, hit rate and evictions of the shared render cache"""
+    return jsonify(render_cache.stats())
+
+@app.route("/api/debug/analysis-cache", methods=["GET"])
+def debug_analysis_cache():
+    """Report size and hit rate of the track analysis cache"""
+    return jsonify(analysis_cache.stats())
+
+@app.route("/api/debug/scratch", methods=["GET"])
+def debug_scratch():
+    """Report how much of the memory-backed scratch space is in use"""
+    return jsonify(scratch.stats())
+
+@app.route("/api/debug/profiles/<session_id>", methods=["GET"])
+def debug_profiles(session_id):
+    """List the profiles saved for a session's jobs (admin only)"""
+    session_dir = session_manager.get_session_dir(session_id)
+    if not session_dir:
+        return jsonify({"error": "Invalid session"}), 404
+    return jsonify({"profiles": profiling.list_profiles(os.path.join(session_dir, profiling.PROFILE_DIR))})
+
+@app.route("/api/debug/profiles/<session_id>/<filename>", methods=["GET"])
+def debug_profile_file(session_id, filename):
+    """Download one artifact of a profiled job (admin only)"""
+    session_dir = session_manager.get_session_dir(session_id)
+    if not session_dir:
+        return jsonify({"error": "Invalid session"}), 404
+    path = os.path.join(session_dir, profiling.PROFILE_DIR, os.path.basename(filename))
+    if not os.path.exists(path):
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=not filename.endswith(".json"))
+
 @app.route("/api/debug/all-sessions", methods=["GET"])
 def debug_all_sessions():
     """List all active sessions (admin only)"""
+    session_ids = session_manager.list_sessions()
     return jsonify({
-        "active_sessions_count": len(session_manager.sessions),
-        "session_ids": list(session_manager.sessions.keys())
+        "active_sessions_count": len(session_ids),
+        "session_ids": session_ids
     })
 
 
@@ -373,23 +863,45 @@ def debug_all_sessions():
 """
 Serving the react frontend from static/dist
 """
-from flask import send_from_directory
+from flask import abort
+from static_assets import StaticBundle
+
+# Built once at startup; requests are served from memory
+static_bundle = StaticBundle(os.path.join(app.root_path, 'static', 'dist'))
 
 @app.route('/assets/<path:filename>')
 def serve_assets(filename):
-    return send_from_directory('static/dist/assets', filename)
+    response = static_bundle.response(f"assets/{filename}")
+    if response is None:
+        abort(404)
+    return response
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_react(path):
-    dist_dir = os.path.join('static', 'dist')
-    if path != "" and os.path.exists(os.path.join(dist_dir, path)):
-        return send_from_directory(dist_dir, path)
-    else:
-        return send_from_directory(dist_dir, 'index.html')
+    # Unknown paths are client-side routes, so they get index.html
+    response = static_bundle.response(path) if path else None
+    if response is None:
+        response = static_bundle.response('index.html')
+    if response is None:
+        abort(404)
+    return response
 
 # Main app entry point
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    import argparse
+    from server import add_arguments, config_from_args, serve
+
+    parser = add_arguments(argparse.ArgumentParser(description="IntelliMix API server"))
+    parser.add_argument("--dev", action="store_true", help="Run the Flask development server with debug enabled")
+    args = parser.parse_args()
+
+    if args.dev:
+        app.run(debug=True, host="0.0.0.0", port=5000)
+    else:
+        config = config_from_args(args)
+        # Running app.py directly has always listened on every interface
+        config["host"] = config["host"] or os.environ.get("INTELLIMIX_HOST", "0.0.0.0")
+        serve(app, **config)
\ No newline at end of file
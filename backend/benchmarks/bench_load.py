@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Load test of the API endpoints with fake media, search and LLM providers.
+
+Serves the Flask app on a local threaded server and drives it with
+concurrent sessions (each with its own cookie jar), mixing
+/api/process-array, /api/generate-ai and /files/<session>/<file>
+requests. Nothing leaves the machine; the providers that normally call
+out are swapped for local fakes with configurable latency and payload:
+
+- fetch: downloads copy a synthetic source of --source-seconds after
+  --fetch-ms; duration lookups while planning take the same latency
+- search: returns a made-up video URL after --search-ms
+- LLM: writes a plan of --ai-songs songs after --llm-ms
+
+Every request uses different videos unless --shared-mixes is given, so
+the render cache doesn't turn the test into a cache benchmark.
+
+Reports throughput and p50/p95/p99 latency per endpoint as JSON.
+
+Usage:
+    python benchmarks/bench_load.py [--sessions 8] [--duration 60] [--mix-segments 4]
+        [--fetch-ms 200] [--search-ms 100] [--llm-ms 1500] [--output load.json]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Relative weights of the endpoints each session picks from
+ENDPOINT_WEIGHTS = {"process-array": 3, "generate-ai": 1, "files": 6}
+
+
+def fake_video_id():
+    return "".join(random.choices(string.ascii_letters + string.digits, k=11))
+
+
+def make_source(path, seconds):
+    """Synthetic download payload: a tone over pink noise, AAC in .m4a"""
+    from pydub import AudioSegment
+
+    graph = (f"sine=frequency=330:duration={seconds}:sample_rate=44100[tone];"
+             f"anoisesrc=color=pink:amplitude=0.1:duration={seconds}:sample_rate=44100[noise];"
+             f"[tone][noise]amix=inputs=2,aformat=channel_layouts=stereo")
+    subprocess.run([AudioSegment.converter, "-y", "-loglevel", "error", "-filter_complex", graph,
+                    "-c:a", "aac", "-b:a", "128k", path], check=True)
+
+
+def install_fakes(args, source_path):
+    """Replace the providers that reach YouTube and Gemini with local fakes"""
+    from features import mix_pipeline, mix_plan
+    from ai import ai_main
+    from scratch import scratch
+
+    def fake_download(url, name="", output_dir="temp/"):
+        time.sleep(args.fetch_ms / 1000)
+        # Placed like a real download
+        with scratch.place(os.path.join(output_dir, f"{name}.m4a"), os.path.getsize(source_path)) as path:
+            shutil.copyfile(source_path, path)
+        return name
+
+    def fake_duration(url):
+        time.sleep(args.fetch_ms / 1000)
+        return args.source_seconds
+
+    def fake_search(title, artist):
+        time.sleep(args.search_ms / 1000)
+        return f"https://www.youtube.com/watch?v={fake_video_id()}"
+
+    def fake_generate(prompt, json_path="audio_data.json"):
+        time.sleep(args.llm_ms / 1000)
+        songs = []
+        for i in range(args.ai_songs):
+            start = random.randint(0, max(0, args.source_seconds - args.segment_seconds))
+            songs.append({"title": f"Song {i}", "artist": "Artist",
+                          "startTime": f"00:{start // 60:02d}:{start % 60:02d}",
+                          "endTime": f"00:{(start + args.segment_seconds) // 60:02d}:{(start + args.segment_seconds) % 60:02d}"})
+        with open(json_path, "w") as f:
+            json.dump({"songs": songs}, f)
+
+    mix_pipeline.download_audio = fake_download
+    mix_plan.resolve_duration = fake_duration
+    ai_main.get_youtube_url = fake_search
+    ai_main.generate = fake_generate
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Session:
+    """One simulated user with its own cookie (and so its own server session)"""
+
+    def __init__(self, base_url, args, results, lock):
+        self.base_url = base_url
+        self.args = args
+        self.results = results
+        self.lock = lock
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.last_file = None
+
+    def request(self, endpoint, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers={"Content-Type": "application/json"} if data else {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.args.timeout) as response:
+                payload = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            status = e.code
+        except OSError as e:
+            payload = b""
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.results[endpoint].append((latency, status, len(payload)))
+        return status, payload
+
+    def mix_items(self):
+        items = []
+        for i in range(self.args.mix_segments):
+            video = f"shared{i:05d}" if self.args.shared_mixes else fake_video_id()
+            start = random.randint(0, max(0, self.args.source_seconds - self.args.segment_seconds))
+            items.append({"url": f"https://www.youtube.com/watch?v={video}",
+                          "start": str(start), "end": str(start + self.args.segment_seconds)})
+        return items
+
+    def step(self, endpoint):
+        if endpoint == "files" and self.last_file is None:
+            endpoint = "process-array"  # Nothing to fetch yet
+        if endpoint == "process-array":
+            status, payload = self.request(endpoint, "/api/process-array", {"urls": self.mix_items()})
+            if status == 200:
+                self.last_file = json.loads(payload)["merged_file_path"]
+        elif endpoint == "generate-ai":
+            status, payload = self.request(endpoint, "/api/generate-ai", {"prompt": "load test mix"})
+            if status == 200:
+                self.last_file = json.loads(payload)["filepath"]
+        else:
+            self.request(endpoint, self.last_file[len(self.base_url):])
+
+    def run(self, deadline):
+        endpoints = list(ENDPOINT_WEIGHTS)
+        weights = [ENDPOINT_WEIGHTS[e] for e in endpoints]
+        while time.perf_counter() < deadline:
+            self.step(random.choices(endpoints, weights)[0])
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    statuses = defaultdict(int)
+    for _, status, _ in samples:
+        statuses[str(status)] += 1
+    ok = statuses.get("200", 0)
+    return {
+        "requests": len(samples),
+        "ok": ok,
+        "statuses": dict(statuses),
+        "throughput_rps": round(ok / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "max_ms": round(latencies[-1], 1),
+        "megabytes": round(sum(size for _, _, size in samples) / 2 ** 20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API with fake media, search and LLM providers")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to drive load for")
+    parser.add_argument("--mix-segments", type=int, default=4, help="Segments per process-array request")
+    parser.add_argument("--ai-songs", type=int, default=4, help="Songs in each fake LLM plan")
+    parser.add_argument("--source-seconds", type=int, default=60, help="Length of each fake download")
+    parser.add_argument("--segment-seconds", type=int, default=10, help="Length of each mixed segment")
+    parser.add_argument("--fetch-ms", type=float, default=200, help="Latency of each fake download/metadata lookup")
+    parser.add_argument("--search-ms", type=float, default=100, help="Latency of each fake search")
+    parser.add_argument("--llm-ms", type=float, default=1500, help="Latency of each fake LLM call")
+    parser.add_argument("--shared-mixes", action="store_true", help="Let sessions request identical mixes")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # Sessions, render cache and fixtures live in a scratch directory
+    workdir = tempfile.mkdtemp(prefix="intellimix-load-")
+    os.chdir(workdir)
+    os.environ["INTELLIMIX_PREWARM"] = "0"
+    try:
+        source_path = os.path.join(workdir, "source.m4a")
+        make_source(source_path, args.source_seconds)
+
+        from app import app
+        install_fakes(args, source_path)
+        server = start_server(app)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        results = defaultdict(list)
+        lock = threading.Lock()
+        sessions = [Session(base_url, args, results, lock) for _ in range(args.sessions)]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=session.run, args=(deadline,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        from scratch import scratch
+        scratch.clear(workdir)
+
+    report = {
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_seconds": round(elapsed, 1),
+        "endpoints": {endpoint: summarize(samples, elapsed) for endpoint, samples in sorted(results.items())},
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
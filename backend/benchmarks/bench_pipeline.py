@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the audio pipeline on synthetic sources.
+
+Generates audio sources with ffmpeg (tones over pink noise, AAC in .m4a
+like the downloads) and times each stage without touching YouTube:
+
+- read_csv: parsing a large playlist CSV
+- analyze_mix: parsing a large AI mix plan
+- split: trimming every source to its segment
+- analysis: loudness and beat grid analysis of every whole source
+- merge: crossfading the segments into one mix
+- pipeline: build_mix end to end, with downloads served from the fixtures
+- sessions: creating, clearing and deleting sessions with files in them
+
+Each stage runs in a fresh interpreter, so its peak RSS is its own. Wall
+time, CPU time (this process and its ffmpeg children) and peak RSS are
+reported as JSON, as the median of --repeats runs. With --baseline, every
+stage is compared against a stored result and the run fails if one got
+slower or bigger by more than --tolerance.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sources 6] [--seconds 60] [--segment 12] [--repeats 3]
+        [--output pipeline.json] [--baseline benchmarks/baseline_pipeline.json] [--tolerance 0.25]
+        [--save-baseline benchmarks/baseline_pipeline.json]
+
+Exits with status 1 if any stage regressed against the baseline.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Peak RSS and child CPU come from getrusage, which Windows doesn't have
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+STAGES = ["read_csv", "analyze_mix", "split", "analysis", "merge", "pipeline", "sessions"]
+# Compared against the baseline; CPU is reported but varies too much between runs to gate on
+GATED_METRICS = ["wall_ms", "peak_rss_mb"]
+
+
+def ffmpeg_binary():
+    from pydub import AudioSegment
+    return AudioSegment.converter
+
+
+def make_fixtures(workdir, sources, seconds, csv_rows, plan_songs):
+    """Write the synthetic sources, a playlist CSV and an AI mix plan into workdir"""
+    source_dir = os.path.join(workdir, "sources")
+    os.makedirs(source_dir, exist_ok=True)
+    for i in range(sources):
+        # A different tone per source over pink noise, so the encoders see real content
+        graph = (f"sine=frequency={220 + 55 * i}:duration={seconds}:sample_rate=44100[tone];"
+                 f"anoisesrc=color=pink:amplitude=0.1:duration={seconds}:sample_rate=44100[noise];"
+                 f"[tone][noise]amix=inputs=2,aformat=channel_layouts=stereo")
+        subprocess.run(
+            [ffmpeg_binary(), "-y", "-loglevel", "error", "-filter_complex", graph,
+             "-c:a", "aac", "-b:a", "128k", os.path.join(source_dir, f"{i}.m4a")],
+            check=True,
+        )
+
+    with open(os.path.join(workdir, "playlist.csv"), "w") as f:
+        f.write("Url,Start,End\n")
+        for i in range(csv_rows):
+            f.write(f"https://www.youtube.com/watch?v=video{i:06d},0:{i % 50:02d},1:{i % 50:02d}\n")
+
+    songs = [{"title": f"Song {i}", "artist": f"Artist {i % 7}",
+              "startTime": f"00:00:{i % 50:02d}", "endTime": f"00:01:{i % 50:02d}"}
+             for i in range(plan_songs)]
+    with open(os.path.join(workdir, "plan.json"), "w") as f:
+        json.dump({"songs": songs}, f)
+
+
+def segments(workdir, sources, seconds, segment):
+    """[source, start, end] for each fixture, cut from the middle of the source"""
+    start = max(0, (seconds - segment) // 2)
+    return [[os.path.join(workdir, "sources", f"{i}.m4a"), start, start + segment] for i in range(sources)]
+
+
+def run_stage(stage, workdir, sources, seconds, segment):
+    """Run one stage in this process (called in a fresh interpreter per run)"""
+    from scratch import scratch as scratch_space
+
+    scratch = os.path.join(workdir, "scratch", stage)
+    shutil.rmtree(scratch, ignore_errors=True)
+    scratch_space.clear(scratch)
+    os.makedirs(scratch)
+    items = segments(workdir, sources, seconds, segment)
+    # Every run analyses its sources afresh
+    os.environ["INTELLIMIX_ANALYSIS_CACHE_DIR"] = os.path.join(scratch, "analysis_cache")
+
+    # Imports happen before the clock starts, so stages measure work, not import time
+    if stage == "read_csv":
+        from features.read_csv import read_csv
+        work = lambda: read_csv(os.path.join(workdir, "playlist.csv"))
+    elif stage == "analyze_mix":
+        from ai.analyze_json import analyze_mix
+        with open(os.path.join(workdir, "plan.json")) as f:
+            plan = f.read()
+        work = lambda: analyze_mix(json_str=plan)
+    elif stage == "split":
+        from features.audio_split import split_audio
+        work = lambda: [split_audio(path, start, end, output_dir=scratch, name=str(i))
+                        for i, (path, start, end) in enumerate(items)]
+    elif stage == "analysis":
+        from features.track_analysis import analyze_file
+        work = lambda: [analyze_file(path) for path, _, _ in items]
+    elif stage == "merge":
+        from features.audio_split import split_audio
+        from features.audio_merge import merge_audio
+        split_files = [split_audio(path, start, end, output_dir=scratch, name=str(i))
+                       for i, (path, start, end) in enumerate(items)]
+        work = lambda: merge_audio(split_files, output_dir=os.path.join(scratch, "output"))
+    elif stage == "pipeline":
+        from features import mix_pipeline
+
+        def download_fixture(url, name="", output_dir="temp/"):
+            # The "URL" is the fixture's path; copying it stands in for the download
+            with scratch_space.place(os.path.join(output_dir, f"{name}.m4a"), os.path.getsize(url)) as path:
+                shutil.copyfile(url, path)
+
+        mix_pipeline.download_audio = download_fixture
+        work = lambda: mix_pipeline.build_mix(
+            items, temp_dir=os.path.join(scratch, "temp"), temp_split_dir=os.path.join(scratch, "temp", "split"),
+            output_dir=os.path.join(scratch, "output"))
+    elif stage == "sessions":
+        from session_manager import SessionManager
+        manager = SessionManager(base_dir=os.path.join(scratch, "sessions"))
+        payload = os.urandom(256 * 1024)
+
+        def work():
+            for _ in range(20):
+                session_id = manager.create_session()
+                session_dir = manager.get_session_dir(session_id)
+                for sub in ("temp", "temp/split", "static/output"):
+                    for n in range(5):
+                        with open(os.path.join(session_dir, sub, f"{n}.bin"), "wb") as f:
+                            f.write(payload)
+                manager.clear_session_temp(session_id)
+                manager.clear_session_output(session_id)
+                manager.delete_session(session_id)
+    else:
+        raise ValueError(f"Unknown stage {stage!r}")
+
+    cpu_before = os.times()
+    started = time.perf_counter()
+    work()
+    wall = time.perf_counter() - started
+    cpu_after = os.times()
+    # Intermediates kept in memory outlive the temporary workdir otherwise
+    scratch_space.clear(scratch)
+
+    result = {
+        "wall_ms": round(wall * 1000, 1),
+        "cpu_ms": round((cpu_after.user + cpu_after.system - cpu_before.user - cpu_before.system) * 1000, 1),
+        "children_cpu_ms": round((cpu_after.children_user + cpu_after.children_system
+                                  - cpu_before.children_user - cpu_before.children_system) * 1000, 1),
+    }
+    if RESOURCE_AVAILABLE:
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 1)
+        result["children_peak_rss_mb"] = round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20, 1)
+    return result
+
+
+def measure(stage, args, workdir):
+    """Median of --repeats fresh-interpreter runs of one stage"""
+    runs = []
+    for _ in range(args.repeats):
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--workdir", workdir,
+             "--sources", str(args.sources), "--seconds", str(args.seconds), "--segment", str(args.segment)],
+            cwd=workdir, capture_output=True, text=True, timeout=1800,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"Stage {stage} failed:\n{process.stderr[-2000:]}")
+        # The result is the last line; stages print progress before it
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    return {metric: statistics.median(run[metric] for run in runs) for metric in runs[0]}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare stage results with a baseline.
+
+    Returns:
+        tuple: (comparison per stage and metric, list of regressions)
+    """
+    comparison = {}
+    regressions = []
+    for stage, metrics in results.items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        comparison[stage] = {}
+        for metric in GATED_METRICS:
+            if metric not in metrics or not before.get(metric):
+                continue
+            change = metrics[metric] / before[metric] - 1
+            comparison[stage][metric] = {"baseline": before[metric], "current": metrics[metric],
+                                         "change": round(change, 3)}
+            if change > tolerance:
+                regressions.append(f"{stage} {metric}: {before[metric]} -> {metrics[metric]} ({change:+.0%})")
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audio pipeline offline on synthetic audio")
+    parser.add_argument("--sources", type=int, default=6, help="Synthetic sources to mix")
+    parser.add_argument("--seconds", type=int, default=60, help="Length of each source")
+    parser.add_argument("--segment", type=int, default=12, help="Seconds cut from each source")
+    parser.add_argument("--csv-rows", type=int, default=20000, help="Rows in the playlist CSV")
+    parser.add_argument("--plan-songs", type=int, default=20000, help="Songs in the AI mix plan")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/growth over the baseline")
+    parser.add_argument("--save-baseline", help="Save these results as the baseline for later runs")
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        # Child process: run one stage and print its measurements
+        print(json.dumps(run_stage(args.run_stage, args.workdir, args.sources, args.seconds, args.segment)))
+        return
+
+    # Sessions, render caches and fixtures all live in a scratch directory
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        make_fixtures(workdir, args.sources, args.seconds, args.csv_rows, args.plan_songs)
+        fixtures_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        stages = {}
+        for stage in args.stages.split(","):
+            stages[stage] = measure(stage, args, workdir)
+            print(f"{stage}: {stages[stage]['wall_ms']}ms", file=sys.stderr)
+
+    results = {
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {"sources": args.sources, "seconds": args.seconds, "segment": args.segment,
+                   "csv_rows": args.csv_rows, "plan_songs": args.plan_songs},
+        "repeats": args.repeats,
+        "fixtures_ms": fixtures_ms,
+        "stages": stages,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline was recorded with a different configuration", file=sys.stderr)
+        results["comparison"], regressions = compare(stages, baseline, args.tolerance)
+        results["regressions"] = regressions
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(json.dumps({key: results[key] for key in ("python", "cpus", "config", "stages")}, indent=2) + "\n")
+
+    if regressions:
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
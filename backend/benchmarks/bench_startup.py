@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the IntelliMix backend.
+
+Measures, in fresh interpreters:
+- the cost of `import app` (and which modules dominate it)
+- the one-off import cost of each heavy dependency loaded lazily
+- time until /api/health answers, and until the background pre-warm is done
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--output startup.json] [--budget-ms 500]
+
+Exits with status 1 if the median `import app` time exceeds --budget-ms.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from warmup import HEAVY_MODULES
+
+
+def run_python(code, cwd, env=None):
+    """Run code in a fresh interpreter with -X importtime and return its stderr"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{result.stderr[-2000:]}")
+    return result.stderr
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative_us} from -X importtime output"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self_us | cumulative_us | <indent>module"
+        _, cumulative_us, name = line.split("|")
+        cumulative[name.strip()] = int(cumulative_us.strip())
+    return cumulative
+
+
+def make_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def bench_import_app(runs, workdir):
+    """Time `import app` with pre-warm disabled so only eager imports count"""
+    env = make_env()
+    env["INTELLIMIX_PREWARM"] = "0"
+    timings = []
+    top_modules = {}
+    for _ in range(runs):
+        cumulative = parse_importtime(run_python("import app", workdir, env))
+        timings.append(cumulative["app"] / 1000)
+        top_modules = cumulative
+    # Direct children of app dominate; report the ten most expensive modules
+    heaviest = sorted(
+        ((name, us / 1000) for name, us in top_modules.items() if name != "app"),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:10]
+    return {
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "max_ms": round(max(timings), 1),
+        "heaviest_modules_ms": {name: round(ms, 1) for name, ms in heaviest},
+    }
+
+
+def bench_heavy_modules(workdir):
+    """One-off cost of each lazily imported dependency"""
+    env = make_env()
+    costs = {}
+    for name in HEAVY_MODULES:
+        try:
+            cumulative = parse_importtime(run_python(f"import {name}", workdir, env))
+            costs[name] = round(cumulative[name] / 1000, 1)
+        except Exception as e:
+            costs[name] = f"failed: {str(e).splitlines()[0]}"
+    return costs
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_health(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def bench_time_to_ready(workdir, timeout=60):
+    """Start the server and time the readiness probe and the pre-warm"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "server.py"), "--port", str(port)],
+        cwd=workdir,
+        env=make_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    ready_ms = warm_ms = None
+    try:
+        while time.perf_counter() - started < timeout:
+            health = get_health(url)
+            if health is not None:
+                if ready_ms is None:
+                    ready_ms = round((time.perf_counter() - started) * 1000, 1)
+                if health.get("warm"):
+                    warm_ms = round((time.perf_counter() - started) * 1000, 1)
+                    break
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {"ready_ms": ready_ms, "warm_ms": warm_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IntelliMix backend startup")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters for `import app`")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--budget-ms", type=float, help="Fail if median `import app` exceeds this")
+    args = parser.parse_args()
+
+    # Run in a scratch directory so the server's session cleanup never touches real sessions
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {
+            "python": sys.version.split()[0],
+            "import_app": bench_import_app(args.runs, workdir),
+            "heavy_modules_ms": bench_heavy_modules(workdir),
+            "server": bench_time_to_ready(workdir),
+        }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.budget_ms is not None and results["import_app"]["median_ms"] > args.budget_ms:
+        print(f"FAIL: import app took {results['import_app']['median_ms']}ms (budget {args.budget_ms}ms)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Connection reuse benchmark for the pooled HTTP transport.
+
+Runs the same fetch pattern as a many-track mix against a local HTTP/1.1
+server: per track, a few small metadata requests followed by the media in
+ranged chunks, with several tracks downloading at once. It's run once with
+urllib's default opener (a new connection per request) and once with the
+transport's keep-alive handlers, and reports wall time, connections the
+server accepted, the client-side reuse rate and DNS cache hits.
+
+Usage:
+    python benchmarks/bench_transport.py [--tracks 24] [--threads 4] [--chunks 8] [--output transport.json]
+"""
+import argparse
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from transport import ConnectionPool, handlers
+
+CHUNK_SIZE = 64 * 1024
+METADATA_REQUESTS = 3  # watch page, player, innertube call
+METADATA_BODY = json.dumps({"streamingData": {"formats": ["x" * 64] * 64}}).encode()
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus the
+    # client's delayed ACK stalls every response on a reused connection
+    disable_nagle_algorithm = True
+    media = os.urandom(CHUNK_SIZE)
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        body = self.media if self.path.startswith("/videoplayback") else METADATA_BODY
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fetch_track(opener, base_url, track, chunks):
+    """Metadata requests then ranged media chunks, like one pytubefix download"""
+    for i in range(METADATA_REQUESTS):
+        data = b'{"videoId": "x"}' if i == METADATA_REQUESTS - 1 else None
+        with opener.open(f"{base_url}/watch?v={track}&n={i}", data=data, timeout=30) as response:
+            response.read()
+    received = 0
+    for chunk in range(chunks):
+        url = f"{base_url}/videoplayback?id={track}&range={chunk * CHUNK_SIZE}-{(chunk + 1) * CHUNK_SIZE - 1}"
+        with opener.open(url, timeout=30) as response:
+            received += len(response.read())
+    return received
+
+
+def run(name, opener, base_url, server, tracks, threads, chunks, pool=None):
+    server.connections = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        received = sum(executor.map(lambda t: fetch_track(opener, base_url, t, chunks), range(tracks)))
+    wall = time.perf_counter() - started
+    requests = tracks * (METADATA_REQUESTS + chunks)
+    result = {
+        "wall_ms": round(wall * 1000, 1),
+        "requests": requests,
+        "server_connections": server.connections,
+        "requests_per_connection": round(requests / max(server.connections, 1), 1),
+        "megabytes": round(received / 2 ** 20, 1),
+    }
+    if pool is not None:
+        result["client"] = pool.stats()
+    print(f"{name}: {result['wall_ms']}ms, {server.connections} connections for {requests} requests")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark connection reuse of the pooled HTTP transport")
+    parser.add_argument("--tracks", type=int, default=24, help="Tracks to fetch")
+    parser.add_argument("--threads", type=int, default=4, help="Tracks fetched at once")
+    parser.add_argument("--chunks", type=int, default=8, help="Ranged media requests per track")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    server = start_server()
+    # "localhost" so every new connection needs a name lookup
+    base_url = f"http://localhost:{server.server_address[1]}"
+    try:
+        baseline = run("urllib default", urllib.request.build_opener(), base_url, server,
+                       args.tracks, args.threads, args.chunks)
+        pool = ConnectionPool()
+        pooled = run("pooled transport", urllib.request.build_opener(*handlers(pool)), base_url, server,
+                     args.tracks, args.threads, args.chunks, pool=pool)
+        pool.close()
+    finally:
+        server.shutdown()
+
+    results = {
+        "python": sys.version.split()[0],
+        "tracks": args.tracks,
+        "threads": args.threads,
+        "chunks": args.chunks,
+        "baseline": baseline,
+        "pooled": pooled,
+        "speedup": round(baseline["wall_ms"] / pooled["wall_ms"], 2) if pooled["wall_ms"] else None,
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
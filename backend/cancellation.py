@@ -0,0 +1,370 @@
+"""
+Cooperative cancellation of in-flight jobs.
+
+Each mix, AI generation or download runs under a CancelToken. The token
+follows the work through contextvars (like scheduled_job), so the
+downloaders, split, merge and mux stages find it without it being passed
+around. A token is cancelled when:
+
+- the same session starts a new job (supersede)
+- the session calls POST /api/cancel
+- the client that started the job disconnects
+
+On cancellation, registered callbacks kill the job's ffmpeg processes
+right away. Downloads stop at their next chunk and every stage removes its
+partial output before raising Cancelled. The next job of a superseded
+session waits for that cleanup before it clears the session's files.
+
+With several server processes, a session's requests can land on different
+workers. Running jobs are then also recorded in the shared session registry
+(JobRegistry.shared): each job polls its row there, so a supersede or a
+cancel from any worker reaches it within JOB_POLL_SECONDS, and a new job
+waits for the rows of the jobs it replaced to go away.
+"""
+import contextvars
+import os
+import select
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# How long a new job waits for the job it superseded to clean up
+SUPERSEDE_TIMEOUT = float(os.environ.get("INTELLIMIX_SUPERSEDE_TIMEOUT", 10))
+# How often the client's connection is checked while its job runs
+DISCONNECT_POLL_SECONDS = 1
+# How often a job checks the shared registry for a cancel from another worker
+JOB_POLL_SECONDS = 1
+
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class Cancelled(Exception):
+    """Raised by work whose job was cancelled"""
+
+    def __init__(self, token):
+        super().__init__(f"Job cancelled: {token.reason}")
+        self.token = token
+
+
+class CancelToken:
+    """Cancellation flag for one job, with callbacks run when it's cancelled"""
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.job_id = uuid.uuid4().hex
+        self.reason = None
+        self.finished = threading.Event()  # Set once the job has cleaned up and returned
+        self._cancelled = threading.Event()
+        self._callbacks = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancel the job and run its callbacks.
+
+        Returns:
+            bool: False if it was already cancelled
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self.reason = reason
+            self._cancelled.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        print(f"Cancelling job for session {self.session_id}: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+        return True
+
+    def check(self):
+        """Raise Cancelled if the job was cancelled"""
+        if self._cancelled.is_set():
+            raise Cancelled(self)
+
+    def on_cancel(self, callback):
+        """
+        Run callback when the job is cancelled (right away if it already was).
+
+        Returns:
+            callable: Unregisters the callback
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._callbacks.pop(callback_id, None)
+        callback()
+        return lambda: None
+
+
+def current_token():
+    """Token of the job running in this context, or None outside a job"""
+    return _current_token.get()
+
+
+def check_cancelled():
+    """Raise Cancelled if the current job was cancelled"""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def is_cancelled():
+    """Whether the current job was cancelled (for pytubefix's interrupt_checker)"""
+    token = _current_token.get()
+    return token is not None and token.cancelled
+
+
+@contextmanager
+def cancel_scope(token):
+    """Run the enclosed block, and everything it starts, under token"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+@contextmanager
+def kill_on_cancel(process):
+    """Kill a child process if the current job is cancelled while the block runs"""
+    token = _current_token.get()
+    if token is None:
+        yield
+        return
+
+    def kill():
+        try:
+            process.kill()
+        except OSError:
+            pass  # Already exited
+
+    unregister = token.on_cancel(kill)
+    try:
+        yield
+    finally:
+        unregister()
+
+
+@contextmanager
+def removed_on_failure(*paths):
+    """Delete the block's partial output files if it raises (including on cancellation)"""
+    try:
+        yield
+    except BaseException:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+
+
+def run_process(command):
+    """
+    Run a command (ffmpeg) to completion, killing it if the job is cancelled.
+
+    Returns:
+        bytes: Its stdout
+
+    Raises:
+        Cancelled: If the job was cancelled while it ran
+        RuntimeError: If it exited with an error
+    """
+    check_cancelled()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with kill_on_cancel(process):
+        stdout, stderr = process.communicate()
+    check_cancelled()
+    if process.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(command[0])} failed: {stderr.decode(errors='replace')}")
+    return stdout
+
+
+def stream_process(command, on_output, chunk_size=1 << 16):
+    """
+    Run a command (ffmpeg), handing its stdout to on_output chunk by chunk.
+
+    Like run_process, but the output is never held in memory as a whole.
+
+    Raises:
+        Cancelled: If the job was cancelled while it ran
+        RuntimeError: If it exited with an error
+    """
+    check_cancelled()
+    # stderr goes to a file so a chatty process can't block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        with kill_on_cancel(process):
+            try:
+                for chunk in iter(lambda: process.stdout.read(chunk_size), b""):
+                    on_output(chunk)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                process.wait()
+        check_cancelled()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"{os.path.basename(command[0])} failed: {stderr.read().decode(errors='replace')}")
+
+
+def _client_disconnected(environ):
+    """A check for whether the request's client went away, or None if the server can't tell"""
+    # waitress (with channel_request_lookahead) reports it directly
+    check = environ.get("waitress.client_disconnected")
+    if check is not None:
+        return check
+
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+
+    def closed():
+        readable, _, _ = select.select([sock], [], [], 0)
+        # Readable with nothing to read means the peer closed its end; a
+        # pipelined next request would show up as data instead
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    return closed
+
+
+class JobRegistry:
+    """
+    The running job of each session, so it can be superseded or cancelled.
+
+    Args:
+        supersede_timeout (float): Longest a new job waits for the job it replaced to clean up
+        shared (SessionManager, optional): Registry every worker process sees; without it
+            only jobs in this process can be superseded or cancelled
+    """
+
+    def __init__(self, supersede_timeout=SUPERSEDE_TIMEOUT, shared=None):
+        self.supersede_timeout = supersede_timeout
+        self.shared = shared
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.cancelled = 0
+
+    @contextmanager
+    def job(self, session_id, environ=None):
+        """
+        Run the enclosed block as the session's job, cancelling the one it replaces.
+
+        Args:
+            session_id (str): Session the job belongs to
+            environ (dict, optional): WSGI environ of the request; the job is
+                cancelled if that client disconnects
+
+        Yields:
+            CancelToken
+        """
+        token = CancelToken(session_id)
+        with self._lock:
+            previous = self._tokens.get(session_id)
+            self._tokens[session_id] = token
+        # Jobs of the session in other workers see this at their next poll
+        superseded = self.shared.start_job(session_id, token.job_id) if self.shared is not None else []
+        elsewhere = [job_id for job_id in superseded if previous is None or job_id != previous.job_id]
+        if elsewhere:
+            with self._lock:
+                self.cancelled += len(elsewhere)
+        deadline = time.monotonic() + self.supersede_timeout
+        # Let them kill their processes and remove partial files before this
+        # job starts clearing the session's directories
+        if previous is not None:
+            self._cancel(previous, "superseded by a newer request")
+            if not previous.finished.wait(self.supersede_timeout):
+                print(f"Superseded job for session {session_id} is still cleaning up")
+        while elsewhere and self.shared.running_jobs(elsewhere):
+            if time.monotonic() >= deadline:
+                print(f"Superseded job for session {session_id} in another worker is still cleaning up")
+                break
+            time.sleep(JOB_POLL_SECONDS / 4)
+
+        self._watch(token, environ)
+        try:
+            with cancel_scope(token):
+                yield token
+        finally:
+            token.finished.set()
+            with self._lock:
+                if self._tokens.get(session_id) is token:
+                    del self._tokens[session_id]
+            if self.shared is not None:
+                self.shared.finish_job(token.job_id)
+
+    def cancel(self, session_id, reason="cancelled by the user"):
+        """
+        Cancel the session's running job, in whichever worker it runs.
+
+        Returns:
+            bool: False if the session has no job running
+        """
+        with self._lock:
+            token = self._tokens.get(session_id)
+        cancelled = token is not None and self._cancel(token, reason)
+        if self.shared is not None and self.shared.cancel_jobs(session_id, reason):
+            if not cancelled:
+                # Running in another worker, which stops it at its next poll
+                with self._lock:
+                    self.cancelled += 1
+            cancelled = True
+        return cancelled
+
+    def _cancel(self, token, reason):
+        if not token.cancel(reason):
+            return False
+        with self._lock:
+            self.cancelled += 1
+        return True
+
+    def _watch(self, token, environ):
+        """Cancel the job when its client disconnects or another worker cancels it"""
+        disconnected = _client_disconnected(environ) if environ is not None else None
+        if disconnected is None and self.shared is None:
+            return
+
+        def watch():
+            nonlocal disconnected
+            while not token.finished.wait(min(DISCONNECT_POLL_SECONDS, JOB_POLL_SECONDS)):
+                if disconnected is not None:
+                    try:
+                        if disconnected():
+                            self._cancel(token, "client disconnected")
+                            return
+                    except (OSError, ValueError):
+                        disconnected = None  # Socket closed under us; the response can't be sent anyway
+                if self.shared is not None:
+                    try:
+                        reason = self.shared.job_cancel_reason(token.job_id)
+                    except Exception as e:
+                        print(f"Checking job {token.job_id} for cancellation failed: {e}")
+                        continue
+                    if reason is not None:
+                        self._cancel(token, reason)
+                        return
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {"running": len(self._tokens), "cancelled": self.cancelled}
+
+
+jobs = JobRegistry()
@@ -1,9 +1,12 @@
+import argparse
 import threading
 import time
+import urllib.request
 import webbrowser
 import os
 import sys
 from app import app
+from server import ThreadedServer, add_arguments, config_from_args, get_config, serve
 
 # Import webview with fallback handling
 try:
@@ -14,8 +17,34 @@ except ImportError as e:
     WEBVIEW_AVAILABLE = False
 
 # --- Run Flask in background ---
-def start_flask():
-    app.run(host="127.0.0.1", port=5000, debug=False, use_reloader=False)
+def start_flask(config):
+    server = ThreadedServer(
+        app,
+        host=config["host"],
+        port=config["port"],
+        threads=config["threads"],
+        keepalive=config["keepalive"],
+        graceful_timeout=config["graceful_timeout"],
+    )
+    flask_thread = threading.Thread(target=server.serve_forever)
+    flask_thread.daemon = True
+    flask_thread.start()
+    return server
+
+
+# --- Wait for the server's readiness probe ---
+def wait_until_ready(app_url, timeout=30):
+    """Poll /api/health until the server answers; returns False on timeout"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{app_url}/api/health", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.05)
+    return False
 
 
 # --- Intercept navigation to handle downloads ---
@@ -28,13 +57,30 @@ def on_navigate(url):
 
 
 if __name__ == "__main__":
+    parser = add_arguments(argparse.ArgumentParser(description="IntelliMix Desktop"))
+    parser.add_argument("--headless", action="store_true", help="Serve the app without opening a window or browser")
+    args = parser.parse_args()
+    if args.workers is not None and args.workers > 1 and not args.headless:
+        parser.error("--workers only applies with --headless; the desktop window is served by a single process")
+
+    if args.headless:
+        # Server mode: production serving in the foreground, no GUI
+        serve(app, **config_from_args(args))
+        sys.exit(0)
+
+    config = get_config(**config_from_args(args))
+    if config["workers"] > 1:
+        print(f"Warning: ignoring INTELLIMIX_WORKERS={config['workers']}, the desktop window is served by a single process")
+        # This process gets the whole machine's transcode slots
+        os.environ["INTELLIMIX_WORKERS"] = "1"
+    app_url = f"http://{config['host']}:{config['port']}"
+
     # Start Flask in a background thread
-    flask_thread = threading.Thread(target=start_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
+    server = start_flask(config)
 
-    # Give Flask time to start
-    time.sleep(2)
+    # Open the window as soon as the server is ready
+    if not wait_until_ready(app_url):
+        print("Warning: server did not report ready within 30 seconds")
 
     if WEBVIEW_AVAILABLE:
         try:
@@ -43,7 +89,7 @@ if __name__ == "__main__":
             # Create window
             window = webview.create_window(
                 title="IntelliMix Desktop",
-                url="http://127.0.0.1:5000",
+                url=app_url,
                 width=1200,
                 height=800,
                 resizable=True,
@@ -58,6 +104,9 @@ if __name__ == "__main__":
 
             # Run GUI loop
             webview.start(debug=False)
+
+            # Window closed, let running jobs finish before exiting
+            server.shutdown()
             
         except Exception as e:
             print(f"Error starting desktop GUI: {e}")
@@ -67,12 +116,12 @@ if __name__ == "__main__":
     if not WEBVIEW_AVAILABLE:
         print("=== IntelliMix Web Mode ===")
         print("Desktop GUI not available, running in web browser mode")
-        print("Open your browser and go to: http://127.0.0.1:5000")
+        print(f"Open your browser and go to: {app_url}")
         print("Press Ctrl+C to stop the server")
         
         # Optionally try to open browser automatically
         try:
-            webbrowser.open("http://127.0.0.1:5000")
+            webbrowser.open(app_url)
         except Exception:
             pass
         
@@ -82,4 +131,5 @@ if __name__ == "__main__":
                 time.sleep(1)
         except KeyboardInterrupt:
             print("\nApplication stopped by user")
+            server.shutdown()
             sys.exit(0)
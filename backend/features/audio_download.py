@@ -1,17 +1,27 @@
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
-
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from proxies import proxies
+from manifest_cache import manifest_cache
+from proxy_pool import proxy_pool
+from scheduler import download_scheduler
+from scratch import scratch
 
 def download_audio(url, name="", output_dir="temp/"):
-    yt = YouTube(url, proxies=proxies, on_progress_callback=on_progress)
-    print(yt.title)
-    if name == "":
-        name = yt.title
+    # pytubefix is imported on first use to keep app startup fast
+    from pytubefix.cli import on_progress
+
+    # Wait for a download slot before leasing a proxy, so queued jobs don't
+    # hold proxies; metadata and media then go out through that one proxy
+    with download_scheduler.slot("download"), proxy_pool.lease():
+        # Reuses the stream manifest if this video was resolved recently
+        manifest = manifest_cache.get(url)
+        print(manifest.title)
+        if name == "":
+            name = manifest.title
 
-    ys = yt.streams.get_audio_only()
-    ys.download(output_path=output_dir,filename=f"{name}.m4a")
-    return yt.title
\ No newline at end of file
+        ys = manifest.streams.get_audio_only()
+        # Kept in memory while there's room; scratch.locate finds it either way
+        with scratch.place(os.path.join(output_dir, f"{name}.m4a"), ys.filesize) as path:
+            manifest.download(ys, output_path=os.path.dirname(path), filename=os.path.basename(path),
+                              on_progress=on_progress)
+    return manifest.title
\ No newline at end of file
@@ -1,35 +1,244 @@
-from pydub import AudioSegment
+import subprocess
 import time
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import check_cancelled, current_token
+from features.waveform import PeakBuilder
+from metrics import STAGE_SECONDS, stage
+from scheduler import transcode_scheduler
 
-def merge_audio(list_of_audio_files, crossfade_duration=3000, output_dir="static/output"):
+# ffmpeg raw PCM formats by pydub sample width
+PCM_FORMATS = {1: "u8", 2: "s16le", 4: "s32le"}
+
+# Without the bit reservoir every MP3 frame holds all of its own audio data,
+# so a finished mix can be re-encoded in place around an edit (see
+# incremental_render.py). The Xing header is left out because its frame
+# count would go stale after such a splice.
+MP3_OPTIONS = ["-reservoir", "0", "-write_xing", "0"]
+
+# Formats a mix can be written in: file extension and ffmpeg output options.
+# The MP3 is the mix itself (cached, re-rendered in place, drawn as a
+# waveform); the others are copies encoded from the same PCM beside it
+OUTPUT_FORMATS = {
+    "mp3": {"extension": "mp3", "options": [*MP3_OPTIONS, "-f", "mp3"]},
+    "flac": {"extension": "flac", "options": ["-c:a", "flac", "-f", "flac"]},
+    # Opus only takes 48kHz (and a few lower rates)
+    "opus": {"extension": "opus", "options": ["-c:a", "libopus", "-b:a", "160k", "-ar", "48000", "-f", "ogg"]},
+    "m4a": {"extension": "m4a", "options": ["-c:a", "aac", "-b:a", "256k", "-f", "ipod"]},
+}
+
+# Crossfade between segments of a mix, in milliseconds
+CROSSFADE_MS = 3000
+# Everything about the encode that changes a mix's bytes (part of its cache key)
+ENCODE_PROFILE = {"format": "mp3", "options": MP3_OPTIONS}
+
+
+class PcmEncoder:
+    """
+    Feed raw PCM to an ffmpeg encoder as it's produced.
+
+    The encoder is killed if the current job is cancelled; writing to it
+    then fails, and abort() removes the partial output.
+    """
+
+    def __init__(self, output_file, frame_rate, channels, sample_width, format="mp3"):
+        from pydub import AudioSegment
+
+        self.output_file = output_file
+        self.started = time.perf_counter()
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-f", PCM_FORMATS[sample_width], "-ar", str(frame_rate), "-ac", str(channels),
+            "-i", "pipe:0",
+            *OUTPUT_FORMATS[format]["options"], output_file,
+        ]
+        check_cancelled()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        token = current_token()
+        self._stop_watching = token.on_cancel(self.process.kill) if token is not None else (lambda: None)
+
+    def write(self, audio):
+        self.process.stdin.write(audio.raw_data)
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        self._stop_watching()
+        if self.process.wait() != 0:
+            check_cancelled()
+            raise RuntimeError(f"Encoding {self.output_file} failed: {stderr.decode(errors='replace')}")
+        # Encoding overlaps the decoding and mixing that feed it
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, stage="encode")
+
+    def abort(self):
+        """Stop the encoder and remove what it wrote"""
+        self._stop_watching()
+        self.process.kill()
+        self.process.wait()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+def crossfade_frames(crossfade_duration, frame_rate):
+    """Crossfade length in sample frames for a duration in milliseconds"""
+    return int(crossfade_duration * frame_rate / 1000)
+
+
+def conform(audio, like):
+    """Convert audio to the frame rate, channels and sample width of another segment"""
+    return (audio.set_frame_rate(like.frame_rate)
+                 .set_channels(like.channels)
+                 .set_sample_width(like.sample_width))
+
+
+def _ramp(audio, rising):
+    """Linear gain ramp over a whole segment, applied in ~1ms blocks"""
+    from pydub.utils import audioop
+
+    frames = int(audio.frame_count())
+    width = audio.frame_width
+    data = audio.raw_data
+    block = max(1, audio.frame_rate // 1000)
+    chunks = []
+    for start in range(0, frames, block):
+        progress = min(start + block / 2, frames) / frames
+        chunks.append(audioop.mul(data[start * width:(start + block) * width], audio.sample_width,
+                                  progress if rising else 1 - progress))
+    return b"".join(chunks)
+
+
+def crossfade_join(pending, audio, crossfade):
+    """
+    Crossfade the end of pending into the start of audio, sample-exactly.
+
+    Args:
+        pending (AudioSegment): Mixed audio not yet written
+        audio (AudioSegment): Next segment, already in pending's format
+        crossfade (int): Overlap in sample frames, at most the length of either
+
+    Returns:
+        tuple: (done, pending) - the part of pending before the overlap, which
+        is final, and the overlap followed by the rest of audio
+    """
+    from pydub.utils import audioop
+
+    total = int(pending.frame_count())
+    done = pending.get_sample_slice(0, total - crossfade)
+    if crossfade == 0:
+        return done, audio
+    fade_out = _ramp(pending.get_sample_slice(total - crossfade, total), rising=False)
+    fade_in = _ramp(audio.get_sample_slice(0, crossfade), rising=True)
+    overlap = audioop.add(fade_out, fade_in, pending.sample_width)
+    return done, audio._spawn(overlap + audio.get_sample_slice(crossfade, None).raw_data)
+
+
+def format_path(output_file, format):
+    """Path of a mix's copy in another output format, beside its MP3"""
+    return f"{os.path.splitext(output_file)[0]}.{OUTPUT_FORMATS[format]['extension']}"
+
+
+def validate_formats(formats):
+    """
+    Check requested output formats.
+
+    Returns:
+        list: The formats, MP3 first and without repeats
+
+    Raises:
+        ValueError: If a format isn't one of OUTPUT_FORMATS
+    """
+    unknown = [f for f in formats if f not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output format {unknown[0]!r}, expected one of {', '.join(OUTPUT_FORMATS)}")
+    return ["mp3"] + [f for f in dict.fromkeys(formats) if f != "mp3"]
+
+
+def merge_audio(list_of_audio_files, crossfade_duration=CROSSFADE_MS, output_dir="static/output", manifest=None,
+                formats=("mp3",)):
+    """
+    Merge audio files into one MP3 with a crossfade between each pair.
+
+    Args:
+        list_of_audio_files (iterable): Segment files in play order
+        crossfade_duration (int): Crossfade in milliseconds
+        output_dir (str): Directory for the merged mix
+        manifest (RenderManifest, optional): Records the layout of the mix so a
+            later edit can be re-rendered incrementally
+        formats (list): Output formats; every one is encoded from the same
+            mixed PCM in one pass, the others beside the MP3 (see format_path)
+
+    Returns:
+        str: Path of the merged MP3
+    """
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Load the audio files
-    audio_files = []
-    for audio_file in list_of_audio_files:
-        audio_files.append(AudioSegment.from_file(audio_file, format="mp3"))
-    
+
     # Check if we have files to merge
-    if not audio_files:
+    if not list_of_audio_files:
         print("No audio files to merge.")
         return
-    
-    # Start with the first audio file
-    combined_audio = audio_files[0]
-    
-    # Append the rest with crossfade
-    for audio in audio_files[1:]:
-        combined_audio = combined_audio.append(audio, crossfade=crossfade_duration)
-    
+
     # Generate output filename with timestamp
     output_filename = f"combined_audio_{int(time.time())}.mp3"
     output_file = os.path.join(output_dir, output_filename)
-    
-    # Save the combined audio
-    combined_audio.export(output_file, format="mp3")
+
+    # pydub is imported on first use to keep app startup fast
+    from pydub import AudioSegment
+
+    # Decoding and the final encode run ffmpeg, so wait for a transcode slot
+    with transcode_scheduler.slot("merge"), stage("merge"):
+        # Segments are loaded one at a time and everything before the last
+        # crossfade window goes straight to the encoder, so memory stays flat
+        # however many files are merged
+        encoders = []  # One per format, all fed the same PCM
+        peaks = None  # Waveform of the mix, from the same PCM the encoders get
+        pending = None  # Mixed audio not yet written; always ends with a full segment
+        written = 0  # Sample frames sent to the encoder so far
+        try:
+            for audio_file in list_of_audio_files:
+                check_cancelled()
+                audio = AudioSegment.from_file(audio_file, format="mp3")
+
+                if pending is None:
+                    # The first segment fixes the output format
+                    pending = audio
+                    for format in validate_formats(formats):
+                        encoders.append(PcmEncoder(format_path(output_file, format), audio.frame_rate,
+                                                   audio.channels, audio.sample_width, format))
+                    peaks = PeakBuilder(audio.frame_rate, audio.channels, audio.sample_width)
+                    if manifest is not None:
+                        manifest.start(audio, crossfade_duration)
+                        manifest.add_segment(audio_file, audio)
+                    continue
+
+                audio = conform(audio, pending)
+                crossfade = min(crossfade_frames(crossfade_duration, pending.frame_rate),
+                                int(pending.frame_count()), int(audio.frame_count()))
+                if manifest is not None:
+                    manifest.add_segment(audio_file, audio, pending=pending, pending_start=written)
+                done, pending = crossfade_join(pending, audio, crossfade)
+                for encoder in encoders:
+                    encoder.write(done)
+                peaks.write(done.raw_data)
+                written += int(done.frame_count())
+
+            for encoder in encoders:
+                encoder.write(pending)
+            peaks.write(pending.raw_data)
+            written += int(pending.frame_count())
+            for encoder in encoders:
+                encoder.close()
+            peaks.save(output_file)
+        except Exception:
+            for encoder in encoders:
+                encoder.abort()
+            # A cancelled job kills the encoder, which surfaces here as a broken pipe
+            check_cancelled()
+            raise
+    if manifest is not None:
+        manifest.finish(output_file, written)
     print(f"Audio combined successfully with {crossfade_duration//1000} second crossfade!")
     print(f"Output saved to: {output_file}")
-    
-    return output_file
\ No newline at end of file
+
+    return output_file
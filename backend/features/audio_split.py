@@ -1,26 +1,47 @@
-from pydub import AudioSegment
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import removed_on_failure, run_process, stream_process
+from features.waveform import DECODE_OUTPUT, PeakBuilder, WavStream
+from metrics import stage
+from scheduler import transcode_scheduler
+from scratch import scratch
 
-def split_audio(audio_file, start_time, end_time, output_dir="temp/split"):
+# ffmpeg's default MP3 bitrate, for sizing the output before it's written
+MP3_BYTES_PER_SECOND = 128000 // 8
+
+def split_audio(audio_file, start_time, end_time, output_dir="temp/split", name=None, peaks_file=None, gain_db=0):
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Load audio file (MP3 or WAV)
-    audio = AudioSegment.from_file(audio_file, format="m4a")
-
-    # Define start and end times in milliseconds
-    start_time = start_time * 1000
-    end_time = end_time * 1000
+    # Get base filename without directory part, unless a name was given
+    base_filename = f"{name}.mp3" if name else os.path.basename(audio_file).replace(".m4a", ".mp3")
+    home_file = os.path.join(output_dir, base_filename)
 
-    # Extract segment
-    split_audio = audio[start_time:end_time]
+    # pydub is imported on first use to keep app startup fast; it knows where ffmpeg is
+    from pydub import AudioSegment
 
-    # Get base filename without directory part
-    base_filename = os.path.basename(audio_file).replace(".m4a", ".mp3")
-    output_file = os.path.join(output_dir, base_filename)
-    
-    # Save the split audio as MP3
-    split_audio.export(output_file, format="mp3")
+    # Segments are intermediates, kept in memory while there's room. Decode
+    # and encode run ffmpeg, so wait for a transcode slot
+    expected_bytes = (end_time - start_time) * MP3_BYTES_PER_SECOND
+    with scratch.place(home_file, expected_bytes) as output_file, transcode_scheduler.slot("split"), stage("split"):
+        # Cut and encode the segment as MP3 in one ffmpeg run, which is killed
+        # (and its partial output removed) if the job is cancelled
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-i", audio_file, "-ss", str(start_time), "-t", str(end_time - start_time),
+            *(["-af", f"volume={gain_db}dB"] if gain_db else []),
+            "-vn", "-f", "mp3", output_file,
+        ]
+        with removed_on_failure(output_file):
+            if peaks_file is None:
+                run_process(command)
+            else:
+                # The same decode also runs to the end of the source for its waveform peaks
+                stream = WavStream(PeakBuilder)
+                stream_process(command + DECODE_OUTPUT, stream.write)
+                peaks, = stream.finished_sinks(audio_file)
+                peaks.save(audio_file, peaks_file)
     print(f"Audio split and converted to {output_file} successfully!")
     
     return output_file
\ No newline at end of file
@@ -1,14 +1,13 @@
 import os
-import moviepy.editor
-from pytubefix import YouTube
-from tqdm import tqdm
 import re
 import uuid
-
-import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from proxies import proxies
+from cancellation import Cancelled
+from manifest_cache import manifest_cache
+from proxy_pool import proxy_pool
+from scheduler import SchedulerBusy, download_scheduler
+from features.stream_policy import StreamPolicy, StreamRejected, select_streams
 
 def sanitize_filename(filename):
     """Sanitize the filename to remove characters that might cause issues."""
@@ -20,45 +19,67 @@ def sanitize_filename(filename):
         sanitized = name[:100] + ext
     return sanitized
 
-def download_highest_quality_audio(url, path):
+def download_highest_quality_audio(url, path, policy=None):
+    """
+    Download the best audio stream within a policy.
+
+    Args:
+        url (str): The video
+        path (str): Directory for the download
+        policy (dict, optional): Overrides of the default stream policy (see StreamPolicy.from_dict)
+
+    Returns:
+        str: Path of the audio relative to the session, or None if it failed
+
+    Raises:
+        StreamRejected: If no stream fits the policy; nothing is downloaded
+    """
+    # Heavy dependencies are imported on first use to keep app startup fast
+    from tqdm import tqdm
+
     try:
         def progress_callback(stream, data_chunk, bytes_remaining):
             pbar.update(len(data_chunk) // 10 ** 6)
             
-        yt = YouTube(url,proxies=proxies)
-        yt.register_on_progress_callback(progress_callback)
-        streams = yt.streams
+        # Wait for a download slot before leasing a proxy, so queued jobs don't
+        # hold proxies; metadata and media then go out through that one proxy
+        with download_scheduler.slot("download"), proxy_pool.lease():
+            # Reuses the stream manifest if this video was resolved recently
+            manifest = manifest_cache.get(url)
 
-        # Get the highest bitrate audio stream (mp4 format)
-        audio_stream = streams.filter(progressive=False, type="audio", file_extension="mp4")
-        audio_stream = audio_stream.order_by("abr").desc().first()
+            # The best audio stream within the policy's codec and size limits
+            selection = select_streams(manifest, StreamPolicy.from_dict(policy), video=False)
+            audio_stream = selection.audio
         
-        # Generate safer filenames
-        video_title = sanitize_filename(yt.title)
-        unique_id = str(uuid.uuid4())[:8]  # Add a unique ID to avoid conflicts
+            # Generate safer filenames
+            video_title = sanitize_filename(manifest.title)
+            unique_id = str(uuid.uuid4())[:8]  # Add a unique ID to avoid conflicts
         
-        # Create a sanitized filename
-        audio_filename = f"{video_title}-{audio_stream.abr}.mp4"
-        final_filename = sanitize_filename(audio_filename)
+            # Create a sanitized filename
+            audio_filename = f"{video_title}-{audio_stream.abr}.{audio_stream.subtype}"
+            final_filename = sanitize_filename(audio_filename)
         
-        # Ensure the directory exists
-        os.makedirs(path, exist_ok=True)
+            # Ensure the directory exists
+            os.makedirs(path, exist_ok=True)
 
-        # Check if the file already exists
-        if final_filename in os.listdir(path):
-            print(f"Already available: {final_filename}")
-            return f"static/audio_dl/{final_filename}"
+            # Check if the file already exists
+            if final_filename in os.listdir(path):
+                print(f"Already available: {final_filename}")
+                return f"static/audio_dl/{final_filename}"
 
-        print(f"Downloading: {video_title} ({audio_stream.abr})")
-        pbar = tqdm(total=audio_stream.filesize // 10 ** 6, unit="MB")
+            print(f"Downloading: {video_title} ({audio_stream.abr})")
+            pbar = tqdm(total=selection.estimated_bytes // 10 ** 6, unit="MB")
 
-        # Download audio stream
-        audio_stream.download(output_path=path, filename=final_filename)
+            # Download audio stream
+            manifest.download(audio_stream, output_path=path, filename=final_filename, on_progress=progress_callback)
         pbar.close()
 
         print(f"Downloaded: {final_filename}")
         return f"static/audio_dl/{final_filename}"
 
+    except (SchedulerBusy, Cancelled, StreamRejected):
+        # Let the API turn backpressure into a 503 and report cancellations and rejections
+        raise
     except Exception as e:
         print(f"Error occurred: {e}")
         return None
\ No newline at end of file
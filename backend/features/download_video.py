@@ -1,13 +1,14 @@
 import os
-import moviepy.editor
-from pytubefix import YouTube
-from tqdm import tqdm
 import re
 import uuid
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from proxies import proxies
+from cancellation import Cancelled, check_cancelled, removed_on_failure, run_process
+from manifest_cache import manifest_cache
+from proxy_pool import proxy_pool
+from scheduler import SchedulerBusy, download_scheduler, transcode_scheduler
+from features.stream_policy import StreamPolicy, StreamRejected, estimate_bytes, select_streams
 
 def sanitize_filename(filename):
     """Sanitize the filename to remove characters that might cause issues."""
@@ -19,76 +20,103 @@ def sanitize_filename(filename):
         sanitized = name[:100] + ext
     return sanitized
 
-def download_highest_quality(url, path):
+def download_highest_quality(url, path, policy=None):
+    """
+    Download the best video and audio streams within a policy, muxed into one MP4.
+
+    Args:
+        url (str): The video
+        path (str): Directory for the download
+        policy (dict, optional): Overrides of the default stream policy (see StreamPolicy.from_dict)
+
+    Returns:
+        str: Path of the video relative to the session, or None if it failed
+
+    Raises:
+        StreamRejected: If no streams fit the policy; nothing is downloaded
+    """
+    # Heavy dependencies are imported on first use to keep app startup fast
+    import moviepy.editor
+    from moviepy.config import get_setting
+    from tqdm import tqdm
+
     try:
         def progress_callback(stream, data_chunk, bytes_remaining):
             pbar.update(len(data_chunk) // 10 ** 6)
 
-        # Add proxies to YouTube instance
-        yt = YouTube(url, proxies=proxies)
-        yt.register_on_progress_callback(progress_callback)
-        streams = yt.streams
+        # Wait for a download slot before leasing a proxy, so queued jobs don't
+        # hold proxies; metadata and media then go out through that one proxy
+        with download_scheduler.slot("download"), proxy_pool.lease():
+            # Reuses the stream manifest if this video was resolved recently
+            manifest = manifest_cache.get(url)
 
-        # Get the highest resolution video stream (webm format)
-        video_stream = streams.filter(progressive=False, type="video", file_extension="webm")
-        video_stream = video_stream.order_by("resolution").desc().first()
+            # The best streams within the policy's resolution, codec and size
+            # limits, estimated from the manifest before anything is fetched
+            selection = select_streams(manifest, StreamPolicy.from_dict(policy))
+            video_stream, audio_stream = selection.video, selection.audio
 
-        # Get the highest bitrate audio stream (mp4 format)
-        audio_stream = streams.filter(progressive=False, type="audio", file_extension="mp4")
-        audio_stream = audio_stream.order_by("abr").desc().first()
-
-        # Generate safer filenames
-        video_title = sanitize_filename(yt.title)
-        unique_id = str(uuid.uuid4())[:8]  # Add a unique ID to avoid conflicts
+            # Generate safer filenames
+            video_title = sanitize_filename(manifest.title)
+            unique_id = str(uuid.uuid4())[:8]  # Add a unique ID to avoid conflicts
         
-        video_filename = f"{unique_id}-video.webm"
-        audio_filename = f"{unique_id}-audio.mp4"
-        output_filename = f"{video_title}-{video_stream.resolution}.mp4"
-        final_filename = sanitize_filename(output_filename)
-
-        # Ensure the directory exists
-        os.makedirs(path, exist_ok=True)
-
-        # Check if the file already exists
-        if final_filename in os.listdir(path):
-            print(f"Already available: {final_filename}")
-            return f"static/video_dl/{final_filename}"
-
-        print(f"Downloading: {video_title} ({video_stream.resolution})")
-        pbar = tqdm(total=video_stream.filesize // 10 ** 6, unit="MB")
-
-        # Download video and audio streams
-        video_stream.download(output_path=path, filename=video_filename)
-        pbar.close()
-        audio_stream.download(output_path=path, filename=audio_filename)
-
-        # Full paths for FFmpeg
-        video_path = os.path.join(path, video_filename)
-        audio_path = os.path.join(path, audio_filename)
-        output_path = os.path.join(path, final_filename)
-
-        print("Merging video and audio...")
-        # Merge audio and video into a single mp4 file
-        try:
-            moviepy.video.io.ffmpeg_tools.ffmpeg_merge_video_audio(
-                video_path,
-                audio_path,
-                output_path
-            )
-        except Exception as e:
-            print(f"FFmpeg merge error: {e}")
-            # Alternative method using moviepy
-            try:
-                video_clip = moviepy.editor.VideoFileClip(video_path)
-                audio_clip = moviepy.editor.AudioFileClip(audio_path)
-                final_clip = video_clip.set_audio(audio_clip)
-                final_clip.write_videofile(output_path, codec='libx264')
-                video_clip.close()
-                audio_clip.close()
-                final_clip.close()
-            except Exception as e2:
-                print(f"MoviePy merge error: {e2}")
-                raise
+            video_filename = f"{unique_id}-video.{video_stream.subtype}"
+            audio_filename = f"{unique_id}-audio.{audio_stream.subtype}"
+            output_filename = f"{video_title}-{video_stream.resolution}.mp4"
+            final_filename = sanitize_filename(output_filename)
+
+            # Ensure the directory exists
+            os.makedirs(path, exist_ok=True)
+
+            # Check if the file already exists
+            if final_filename in os.listdir(path):
+                print(f"Already available: {final_filename}")
+                return f"static/video_dl/{final_filename}"
+
+            print(f"Downloading: {video_title} ({video_stream.resolution} {video_stream.video_codec}, "
+                  f"about {selection.estimated_bytes // 2 ** 20} MB{', downgraded' if selection.downgraded else ''})")
+            pbar = tqdm(total=estimate_bytes(video_stream, manifest.duration) // 10 ** 6, unit="MB")
+
+            # Full paths for FFmpeg
+            video_path = os.path.join(path, video_filename)
+            audio_path = os.path.join(path, audio_filename)
+            output_path = os.path.join(path, final_filename)
+
+            # Download video and audio streams; if either fails or the job is
+            # cancelled, neither half is left behind
+            with removed_on_failure(video_path, audio_path):
+                manifest.download(video_stream, output_path=path, filename=video_filename, on_progress=progress_callback)
+                pbar.close()
+                manifest.download(audio_stream, output_path=path, filename=audio_filename)
+
+        with removed_on_failure(video_path, audio_path, output_path):
+            print("Merging video and audio...")
+            # Merge audio and video into a single mp4 file
+            with transcode_scheduler.slot("mux"):
+                try:
+                    # Stream copy, as moviepy's ffmpeg_merge_video_audio does, but
+                    # killed if the job is cancelled
+                    run_process([
+                        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                        "-i", audio_path, "-i", video_path,
+                        "-vcodec", "copy", "-acodec", "copy", output_path,
+                    ])
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"FFmpeg merge error: {e}")
+                    # Alternative method using moviepy
+                    try:
+                        video_clip = moviepy.editor.VideoFileClip(video_path)
+                        audio_clip = moviepy.editor.AudioFileClip(audio_path)
+                        final_clip = video_clip.set_audio(audio_clip)
+                        final_clip.write_videofile(output_path, codec='libx264')
+                        video_clip.close()
+                        audio_clip.close()
+                        final_clip.close()
+                    except Exception as e2:
+                        print(f"MoviePy merge error: {e2}")
+                        raise
+                    check_cancelled()
 
         # Clean up temporary files
         try:
@@ -100,6 +128,9 @@ def download_highest_quality(url, path):
         print(f"Downloaded: {final_filename}")
         return f"static/video_dl/{final_filename}"
 
+    except (SchedulerBusy, Cancelled, StreamRejected):
+        # Let the API turn backpressure into a 503 and report cancellations and rejections
+        raise
     except Exception as e:
         print(f"Error occurred: {e}")
         return None
\ No newline at end of file
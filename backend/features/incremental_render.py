@@ -0,0 +1,365 @@
+"""
+Incremental re-rendering of a mix after one of its segments changes.
+
+A full render records a RenderManifest next to the session's temp files: the
+segment files in play order, and, before every crossfade, the tail of the mix
+that the next segment is faded into. When a later request differs from the
+recorded one in a single segment, only that segment and the crossfades on
+either side of it are mixed again:
+
+1. The changed region is mixed from the stored tail before the segment
+   through the crossfade into the following segment, once with the old
+   segment and once with the new one, to find where their output starts to
+   differ and where it becomes identical again.
+2. That region is re-encoded on the MP3 frame grid of the existing file,
+   starting a few frames early so the encoder is primed with real audio.
+   Those warm-up frames are dropped.
+3. The new frames are spliced between the untouched frames of the old file.
+   Mixes are encoded without the bit reservoir (see audio_merge.MP3_OPTIONS),
+   so frames don't borrow bits from their neighbours.
+
+The splice only works when the region's length changes by a whole number of
+MP3 frames. The edited segment's end is trimmed by up to one frame (~26ms)
+to make that true. Whenever a splice isn't possible, RenderUnavailable is
+raised and the caller does a full render.
+"""
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import check_cancelled, removed_on_failure
+from scheduler import transcode_scheduler
+from scratch import scratch
+from features.audio_merge import PcmEncoder, conform, crossfade_frames, crossfade_join
+from features.mp3_frames import scan_frames
+from features.waveform import peaks_path
+
+# Audio kept before each crossfade, beyond the crossfade itself, to prime the encoder
+TAIL_EXTRA_MS = 250
+# Frames encoded before the region and discarded, so the encoder starts primed
+WARMUP_FRAMES = 3
+# Frames of unchanged audio re-encoded after the region, so the splice lands on
+# frames that were encoded from identical input
+SETTLE_FRAMES = 3
+
+
+class RenderUnavailable(Exception):
+    """The previous render can't be updated in place; render from scratch"""
+
+
+def _frames(audio):
+    return int(audio.frame_count())
+
+
+class RenderManifest:
+    """Layout of a rendered mix, as needed to re-render part of it"""
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.tails_dir = os.path.join(os.path.dirname(path), "tails")
+        self.data = {"version": self.VERSION, "segments": []}
+
+    @classmethod
+    def load(cls, path):
+        """Return the manifest saved at path, or None if there isn't a usable one"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != cls.VERSION:
+            return None
+        manifest = cls(path)
+        manifest.data = data
+        return manifest
+
+    @property
+    def segments(self):
+        return self.data["segments"]
+
+    @property
+    def items(self):
+        return self.data.get("items", [])
+
+    @property
+    def output(self):
+        return self.data.get("output")
+
+    # Recording, called by merge_audio during a full render
+
+    def start(self, first_audio, crossfade_duration):
+        self.data = {
+            "version": self.VERSION,
+            "crossfade": crossfade_duration,
+            "format": {
+                "frame_rate": first_audio.frame_rate,
+                "channels": first_audio.channels,
+                "sample_width": first_audio.sample_width,
+            },
+            "segments": [],
+        }
+        if os.path.isdir(self.tails_dir):
+            for name in os.listdir(self.tails_dir):
+                os.remove(os.path.join(self.tails_dir, name))
+        scratch.clear(self.tails_dir)
+
+    def add_segment(self, audio_file, audio, pending=None, pending_start=0):
+        segment = {"file": audio_file, "frames": _frames(audio), "trim": 0}
+        if pending is not None:
+            segment.update(self._save_tail(pending, pending_start))
+        self.segments.append(segment)
+
+    def finish(self, output_file, total_frames):
+        self.data["output"] = output_file
+        self.data["total_frames"] = total_frames
+
+    def save(self, items=None, sources=None):
+        if items is not None:
+            self.data["items"] = [list(item) for item in items]
+        if sources is not None:
+            for segment, source in zip(self.segments, sources):
+                segment["source"] = source
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(temp_path, self.path)
+
+    def _save_tail(self, pending, pending_start):
+        """Store the end of the pending mix that the next segment is crossfaded into"""
+        keep = min(_frames(pending), crossfade_frames(self.data["crossfade"] + TAIL_EXTRA_MS, pending.frame_rate))
+        total = _frames(pending)
+        tail = pending.get_sample_slice(total - keep, total).raw_data
+        with scratch.place(os.path.join(self.tails_dir, f"{uuid.uuid4().hex[:12]}.pcm"), len(tail)) as tail_file:
+            with open(tail_file, "wb") as f:
+                f.write(tail)
+        return {"tail": tail_file, "tail_start": pending_start + total - keep, "pending_frames": total}
+
+    # Reading back
+
+    def empty(self):
+        from pydub import AudioSegment
+
+        return AudioSegment(data=b"", **self.data["format"])
+
+    def load_segment(self, index):
+        from pydub import AudioSegment
+
+        segment = self.segments[index]
+        audio = conform(AudioSegment.from_file(segment["file"], format="mp3"), self.empty())
+        if segment["trim"]:
+            audio = audio.get_sample_slice(0, _frames(audio) - segment["trim"])
+        return audio
+
+    def load_tail(self, index):
+        with open(self.segments[index]["tail"], "rb") as f:
+            return self.empty()._spawn(f.read())
+
+    def files_present(self):
+        paths = [self.output] + [s["file"] for s in self.segments] + [s["tail"] for s in self.segments[1:]]
+        return all(path and os.path.exists(path) for path in paths)
+
+    def changed_indexes(self, items):
+        """Indexes whose [url, start, end] differ from the recorded render, or None if the count changed"""
+        if len(items) != len(self.items):
+            return None
+        return [i for i, (new, old) in enumerate(zip(items, self.items)) if list(new) != list(old)]
+
+
+class _Region:
+    """The mix from the stored tail before a segment through the crossfade after it"""
+
+    def __init__(self, manifest, index, audio, next_audio, crossfade):
+        if index == 0:
+            done = manifest.empty()
+            pending = audio
+            self.diverge = 0
+        else:
+            tail = manifest.load_tail(index)
+            crossfade_in = min(crossfade, manifest.segments[index]["pending_frames"], _frames(audio))
+            done, pending = crossfade_join(tail, audio, crossfade_in)
+            # Everything before the incoming crossfade is the untouched previous mix
+            self.diverge = _frames(tail) - crossfade_in
+        self.pending_after = pending  # Mix the following segment is faded into
+        self.pending_after_start = _frames(done)
+        chunks = [done]
+
+        self.crossfade_out = 0
+        if next_audio is not None:
+            self.crossfade_out = min(crossfade, _frames(pending), _frames(next_audio))
+            done_next, pending = crossfade_join(pending, next_audio, self.crossfade_out)
+            chunks.append(done_next)
+        self.written = sum(_frames(chunk) for chunk in chunks)
+        self.pending_next = pending  # Mix the segment after next is faded into
+        self.audio = manifest.empty()._spawn(b"".join(chunk.raw_data for chunk in chunks) + pending.raw_data)
+
+
+def rerender_segment(manifest, index, item, source, split_file, output_dir):
+    """
+    Replace one segment of the recorded mix and splice the result into its output.
+
+    Args:
+        manifest (RenderManifest): Layout of the current mix
+        index (int): Segment that changed
+        item (list): New [url, start, end] of the segment
+        source (str): Downloaded source of the new segment
+        split_file (str): New segment file, already trimmed to start/end
+        output_dir (str): Directory for the new mix file
+
+    Returns:
+        str: Path of the new mix file (the previous one is removed)
+
+    Raises:
+        RenderUnavailable: If the edit can't be spliced into the existing mix
+    """
+    from pydub import AudioSegment
+
+    segments = manifest.segments
+    last = len(segments) - 1
+    base = 0 if index == 0 else segments[index]["tail_start"]
+    crossfade = crossfade_frames(manifest.data["crossfade"], manifest.data["format"]["frame_rate"])
+
+    with transcode_scheduler.slot("merge"):
+        with open(manifest.output, "rb") as f:
+            old_bytes = f.read()
+        old_offsets, frame_size = scan_frames(old_bytes)
+        old_frame_count = len(old_offsets) - 1
+
+        next_audio = manifest.load_segment(index + 1) if index < last else None
+        old = _Region(manifest, index, manifest.load_segment(index), next_audio, crossfade)
+        new_audio = conform(AudioSegment.from_file(split_file, format="mp3"), manifest.empty())
+
+        # The region has to grow or shrink by whole frames for the old frames
+        # after it to stay valid, so trim the edited segment's end to fit
+        trim = 0
+        for _ in range(3):
+            new = _Region(manifest, index, new_audio, next_audio, crossfade)
+            # Past the longer of the two outgoing crossfades both mixes are the next segment
+            settled = max(old.crossfade_out, new.crossfade_out)
+            shift = new.written - old.written
+            if next_audio is None or shift % frame_size == 0:
+                break
+            cut = shift % frame_size
+            if cut >= _frames(new_audio):
+                raise RenderUnavailable("segment too short to align")
+            new_audio = new_audio.get_sample_slice(0, _frames(new_audio) - cut)
+            trim += cut
+        else:
+            raise RenderUnavailable("could not align the edit to MP3 frames")
+
+        # Start on the frame grid at or before the first changed sample
+        start = (base + min(old.diverge, new.diverge)) // frame_size * frame_size
+        warmup = WARMUP_FRAMES if index > 0 else 0
+        if start - warmup * frame_size < base:
+            raise RenderUnavailable("not enough audio before the edit to prime the encoder")
+
+        # End on the frame grid a few frames into audio that didn't change
+        to_end = next_audio is None
+        if index + 2 < len(segments):
+            # The crossfade out of the next segment must start after all of that,
+            # or the old frames there were mixed from audio that did change
+            pending_frames = _frames(new.pending_next)
+            crossfade_next = min(crossfade, pending_frames, segments[index + 2]["frames"])
+            needed = settled + (SETTLE_FRAMES + WARMUP_FRAMES + 1) * frame_size
+            if pending_frames - crossfade_next < needed:
+                raise RenderUnavailable("segment after the edit is too short")
+        if not to_end:
+            old_end = base + old.written + settled + SETTLE_FRAMES * frame_size
+            old_end = -(-old_end // frame_size) * frame_size
+            new_end = old_end + shift
+            enough_audio = new_end + WARMUP_FRAMES * frame_size <= base + _frames(new.audio)
+            if not enough_audio or old_end // frame_size > old_frame_count:
+                if index + 1 < last:
+                    raise RenderUnavailable("segment after the edit is too short")
+                # The next segment ends the mix; re-encode through to the end
+                to_end = True
+
+        first = start - warmup * frame_size - base
+        if to_end:
+            region = new.audio.get_sample_slice(first, None)
+        else:
+            region = new.audio.get_sample_slice(first, new_end + WARMUP_FRAMES * frame_size - base)
+
+        fmt = manifest.data["format"]
+        # Encoded at the mix's bitrate, so about as big as its share of the mix
+        expected_bytes = len(old_bytes) * _frames(region) // max(1, manifest.data["total_frames"])
+        with scratch.place(os.path.join(output_dir, f".region_{uuid.uuid4().hex[:8]}.mp3"), expected_bytes) as region_file:
+            encoder = PcmEncoder(region_file, fmt["frame_rate"], fmt["channels"], fmt["sample_width"])
+            try:
+                encoder.write(region)
+                encoder.close()
+            except Exception:
+                encoder.abort()
+                check_cancelled()
+                raise
+            try:
+                with open(region_file, "rb") as f:
+                    region_bytes = f.read()
+            finally:
+                scratch.release(region_file)
+        region_offsets, region_frame_size = scan_frames(region_bytes)
+        if region_frame_size != frame_size:
+            raise RenderUnavailable("re-encoded frames don't match the existing mix")
+
+        if to_end:
+            spliced = (old_bytes[:old_offsets[start // frame_size]]
+                       + region_bytes[region_offsets[warmup]:region_offsets[-1]]
+                       + old_bytes[old_offsets[-1]:])
+        else:
+            keep = (new_end - start) // frame_size
+            if warmup + keep >= len(region_offsets):
+                raise RenderUnavailable("re-encoded region came out short")
+            spliced = (old_bytes[:old_offsets[start // frame_size]]
+                       + region_bytes[region_offsets[warmup]:region_offsets[warmup + keep]]
+                       + old_bytes[old_offsets[old_end // frame_size]:])
+
+    output_file = os.path.join(output_dir, f"combined_audio_{int(time.time())}.mp3")
+    if output_file == manifest.output:
+        output_file = os.path.join(output_dir, f"combined_audio_{int(time.time())}_{uuid.uuid4().hex[:4]}.mp3")
+    # Last point to give up; from here the manifest moves to the new output
+    check_cancelled()
+    with removed_on_failure(output_file):
+        with open(output_file, "wb") as f:
+            f.write(spliced)
+
+    _update_manifest(manifest, index, item, source, split_file, new_audio, trim, new, old, base, output_file)
+    print(f"Re-rendered segment {index + 1} of {len(segments)} in place "
+          f"({len(spliced) - len(old_bytes):+d} bytes)")
+    return output_file
+
+
+def _update_manifest(manifest, index, item, source, split_file, new_audio, trim, new, old, base, output_file):
+    segments = manifest.segments
+    replaced = [manifest.output, segments[index]["file"]]
+    if segments[index].get("source") not in (None, source):
+        replaced.append(segments[index]["source"])
+
+    segments[index].update({"file": split_file, "source": source, "frames": _frames(new_audio), "trim": trim})
+    # The mixes the next two segments are faded into now contain the new audio
+    following = [(index + 1, new.pending_after, new.pending_after_start),
+                 (index + 2, new.pending_next, new.written)]
+    for i, pending, relative_start in following:
+        if i < len(segments):
+            replaced.append(segments[i]["tail"])
+            segments[i].update(manifest._save_tail(pending, base + relative_start))
+    # Everything later keeps its audio but moves by the change in length
+    shift = _frames(new.audio) - _frames(old.audio)
+    for segment in segments[index + 3:]:
+        segment["tail_start"] += shift
+
+    manifest.data["total_frames"] += shift
+    manifest.data["output"] = output_file
+    manifest.data["items"][index] = list(item)
+    manifest.save()
+
+    for path in replaced:
+        if path and os.path.exists(path) and path != output_file:
+            scratch.release(path)
+            # Waveform peaks cached beside the file
+            if os.path.exists(peaks_path(path)):
+                os.remove(peaks_path(path))
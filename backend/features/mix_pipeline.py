@@ -0,0 +1,203 @@
+import contextvars
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from features.audio_download import download_audio
+from features.audio_split import split_audio
+from features.audio_merge import CROSSFADE_MS, ENCODE_PROFILE, format_path, merge_audio
+from features.incremental_render import RenderManifest, RenderUnavailable, rerender_segment
+from features.track_analysis import TRANSITIONS_ENABLED, TRANSITION_PROFILE, analyze_source
+from features.waveform import SOURCE_PEAKS, peaks_path
+from cancellation import check_cancelled
+from metrics import stage
+from profiling import thread_profile
+from render_cache import mix_key, render_cache
+from scratch import scratch
+
+# Segments of one mix that may be downloaded/trimmed at the same time. The
+# process-wide schedulers decide how many actually run across all sessions.
+JOB_CONCURRENCY = int(os.environ.get("INTELLIMIX_JOB_CONCURRENCY", 4))
+
+
+def cut_segment(url, source, start, end, temp_split_dir, name=None, index_source=True):
+    """
+    Trim a downloaded source to its segment, level-matched and cut on the beat.
+
+    Args:
+        url (str): Where the source came from; its analysis is cached by video
+        source (str): The downloaded source
+        start (float): Requested start in seconds
+        end (float): Requested end in seconds
+        temp_split_dir (str): Directory for the trimmed segment
+        name (str, optional): Name of the trimmed segment
+        index_source (bool): Whether the source still needs its waveform peaks
+
+    Returns:
+        str: Path of the trimmed segment
+    """
+    peaks_file = peaks_path(source) if SOURCE_PEAKS and index_source else None
+    if TRANSITIONS_ENABLED:
+        try:
+            # Decoding the source for its analysis also indexes its peaks
+            analysis, decoded = analyze_source(url, source, peaks_file)
+            plan = analysis.plan_segment(float(start), float(end), CROSSFADE_MS / 1000)
+            return split_audio(source, plan.start, plan.end, output_dir=temp_split_dir, name=name,
+                               peaks_file=None if decoded else peaks_file, gain_db=plan.gain_db)
+        except (RuntimeError, ValueError) as e:
+            print(f"Analysing {url} failed, using the segment as cut: {e}")
+    return split_audio(source, start, end, output_dir=temp_split_dir, name=name, peaks_file=peaks_file)
+
+
+def prepare_segment(name, url, start, end, temp_dir, temp_split_dir):
+    """Download one source and trim it to its segment, returning the segment path"""
+    # Queued segments of a cancelled job don't start
+    check_cancelled()
+    # Worker threads only show up in a job's profile if they join it
+    with thread_profile():
+        download_audio(url, name=name, output_dir=temp_dir)
+        source = scratch.locate(os.path.join(temp_dir, f"{name}.m4a"))
+        return cut_segment(url, source, start, end, temp_split_dir)
+
+
+def mix_cache_key(url_start_end):
+    """Render cache key of a mix made by this pipeline (see render_cache.mix_key)"""
+    profile = dict(ENCODE_PROFILE, transitions=TRANSITION_PROFILE) if TRANSITIONS_ENABLED else ENCODE_PROFILE
+    return mix_key(url_start_end, crossfade=CROSSFADE_MS, profile=profile)
+
+
+def cached_mix(key, output_dir, formats=("mp3",)):
+    """
+    A mix from the render cache, linked into output_dir.
+
+    Only MP3s are cached, so a mix that also needs other formats is never
+    served from the cache; its MP3 is cached once rendered.
+
+    Returns:
+        str: Path of the mix, or None if it has to be rendered
+    """
+    if any(format != "mp3" for format in formats):
+        return None
+    return render_cache.get(key, output_dir)
+
+
+def build_mix(url_start_end, temp_dir="temp", temp_split_dir="temp/split", output_dir="static/output", manifest=None,
+              formats=("mp3",)):
+    """
+    Download, trim and merge a sequence of segments into one mix.
+
+    Items are pulled from url_start_end only as fast as they can be worked
+    on, so a generator (e.g. a CSV being read) starts downloading its first
+    rows right away and is never held in memory as a whole.
+
+    Args:
+        url_start_end (iterable): [url, start_seconds, end_seconds] items
+        temp_dir (str): Directory for the downloaded source audio
+        temp_split_dir (str): Directory for the trimmed segments
+        output_dir (str): Directory for the merged mix
+        manifest (RenderManifest, optional): Saved with the mix's layout for incremental re-renders
+        formats (list): Output formats, all encoded in the one merge (see merge_audio)
+
+    Returns:
+        str: Path of the merged MP3
+
+    Raises:
+        ValueError: If there are no segments to mix
+    """
+    split_files = []
+    items = []
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=JOB_CONCURRENCY)
+    try:
+        for i, item in enumerate(url_start_end):
+            if manifest is not None:
+                items.append(list(item))
+            # Each task carries the caller's context so the schedulers know whose work it is
+            pending.append(pool.submit(contextvars.copy_context().run, prepare_segment,
+                                       str(i), item[0], item[1], item[2], temp_dir, temp_split_dir))
+            # Keep a bounded window of work in flight, collecting results in order
+            if len(pending) >= JOB_CONCURRENCY * 2:
+                split_files.append(pending.popleft().result())
+        while pending:
+            split_files.append(pending.popleft().result())
+    finally:
+        # On failure, drop segments that haven't started yet
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    if not split_files:
+        raise ValueError("No segments to mix")
+
+    # Merge audio files in their original order
+    output_file = merge_audio(split_files, output_dir=output_dir, manifest=manifest, formats=formats)
+    if manifest is not None:
+        manifest.save(items, sources=[scratch.locate(os.path.join(temp_dir, f"{i}.m4a")) for i in range(len(items))])
+    return output_file
+
+
+def render_mix(url_start_end, temp_dir="temp", temp_split_dir="temp/split", output_dir="static/output", reset=None,
+               formats=("mp3",)):
+    """
+    Build a mix, updating the previous render in place when only one segment changed.
+
+    The previous render's manifest lives in temp_dir. If the new items match
+    it, the existing mix is returned as is. A mix someone already rendered is
+    linked from the render cache. If exactly one item differs from the
+    previous render, only that segment is downloaded/trimmed and spliced into
+    the existing output. Anything else is a full build, which is cached.
+    Edits are only spliced into the MP3, so a mix that also needs other
+    formats is built in full unless it's unchanged.
+
+    Args:
+        url_start_end (list): [url, start_seconds, end_seconds] items
+        temp_dir (str): Directory for the downloaded source audio
+        temp_split_dir (str): Directory for the trimmed segments
+        output_dir (str): Directory for the merged mix
+        reset (callable, optional): Clears previous temp and output files before a full build
+        formats (list): Output formats, all encoded in the one merge (see merge_audio)
+
+    Returns:
+        str: Path of the merged MP3
+    """
+    items = [list(item) for item in url_start_end]
+    manifest_path = os.path.join(temp_dir, "render", "manifest.json")
+    previous = RenderManifest.load(manifest_path)
+
+    changed = None
+    if previous is not None and previous.files_present():
+        changed = previous.changed_indexes(items)
+        if changed == [] and all(os.path.exists(format_path(previous.output, f)) for f in formats):
+            print("Mix unchanged, reusing the previous render")
+            return previous.output
+
+    key = mix_cache_key(items)
+    # The previous render and its manifest stay, so a later edit can still be incremental
+    cached = cached_mix(key, output_dir, formats)
+    if cached is not None:
+        return cached
+
+    if changed is not None and len(changed) == 1 and all(format == "mp3" for format in formats):
+        index = changed[0]
+        url, start, end = items[index]
+        name = f"{index}-{uuid.uuid4().hex[:8]}"
+        # Only new times for the same video: trim the source we already have
+        source = previous.segments[index].get("source")
+        downloaded = False
+        if url != previous.items[index][0] or not source or not os.path.exists(source):
+            download_audio(url, name=name, output_dir=temp_dir)
+            source = scratch.locate(os.path.join(temp_dir, f"{name}.m4a"))
+            downloaded = True
+        split_file = cut_segment(url, source, start, end, temp_split_dir, name=name, index_source=downloaded)
+        try:
+            # Not cached: the edited segment may be up to one MP3 frame shorter than in a full build
+            with stage("rerender"):
+                return rerender_segment(previous, index, items[index], source, split_file, output_dir)
+        except RenderUnavailable as e:
+            print(f"Rendering the whole mix again: {e}")
+
+    if reset is not None:
+        reset()
+    output_file = build_mix(items, temp_dir, temp_split_dir, output_dir, manifest=RenderManifest(manifest_path),
+                            formats=formats)
+    render_cache.put(key, output_file)
+    return output_file
@@ -0,0 +1,201 @@
+import contextvars
+import itertools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from features.mix_pipeline import JOB_CONCURRENCY
+from features.read_csv import parse_time
+from manifest_cache import manifest_cache
+from metrics import stage
+from proxy_pool import proxy_pool
+
+# Sources whose metadata is resolved at the same time while planning
+PLAN_CONCURRENCY = int(os.environ.get("INTELLIMIX_PLAN_CONCURRENCY", 8))
+# Items of a streamed plan checked together: as many segments as a mix keeps in flight
+PLAN_WINDOW = JOB_CONCURRENCY * 2
+# Shorter segments are rejected rather than mixed
+MIN_SEGMENT_SECONDS = 1
+
+
+class PlanError(ValueError):
+    """Raised when a mix plan can't be rendered; carries the per-item diagnostics"""
+
+    def __init__(self, message, diagnostics):
+        super().__init__(message)
+        self.diagnostics = diagnostics
+
+
+def to_seconds(value):
+    """Seconds from a number or an SS, MM:SS or HH:MM:SS string"""
+    if isinstance(value, bool):
+        raise ValueError(f"invalid time {value!r}")
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"invalid time {value!r}, expected SS, MM:SS or HH:MM:SS")
+    return parse_time(value)
+
+
+def resolve_duration(url):
+    """Length of a video in seconds from its metadata alone; no media is fetched"""
+    # Durations are cached per video whichever proxy resolved them. The
+    # download may lease another proxy and resolve its own stream URLs;
+    # without proxies it reuses the manifest cached here
+    with proxy_pool.lease():
+        return manifest_cache.info(url).duration
+
+
+def check_item(index, item, duration=None):
+    """
+    Validate one [url, start, end] item, clamping what can be fixed.
+
+    Args:
+        index (int): Position of the item in the plan
+        item (list): [url, start, end]; times may be seconds or time strings
+        duration (int, optional): Length of the source in seconds, if known
+
+    Returns:
+        tuple: (fixed item or None if it's rejected, diagnostic dict)
+    """
+    url, start, end = (list(item) + [None, None, None])[:3]
+    diagnostic = {"index": index, "url": url, "status": "ok", "issues": []}
+
+    def reject(message):
+        diagnostic["status"] = "rejected"
+        diagnostic["issues"].append(message)
+        return None, diagnostic
+
+    if not url or not isinstance(url, str):
+        return reject("no source URL")
+    try:
+        start, end = to_seconds(start), to_seconds(end)
+    except ValueError as e:
+        return reject(str(e))
+    if start < 0:
+        return reject(f"start ({start}s) is negative")
+    if start >= end:
+        return reject(f"start ({start}s) must be before end ({end}s)")
+
+    if duration:
+        diagnostic["duration"] = duration
+        if start >= duration:
+            return reject(f"start ({start}s) is past the end of the video ({duration}s)")
+        if end > duration:
+            diagnostic["status"] = "fixed"
+            diagnostic["issues"].append(f"end ({end}s) clamped to the video length ({duration}s)")
+            end = duration
+    if end - start < MIN_SEGMENT_SECONDS:
+        return reject(f"segment is shorter than {MIN_SEGMENT_SECONDS}s")
+    return [url, start, end], diagnostic
+
+
+def _plan_window(items, offset, pool):
+    """
+    Check a run of items against their sources' metadata, resolved concurrently.
+
+    Args:
+        items (list): [url, start, end] items
+        offset (int): Index of the first item in the whole plan
+        pool (ThreadPoolExecutor): Runs the metadata lookups
+
+    Returns:
+        tuple: (planned items, one diagnostic per item)
+    """
+    # Times are checked first, so items that are wrong anyway cost no requests
+    checked = [check_item(offset + i, item) for i, item in enumerate(items)]
+    # Each lookup carries the caller's context, like the segment jobs of a mix
+    lookups = {
+        i: pool.submit(contextvars.copy_context().run, resolve_duration, fixed[0])
+        for i, (fixed, _) in enumerate(checked) if fixed is not None
+    }
+
+    planned = []
+    diagnostics = []
+    for i, (fixed, diagnostic) in enumerate(checked):
+        if fixed is not None:
+            try:
+                duration = lookups[i].result()
+            except Exception as e:
+                fixed = None
+                diagnostic["status"] = "rejected"
+                diagnostic["issues"].append(f"video unavailable: {e}")
+            else:
+                fixed, diagnostic = check_item(offset + i, fixed, duration)
+        if diagnostic["status"] != "ok":
+            print(f"Plan item {diagnostic['index']} {diagnostic['status']}: {'; '.join(diagnostic['issues'])}")
+        diagnostics.append(diagnostic)
+        if fixed is not None:
+            planned.append(fixed)
+    return planned, diagnostics
+
+
+def plan_mix(url_start_end, strict=False):
+    """
+    Validate a mix against its sources' metadata before any media is downloaded.
+
+    Durations of all sources are resolved concurrently (only the cheap
+    metadata requests), then every segment is checked: bad times and
+    unavailable videos are rejected, and ends past the video are clamped.
+
+    Args:
+        url_start_end (iterable): [url, start, end] items in play order
+        strict (bool): Reject the whole plan if any item needed fixing or was rejected,
+            instead of mixing the fixed items and dropping the rejected ones
+
+    Returns:
+        tuple: (items, diagnostics) - the [url, start_seconds, end_seconds]
+        items to render and one diagnostic per input item
+
+    Raises:
+        PlanError: If nothing is left to mix, or strict and any item had issues
+    """
+    items = [list(item) for item in url_start_end]
+    with stage("plan"), ThreadPoolExecutor(max_workers=PLAN_CONCURRENCY) as pool:
+        planned, diagnostics = _plan_window(items, 0, pool)
+
+    problems = [d for d in diagnostics if d["status"] != "ok"]
+    if strict and problems:
+        raise PlanError(f"{len(problems)} of {len(items)} items have problems", diagnostics)
+    if not planned:
+        raise PlanError("No valid segments to mix", diagnostics)
+    return planned, diagnostics
+
+
+def iter_plan(url_start_end, problems, window=PLAN_WINDOW):
+    """
+    Plan a long mix a window of items at a time, as it's being rendered.
+
+    Items are read, checked and yielded one window at a time, so the first
+    segments download while later rows haven't been read yet, memory stays
+    flat however long the playlist is, and each source is resolved shortly
+    before it's downloaded.
+
+    Args:
+        url_start_end (iterable): [url, start, end] items in play order, e.g. CSV rows
+        problems (list): Receives the diagnostics of items that were fixed or rejected
+        window (int): Items planned together
+
+    Yields:
+        list: [url, start_seconds, end_seconds] items to render
+
+    Raises:
+        PlanError: Once the items run out, if none of them could be mixed
+    """
+    items = iter(url_start_end)
+    offset = 0
+    planned_any = False
+    with ThreadPoolExecutor(max_workers=PLAN_CONCURRENCY) as pool:
+        while True:
+            chunk = [list(item) for item in itertools.islice(items, window)]
+            if not chunk:
+                break
+            with stage("plan"):
+                planned, diagnostics = _plan_window(chunk, offset, pool)
+            problems.extend(d for d in diagnostics if d["status"] != "ok")
+            offset += len(chunk)
+            for item in planned:
+                planned_any = True
+                yield item
+    if not planned_any:
+        raise PlanError("No valid segments to mix", problems)
@@ -0,0 +1,79 @@
+"""
+Minimal MPEG audio (Layer III) frame scanner.
+
+Mixes are encoded without the bit reservoir, so every frame carries all of
+its own audio data and a file can be cut and joined at frame boundaries.
+This module finds those boundaries.
+"""
+
+# Layer III bitrates in kbps by bitrate index
+_BITRATES_MPEG1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_BITRATES_MPEG2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5) and rate index
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _id3v2_size(data):
+    """Bytes taken by an ID3v2 tag at the start of data (0 if there is none)"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:  # Synchsafe integer: 7 bits per byte
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def parse_header(header):
+    """
+    Decode a 4-byte Layer III frame header.
+
+    Returns:
+        tuple: (frame_bytes, samples_per_frame, sample_rate) or None if it isn't a valid header
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    if version == 3:
+        bitrate = _BITRATES_MPEG1[bitrate_index] * 1000
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+    bitrate = _BITRATES_MPEG2[bitrate_index] * 1000
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate
+
+
+def scan_frames(data):
+    """
+    Find the audio frames in an MP3 file's bytes.
+
+    Args:
+        data (bytes): Whole file contents
+
+    Returns:
+        tuple: (offsets, samples_per_frame) where offsets[i] is the byte
+        offset of frame i and offsets[-1] is the end of the last frame
+
+    Raises:
+        ValueError: If no frames are found
+    """
+    pos = _id3v2_size(data)
+    offsets = []
+    samples_per_frame = None
+    while pos + 4 <= len(data):
+        parsed = parse_header(data[pos:pos + 4])
+        if parsed is None or pos + parsed[0] > len(data):
+            break  # Trailing tag or truncated frame
+        offsets.append(pos)
+        samples_per_frame = parsed[1]
+        pos += parsed[0]
+    if not offsets:
+        raise ValueError("No MP3 frames found")
+    offsets.append(pos)
+    return offsets, samples_per_frame
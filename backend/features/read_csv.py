@@ -1,25 +1,64 @@
 import csv
 
-def read_csv(file_path):
-    url_start_end = []
+REQUIRED_COLUMNS = ("Url", "Start", "End")
+
+
+def parse_time(value):
+    """Convert MM:SS, HH:MM:SS or plain seconds to seconds"""
+    value = value.strip()
+    parts = value.split(":")
+    if not 1 <= len(parts) <= 3 or not all(part.strip().isdigit() for part in parts):
+        raise ValueError(f"invalid time {value!r}, expected SS, MM:SS or HH:MM:SS")
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def iter_csv_rows(file_path, errors=None):
+    """
+    Stream [url, start, end] work items from a playlist CSV as rows are read.
+
+    Rows that fail validation are skipped and reported in errors instead of
+    aborting the whole playlist.
+
+    Args:
+        file_path (str): CSV file with Url, Start and End columns
+        errors (list, optional): Receives {"line": n, "error": message} for bad rows
+
+    Yields:
+        list: [url, start_seconds, end_seconds]
+
+    Raises:
+        ValueError: If the header is missing a required column
+    """
+    if errors is None:
+        errors = []
+
     with open(file_path, mode='r', newline='') as file:
         csv_reader = csv.DictReader(file)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (csv_reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+
         for row in csv_reader:
-            start = row['Start']
-            end = row['End']
-
-            # Convert MM:SS format to seconds
-            if ':' in start:
-                minutes, seconds = map(int, start.split(':'))
-                start = minutes * 60 + seconds
-            else:
-                start = int(start)
-
-            if ':' in end:
-                minutes, seconds = map(int, end.split(':'))
-                end = minutes * 60 + seconds
-            else:
-                end = int(end)
-
-            url_start_end.append([row['Url'], start, end])
-    return url_start_end
\ No newline at end of file
+            # Line of the row's last physical line, 1-based and counting the header
+            line = csv_reader.line_num
+            try:
+                url = (row['Url'] or '').strip()
+                if not url:
+                    raise ValueError("missing Url")
+                start = parse_time(row['Start'] or '')
+                end = parse_time(row['End'] or '')
+                if start >= end:
+                    raise ValueError(f"Start ({start}s) must be before End ({end}s)")
+            except ValueError as e:
+                errors.append({"line": line, "error": str(e)})
+                continue
+
+            yield [url, start, end]
+
+
+def read_csv(file_path):
+    """Read a whole playlist CSV into a list of [url, start, end]"""
+    return list(iter_csv_rows(file_path))
@@ -0,0 +1,242 @@
+"""
+Which streams of a video to download, within quality and size limits.
+
+A policy caps the resolution, the bitrate and the estimated size of a
+download, and lists the codecs it accepts in order of preference:
+
+    policy = StreamPolicy.from_dict({"max_height": 720, "max_mb": 200})
+    selection = select_streams(manifest, policy)
+    manifest.download(selection.video, ...)
+
+Sizes are estimated from the manifest alone, before any media is
+requested: the contentLength YouTube lists for most adaptive streams, else
+bitrate times duration (an overestimate, as the listed bitrate is a peak).
+When the best streams under the resolution and codec caps would go over
+the bitrate or size limit, the policy either downgrades to the best
+streams that fit or rejects the download.
+
+Requests can override any limit of the default policy, which comes from
+INTELLIMIX_* environment variables; 0 means no limit. Video downloads are
+capped at 1080p by default; set INTELLIMIX_MAX_HEIGHT=0 to take the highest
+resolution again, as downloads did before there was a policy.
+"""
+import os
+
+# Default limits
+MAX_HEIGHT = int(os.environ.get("INTELLIMIX_MAX_HEIGHT", 1080))
+MAX_KBPS = int(os.environ.get("INTELLIMIX_MAX_KBPS", 0))
+MAX_DOWNLOAD_MB = float(os.environ.get("INTELLIMIX_MAX_DOWNLOAD_MB", 0))
+# Accepted codec families, preferred first
+VIDEO_CODECS = tuple(c.strip() for c in os.environ.get("INTELLIMIX_VIDEO_CODECS", "vp9,h264,av1").split(",") if c.strip())
+AUDIO_CODECS = tuple(c.strip() for c in os.environ.get("INTELLIMIX_AUDIO_CODECS", "aac,opus").split(",") if c.strip())
+# What happens when the preferred streams are over a limit: downgrade or reject
+OVER_LIMIT = os.environ.get("INTELLIMIX_OVER_LIMIT", "downgrade")
+
+# Codec families by the first part of the codec strings in YouTube manifests
+CODEC_FAMILIES = {"avc1": "h264", "vp9": "vp9", "vp09": "vp9", "av01": "av1", "mp4a": "aac", "opus": "opus"}
+OVER_LIMIT_ACTIONS = ("downgrade", "reject")
+
+
+class StreamRejected(Exception):
+    """No streams of a video can be downloaded within the policy"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or {}
+
+
+def codec_family(codec):
+    """Family of a manifest codec string, e.g. "avc1.640028" -> "h264" """
+    if not codec:
+        return None
+    prefix = codec.split(".")[0].lower()
+    return CODEC_FAMILIES.get(prefix, prefix)
+
+
+def _codec_list(value, name):
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)) or not all(isinstance(codec, str) for codec in value):
+        raise ValueError(f"{name} must be a list of codec names")
+    return tuple(codec.strip().lower() for codec in value if codec.strip())
+
+
+def _limit(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"{name} must be a number of at least 0")
+    return value
+
+
+class StreamPolicy:
+    """
+    Limits on the streams a download may use.
+
+    Args:
+        max_height (int): Highest video resolution in lines, 0 for any
+        max_kbps (int): Highest combined bitrate of the streams, 0 for any
+        max_bytes (int): Largest estimated download, 0 for any
+        video_codecs (tuple): Accepted video codec families, preferred first
+        audio_codecs (tuple): Accepted audio codec families, preferred first
+        over_limit (str): "downgrade" to the best streams within the limits, or "reject"
+    """
+
+    FIELDS = ("max_height", "max_kbps", "max_mb", "video_codecs", "audio_codecs", "over_limit")
+
+    def __init__(self, max_height=MAX_HEIGHT, max_kbps=MAX_KBPS, max_bytes=int(MAX_DOWNLOAD_MB * 2 ** 20),
+                 video_codecs=VIDEO_CODECS, audio_codecs=AUDIO_CODECS, over_limit=OVER_LIMIT):
+        self.max_height = max_height
+        self.max_kbps = max_kbps
+        self.max_bytes = max_bytes
+        self.video_codecs = video_codecs
+        self.audio_codecs = audio_codecs
+        self.over_limit = over_limit
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """
+        A policy from a request, with the limits it doesn't set taken from base.
+
+        Args:
+            data (dict): Any of FIELDS; max_mb is in MiB
+            base (StreamPolicy, optional): Defaults, the configured policy if not given
+
+        Raises:
+            ValueError: If data has unknown fields or invalid values
+        """
+        base = base or cls()
+        data = data or {}
+        if not isinstance(data, dict):
+            raise ValueError("policy must be an object")
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown policy fields: {', '.join(sorted(unknown))}")
+        policy = cls(base.max_height, base.max_kbps, base.max_bytes, base.video_codecs, base.audio_codecs,
+                     base.over_limit)
+        if data.get("max_height") is not None:
+            policy.max_height = int(_limit(data["max_height"], "max_height"))
+        if data.get("max_kbps") is not None:
+            policy.max_kbps = _limit(data["max_kbps"], "max_kbps")
+        if data.get("max_mb") is not None:
+            policy.max_bytes = int(_limit(data["max_mb"], "max_mb") * 2 ** 20)
+        if data.get("video_codecs") is not None:
+            policy.video_codecs = _codec_list(data["video_codecs"], "video_codecs")
+        if data.get("audio_codecs") is not None:
+            policy.audio_codecs = _codec_list(data["audio_codecs"], "audio_codecs")
+        if data.get("over_limit") is not None:
+            if data["over_limit"] not in OVER_LIMIT_ACTIONS:
+                raise ValueError(f"over_limit must be one of: {', '.join(OVER_LIMIT_ACTIONS)}")
+            policy.over_limit = data["over_limit"]
+        return policy
+
+    def to_dict(self):
+        """The policy as request fields, which from_dict reads back"""
+        return {
+            "max_height": self.max_height,
+            "max_kbps": self.max_kbps,
+            "max_mb": self.max_bytes / 2 ** 20,
+            "video_codecs": list(self.video_codecs),
+            "audio_codecs": list(self.audio_codecs),
+            "over_limit": self.over_limit,
+        }
+
+
+class Selection:
+    """Streams picked for a download, with what they are expected to cost"""
+
+    def __init__(self, video, audio, estimated_bytes, kbps, downgraded=False):
+        self.video = video  # None for audio-only downloads
+        self.audio = audio
+        self.estimated_bytes = estimated_bytes
+        self.kbps = kbps
+        self.downgraded = downgraded
+
+    def describe(self):
+        return {
+            "resolution": self.video.resolution if self.video is not None else None,
+            "video_codec": self.video.video_codec if self.video is not None else None,
+            "audio_codec": self.audio.audio_codec,
+            "abr": self.audio.abr,
+            "kbps": round(self.kbps),
+            "estimated_bytes": self.estimated_bytes,
+            "downgraded": self.downgraded,
+        }
+
+
+def estimate_bytes(stream, duration):
+    """Expected size of a stream from the manifest, without requesting it"""
+    # _filesize is the listed contentLength; stream.filesize would ask the server
+    if stream._filesize:
+        return stream._filesize
+    return int((stream.bitrate or 0) * (duration or 0) / 8)
+
+
+def _height(stream):
+    if stream.height:
+        return stream.height
+    try:
+        return int((stream.resolution or "0p").rstrip("p"))
+    except ValueError:
+        return 0
+
+
+def select_streams(manifest, policy=None, video=True, seconds=None):
+    """
+    Pick the best video and audio streams of a manifest within a policy.
+
+    Args:
+        manifest (VideoManifest): The resolved video
+        policy (StreamPolicy, optional): Limits, the configured defaults if not given
+        video (bool): Whether a video stream is wanted, or only audio
+        seconds (float, optional): How much of the video is downloaded, for clips
+
+    Returns:
+        Selection
+
+    Raises:
+        StreamRejected: If no streams fit, or the preferred ones don't and the policy rejects
+    """
+    policy = policy or StreamPolicy()
+    fraction = min(1.0, seconds / manifest.duration) if seconds and manifest.duration else 1.0
+
+    audios = [s for s in manifest.streams.filter(progressive=False, type="audio")
+              if codec_family(s.audio_codec) in policy.audio_codecs]
+    videos = [None]
+    if video:
+        videos = [s for s in manifest.streams.filter(progressive=False, type="video")
+                  if codec_family(s.video_codec) in policy.video_codecs
+                  and (not policy.max_height or _height(s) <= policy.max_height)]
+    if not audios or not videos:
+        raise StreamRejected("No streams match the resolution and codec limits", {
+            "policy": policy.to_dict(),
+            "available": [
+                {"resolution": s.resolution, "video_codec": s.video_codec, "audio_codec": s.audio_codec}
+                for s in manifest.streams.filter(progressive=False)
+            ],
+        })
+
+    def quality(pair):
+        # Video by resolution and frame rate, then the preferred codec, then
+        # bitrate; audio by the preferred codec, then bitrate
+        v, a = pair
+        video_rank = (0, 0, 0, 0) if v is None else (
+            _height(v), getattr(v, "fps", 0) or 0,
+            -policy.video_codecs.index(codec_family(v.video_codec)), v.bitrate or 0)
+        return video_rank + (-policy.audio_codecs.index(codec_family(a.audio_codec)), a.bitrate or 0)
+
+    candidates = []
+    for v, a in sorted(((v, a) for v in videos for a in audios), key=quality, reverse=True):
+        streams = [s for s in (v, a) if s is not None]
+        size = int(sum(estimate_bytes(s, manifest.duration) for s in streams) * fraction)
+        kbps = sum(s.bitrate or 0 for s in streams) / 1000
+        fits = (not policy.max_bytes or size <= policy.max_bytes) and (not policy.max_kbps or kbps <= policy.max_kbps)
+        candidates.append(Selection(v, a, size, kbps, downgraded=bool(candidates)))
+        if fits:
+            return candidates[-1]
+        if policy.over_limit == "reject":
+            break
+
+    preferred = candidates[0]
+    raise StreamRejected(
+        f"Download would be about {preferred.estimated_bytes / 2 ** 20:.0f} MB at {preferred.kbps:.0f} kbps, over the limits",
+        {"policy": policy.to_dict(), "preferred": preferred.describe()},
+    )
@@ -0,0 +1,537 @@
+"""
+Loudness and beat grid analysis of sources, for level-matched, beat-aligned transitions.
+
+Each source is decoded once to mono PCM and analysed as it streams by,
+with numpy, in blocks of STFT frames:
+
+- loudness: K-weighted power (ITU-R BS.1770) per 100ms step, from which
+  the gated integrated loudness of any segment is computed, and the
+  sample peak per step for headroom
+- beats: a spectral-flux onset envelope, its tempo from autocorrelation
+  and a beat grid from dynamic programming (Ellis, 2007)
+
+K-weighting is applied as the BS.1770 filters' magnitude response on the
+STFT bins rather than as IIR filters over the samples, which would be a
+Python loop per sample. Loudness is of the mono downmix as if played on
+both channels, which matches BS.1770 for centred material and is close
+enough to match levels between songs otherwise.
+
+Results are small (a few floats per 100ms), so they're cached on disk per
+source video and shared by every session and render:
+
+    analysis = analyze_source(url, source_path)
+    plan = analysis.plan_segment(start, end, crossfade_seconds)
+    split_audio(source_path, plan.start, plan.end, gain_db=plan.gain_db)
+"""
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import removed_on_failure, stream_process
+from features.waveform import DECODE_OUTPUT, PeakBuilder, WavStream
+from metrics import stage
+from render_cache import canonical_source
+from scheduler import transcode_scheduler
+from single_flight import SingleFlight
+
+# Set to 0 to mix segments as cut, with no level matching or beat snapping
+TRANSITIONS_ENABLED = os.environ.get("INTELLIMIX_TRANSITIONS", "1") != "0"
+# Loudness every segment is brought to, in LUFS
+TARGET_LUFS = float(os.environ.get("INTELLIMIX_TARGET_LUFS", -14))
+# Most a segment is boosted or cut, in dB
+MAX_GAIN_DB = 12
+# Boosts stop this far below full scale
+HEADROOM_DB = 1
+CACHE_DIR = os.environ.get("INTELLIMIX_ANALYSIS_CACHE_DIR", "analysis_cache")
+MAX_ENTRIES = int(os.environ.get("INTELLIMIX_ANALYSIS_CACHE_SIZE", 4096))
+# Bump when a change here changes analysis results
+ANALYSIS_VERSION = 1
+
+# Loudness steps and gating blocks (BS.1770: 400ms blocks overlapping by 75%)
+STEP_SECONDS = 0.1
+BLOCK_STEPS = 4
+ABSOLUTE_GATE_LUFS = -70
+RELATIVE_GATE_LU = -10
+# Tempo range searched, and the tempo assumed most likely
+MIN_BPM = 60
+MAX_BPM = 200
+PRIOR_BPM = 120
+# Onset detection ignores the spectrum above this
+ONSET_MAX_HZ = 8000
+# Weakest autocorrelation peak (relative to lag 0) taken as a beat
+MIN_TEMPO_STRENGTH = 0.1
+# How strictly beats keep to the tempo, against following onsets
+TIGHTNESS = 100
+# Segments aren't shortened by snapping to less than this share of their length
+MIN_SNAPPED_SHARE = 0.5
+
+# BS.1770 K-weighting at 48kHz: high shelf, then high-pass
+_K_FILTERS = [
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+_K_RATE = 48000
+_LUFS_OFFSET = -0.691
+# The mono downmix played on both channels, which is what a centred mix sounds like
+_CHANNELS_OFFSET = 10 * math.log10(2)
+# numpy dtype and full scale by pydub/ffmpeg sample width
+_SAMPLE_FORMATS = {1: ("u1", 128), 2: ("<i2", 2 ** 15), 4: ("<i4", 2 ** 31)}
+
+# Everything here that changes how a mix sounds (part of its render cache key)
+TRANSITION_PROFILE = {"analysis": ANALYSIS_VERSION, "target_lufs": TARGET_LUFS, "max_gain_db": MAX_GAIN_DB,
+                      "headroom_db": HEADROOM_DB}
+
+_analyzing = SingleFlight()
+
+
+def _k_weighting(frequencies):
+    """Power response of the K-weighting filters at frequencies in Hz"""
+    import numpy as np
+
+    z = np.exp(-2j * np.pi * np.minimum(frequencies, _K_RATE / 2) / _K_RATE)
+    response = np.ones(len(frequencies))
+    for b, a in _K_FILTERS:
+        h = np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+        response *= np.abs(h) ** 2
+    return response
+
+
+def _lufs(power):
+    return _LUFS_OFFSET + _CHANNELS_OFFSET + 10 * math.log10(power) if power > 0 else -math.inf
+
+
+class SegmentPlan:
+    """Where to cut a segment and how much to turn it up or down"""
+
+    def __init__(self, start, end, gain_db, loudness=None):
+        self.start = start
+        self.end = end
+        self.gain_db = gain_db
+        self.loudness = loudness  # LUFS before the gain, None if silent
+
+    def __repr__(self):
+        return f"SegmentPlan({self.start:.3f}-{self.end:.3f}s, {self.gain_db:+.1f}dB)"
+
+
+class TrackAnalysis:
+    """
+    Loudness steps and beat grid of one source.
+
+    Args:
+        power (list): Mean K-weighted power of every STEP_SECONDS
+        peaks (list): Sample peak of every STEP_SECONDS, 0-1 of full scale
+        tempo (float): Beats per minute, or None without a clear beat
+        beats (list): Beat times in seconds
+    """
+
+    def __init__(self, power, peaks, tempo=None, beats=()):
+        self.power = power
+        self.peaks = peaks
+        self.tempo = tempo
+        self.beats = list(beats)
+
+    @property
+    def duration(self):
+        return len(self.power) * STEP_SECONDS
+
+    def _steps(self, start, end):
+        first = max(0, int(start / STEP_SECONDS))
+        return first, max(first + 1, min(len(self.power), int(math.ceil(end / STEP_SECONDS))))
+
+    def loudness(self, start=0, end=None):
+        """
+        Gated integrated loudness of [start, end] seconds (BS.1770).
+
+        Returns:
+            float: LUFS, or None if all of it is below the absolute gate
+        """
+        first, last = self._steps(start, self.duration if end is None else end)
+        steps = self.power[first:last]
+        if len(steps) < BLOCK_STEPS:
+            blocks = [sum(steps) / len(steps)] if steps else []
+        else:
+            blocks = [sum(steps[i:i + BLOCK_STEPS]) / BLOCK_STEPS for i in range(len(steps) - BLOCK_STEPS + 1)]
+        blocks = [power for power in blocks if _lufs(power) > ABSOLUTE_GATE_LUFS]
+        if not blocks:
+            return None
+        relative_gate = _lufs(sum(blocks) / len(blocks)) + RELATIVE_GATE_LU
+        gated = [power for power in blocks if _lufs(power) > relative_gate]
+        return _lufs(sum(gated) / len(gated))
+
+    def peak(self, start=0, end=None):
+        """Sample peak of [start, end] seconds, 0-1 of full scale"""
+        first, last = self._steps(start, self.duration if end is None else end)
+        return max(self.peaks[first:last], default=0)
+
+    def gain_db(self, start, end):
+        """Gain that brings [start, end] to TARGET_LUFS without clipping"""
+        loudness = self.loudness(start, end)
+        if loudness is None:
+            return 0.0
+        gain = max(-MAX_GAIN_DB, min(MAX_GAIN_DB, TARGET_LUFS - loudness))
+        peak = self.peak(start, end)
+        if peak > 0:
+            gain = min(gain, -HEADROOM_DB - 20 * math.log10(peak))
+        return round(gain, 2)
+
+    def plan_segment(self, start, end, crossfade=0):
+        """
+        Cut a segment on the beat and level-match it.
+
+        The start moves forward to the first beat, and the end back so the
+        crossfade out of the segment starts on a beat; the segment only
+        ever gets shorter, and keeps its times if it has no beat grid or
+        would lose more than half its length.
+
+        Args:
+            start (float): Requested start in seconds
+            end (float): Requested end in seconds
+            crossfade (float): Seconds the segment overlaps the next one by
+
+        Returns:
+            SegmentPlan
+        """
+        snapped_start, snapped_end = start, end
+        if self.tempo:
+            beat = 60 / self.tempo
+            after_start = [t for t in self.beats if start <= t < start + beat]
+            before_end = [t for t in self.beats if end - crossfade - beat < t <= end - crossfade]
+            if after_start:
+                snapped_start = after_start[0]
+            if before_end:
+                snapped_end = before_end[-1] + crossfade
+            if snapped_end - snapped_start < (end - start) * MIN_SNAPPED_SHARE:
+                snapped_start, snapped_end = start, end
+        return SegmentPlan(round(snapped_start, 3), round(snapped_end, 3),
+                           self.gain_db(snapped_start, snapped_end), self.loudness(snapped_start, snapped_end))
+
+    def to_json(self):
+        return {
+            "version": ANALYSIS_VERSION,
+            "step_seconds": STEP_SECONDS,
+            "tempo": self.tempo,
+            "beats": [round(t, 3) for t in self.beats],
+            "power": [float(f"{p:.4g}") for p in self.power],
+            "peaks": [round(p, 4) for p in self.peaks],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["power"], data["peaks"], data["tempo"], data["beats"])
+
+
+class TrackAnalyzer:
+    """
+    Analyse raw PCM as it's produced, in blocks of STFT frames.
+
+    Args:
+        sample_rate (int): Frames per second of the PCM
+        channels (int): Interleaved channels, mixed down to one
+        sample_width (int): Bytes per sample, as in pydub
+    """
+
+    # Frames transformed per numpy call
+    BLOCK_FRAMES = 128
+
+    def __init__(self, sample_rate, channels=1, sample_width=2):
+        import numpy as np
+
+        self._np = np
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.dtype, self.full_scale = _SAMPLE_FORMATS[sample_width]
+        # ~23ms hop, 50% overlapping Hann frames
+        self.hop = 2 ** round(math.log2(sample_rate * 0.023))
+        self.frame = 2 * self.hop
+        self.window = np.hanning(self.frame + 1)[:-1].astype(np.float32)
+        frequencies = np.fft.rfftfreq(self.frame, 1 / sample_rate)
+        # Onsets are found below this frequency, where drums and note attacks show
+        self.onset_bins = int(np.searchsorted(frequencies, ONSET_MAX_HZ))
+        # Parseval: sum of weighted |X|^2 over this is the frame's mean square
+        self.weights = (_k_weighting(frequencies) * 2 / (self.frame * np.sum(self.window ** 2))).astype(np.float32)
+        self.weights[0] /= 2
+        if self.frame % 2 == 0:
+            self.weights[-1] /= 2
+        self.step = round(sample_rate * STEP_SECONDS)
+        self._bytes_per_frame = channels * sample_width
+        self._rest = b""
+        self._samples = np.zeros(self.hop, dtype=np.float32)  # Carried over to the next frame
+        self._previous = None  # Log spectrum of the last frame, for the flux
+        self._power = []
+        self._flux = []
+        self._peak_samples = np.zeros(0, dtype=np.float32)  # Not yet a whole step
+        self._peaks = []
+
+    def write(self, data):
+        """Add the next PCM bytes (any length)"""
+        if self._rest:
+            data = self._rest + data
+        block = self.BLOCK_FRAMES * self.hop * self._bytes_per_frame
+        usable = len(data) - len(data) % block
+        self._rest = data[usable:]
+        if usable:
+            self._process(self._decode(data[:usable]))
+
+    def _decode(self, data):
+        np = self._np
+        samples = np.frombuffer(data, dtype=self.dtype).astype(np.float32)
+        if self.dtype == "u1":
+            samples -= 128
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        return samples / self.full_scale
+
+    def _process(self, samples):
+        np = self._np
+        peaks = np.concatenate([self._peak_samples, np.abs(samples)])
+        whole = len(peaks) - len(peaks) % self.step
+        self._peaks.append(peaks[:whole].reshape(-1, self.step).max(axis=1))
+        self._peak_samples = peaks[whole:]
+
+        signal = np.concatenate([self._samples, samples])
+        count = (len(signal) - self.frame) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(signal, self.frame)[::self.hop][:count]
+        self._samples = signal[count * self.hop:]
+        transform = np.fft.rfft(frames * self.window, axis=1)
+        spectrum = transform.real ** 2 + transform.imag ** 2
+        self._power.append(spectrum @ self.weights)
+        # Onsets: rises in log magnitude, summed over the spectrum
+        log_spectrum = np.log1p(1000 * np.sqrt(spectrum[:, :self.onset_bins]))
+        previous = log_spectrum[:1] if self._previous is None else self._previous
+        self._flux.append(np.maximum(0, np.diff(log_spectrum, axis=0, prepend=previous)).sum(axis=1))
+        self._previous = log_spectrum[-1:]
+
+    def finish(self):
+        """
+        Analysis of everything written.
+
+        Returns:
+            TrackAnalysis
+        """
+        np = self._np
+        width = self._bytes_per_frame
+        rest = self._rest[:len(self._rest) - len(self._rest) % width]
+        self._rest = b""
+        # Pad the last partial block to whole frames with silence
+        samples = self._decode(rest) if rest else np.zeros(0, dtype=np.float32)
+        padding = -(len(self._samples) + len(samples) - self.frame) % self.hop
+        self._process(np.concatenate([samples, np.zeros(padding, dtype=np.float32)]))
+        if len(self._peak_samples):
+            self._peaks.append(self._peak_samples.max(keepdims=True))
+
+        frame_power = np.concatenate(self._power)
+        flux = np.concatenate(self._flux)
+        peaks = np.concatenate(self._peaks)
+
+        # Frame powers averaged into steps by where each frame's centre falls
+        centres = (np.arange(len(frame_power)) * self.hop + self.hop) // self.step
+        steps = len(peaks)
+        totals = np.bincount(np.minimum(centres, steps - 1), weights=frame_power, minlength=steps)
+        counts = np.bincount(np.minimum(centres, steps - 1), minlength=steps)
+        power = totals / np.maximum(counts, 1)
+
+        tempo, beats = self._beats(flux)
+        return TrackAnalysis(power.tolist(), peaks.astype(float).tolist(), tempo, beats)
+
+    def _beats(self, onsets):
+        """Tempo and beat times from the onset envelope, or (None, []) without a clear beat"""
+        np = self._np
+        frame_rate = self.sample_rate / self.hop
+        min_lag = int(frame_rate * 60 / MAX_BPM)
+        max_lag = int(math.ceil(frame_rate * 60 / MIN_BPM))
+        if len(onsets) < 4 * max_lag:
+            return None, []
+        onsets = onsets - onsets.mean()
+        scale = onsets.std()
+        if scale == 0:
+            return None, []
+        onsets = onsets / scale
+
+        # Autocorrelation by FFT, weighted towards likely tempos
+        size = 2 ** int(math.ceil(math.log2(2 * len(onsets))))
+        spectrum = np.fft.rfft(onsets, size)
+        correlation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:max_lag + 2]
+        correlation /= correlation[0]
+        lags = np.arange(min_lag, max_lag + 1)
+        prior = np.exp(-0.5 * np.log2(lags / (frame_rate * 60 / PRIOR_BPM)) ** 2)
+        best = lags[np.argmax(correlation[lags] * prior)]
+        if correlation[best] < MIN_TEMPO_STRENGTH:
+            return None, []
+        # Parabolic interpolation between lags
+        left, centre, right = correlation[best - 1:best + 2]
+        curvature = left - 2 * centre + right
+        period = best + (0.5 * (left - right) / curvature if curvature < 0 else 0)
+        tempo = 60 * frame_rate / period
+
+        # Best-scoring chain of onsets about one period apart
+        offsets = np.arange(-int(round(2 * period)), -int(round(period / 2)) + 1)
+        penalties = -TIGHTNESS * np.log(-offsets / period) ** 2
+        score = onsets.copy()
+        backlink = np.full(len(onsets), -1)
+        for t in range(-offsets[0], len(onsets)):
+            candidates = score[t + offsets] + penalties
+            i = np.argmax(candidates)
+            if candidates[i] > 0:
+                score[t] += candidates[i]
+                backlink[t] = t + offsets[i]
+        # End on the best-scoring frame in the last period
+        t = len(score) - int(round(period)) + int(np.argmax(score[-int(round(period)):]))
+        frames = []
+        while t >= 0:
+            frames.append(t)
+            t = backlink[t]
+        # An onset registers as soon as it enters a frame's window, so the
+        # frame's start is closer to it than its centre
+        times = np.array(frames[::-1]) * self.hop / self.sample_rate
+        return round(float(tempo), 2), times.tolist()
+
+
+class AnalysisCache:
+    """
+    Analyses of sources on disk, one small JSON file per source video.
+
+    Args:
+        cache_dir (str): Directory holding the analyses
+        max_entries (int): Files kept before the least recently used are dropped
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> TrackAnalysis, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source_id):
+        text = json.dumps([ANALYSIS_VERSION, canonical_source(source_id)])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, source_id):
+        """The cached analysis of a source, or None"""
+        key = self.key(source_id)
+        with self._lock:
+            analysis = self._memory.get(key)
+            if analysis is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return analysis
+        try:
+            with open(self._path(key)) as f:
+                analysis = TrackAnalysis.from_json(json.load(f))
+            os.utime(self._path(key))
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self._remember(key, analysis)
+            self.hits += 1
+        return analysis
+
+    def put(self, source_id, analysis):
+        key = self.key(source_id)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        with removed_on_failure(temp_path):
+            with open(temp_path, "w") as f:
+                json.dump(analysis.to_json(), f)
+            # Atomic, so readers never see a partial file
+            os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._remember(key, analysis)
+        self._evict()
+
+    def _remember(self, key, analysis):
+        """Keep an analysis in memory (caller holds the lock)"""
+        self._memory[key] = analysis
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """Remove the least recently used files beyond max_entries"""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".json")]
+        except FileNotFoundError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+analysis_cache = AnalysisCache()
+
+
+def analyze_file(audio_file, peaks_file=None):
+    """
+    Decode audio_file once and analyse it, writing its waveform peaks from the same decode if peaks_file is given.
+
+    Returns:
+        TrackAnalysis
+    """
+    from pydub import AudioSegment
+
+    factories = [TrackAnalyzer] + ([PeakBuilder] if peaks_file else [])
+    stream = WavStream(*factories)
+    # Decoding runs ffmpeg, so wait for a transcode slot
+    with transcode_scheduler.slot("analysis"), stage("analysis"):
+        stream_process([AudioSegment.converter, "-loglevel", "error", "-i", audio_file, *DECODE_OUTPUT],
+                       stream.write)
+        sinks = stream.finished_sinks(audio_file)
+        analysis = sinks[0].finish()
+    if peaks_file:
+        sinks[1].save(audio_file, peaks_file)
+    return analysis
+
+
+def analyze_source(source_id, audio_file, peaks_file=None):
+    """
+    Analysis of a downloaded source, from the cache or computed and cached.
+
+    Args:
+        source_id (str): URL of the source; analyses are shared by video
+        audio_file (str): The downloaded source
+        peaks_file (str, optional): Also write the source's waveform peaks here when decoding it
+
+    Returns:
+        tuple: (TrackAnalysis, whether it was computed now, so peaks_file was written)
+    """
+    analysis = analysis_cache.get(source_id)
+    if analysis is not None:
+        return analysis, False
+
+    def compute():
+        analysis = analyze_file(audio_file, peaks_file)
+        analysis_cache.put(source_id, analysis)
+        return analysis
+
+    # Sessions mixing the same video at once share one decode; only the
+    # leader's peaks_file gets written
+    analysis, shared = _analyzing.do(analysis_cache.key(source_id), compute)
+    return analysis, not shared
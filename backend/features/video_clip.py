@@ -0,0 +1,282 @@
+"""
+Clips of a video, cut straight from its streams.
+
+A clip never downloads the whole video. ffmpeg reads the signed stream URLs
+itself and seeks with HTTP range requests, so only the bytes of the GOPs
+the clip covers are fetched; a clip costs about the same from a 5 minute
+video as from a 3 hour one. Cuts are planned on the video's keyframes:
+
+- by default everything is stream-copied from the last keyframe at or
+  before start, so the clip may begin up to one GOP early
+- exact clips stream-copy the keyframe-aligned middle and re-encode only
+  the partial GOPs at either edge, then join the pieces without another
+  encode; only a clip shorter than a GOP is re-encoded as a whole
+
+Audio has no GOPs worth the name: it is copied along with the video, or
+re-encoded for exact clips (cheap next to video) so it starts on the sample.
+"""
+import json
+import os
+import re
+import uuid
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import Cancelled, removed_on_failure, run_process
+from manifest_cache import manifest_cache
+from metrics import stage
+from proxy_pool import current_proxy_url, proxy_pool
+from scheduler import SchedulerBusy, download_scheduler, transcode_scheduler
+from scratch import scratch
+from features.stream_policy import StreamPolicy, StreamRejected, select_streams
+
+# Longest clip served; longer ranges should download the video instead
+CLIP_MAX_SECONDS = float(os.environ.get("INTELLIMIX_CLIP_MAX_SECONDS", 600))
+# Keyframes closer than this to a cut count as on it
+KEYFRAME_TOLERANCE = 0.001
+# Encoder settings for the re-encoded edges of an exact clip, by source codec.
+# The pieces are joined by stream copy, so edges keep the source's codec
+EDGE_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"],
+    "vp9": ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-crf", "24", "-b:v", "0"],
+    "av1": ["-c:v", "libaom-av1", "-cpu-used", "8", "-crf", "28", "-b:v", "0"],
+}
+# Audio of exact clips
+CLIP_AUDIO_OPTIONS = ["-c:a", "aac", "-b:a", "192k"]
+# What pytubefix sends for media; googlevideo refuses some bare clients
+USER_AGENT = "Mozilla/5.0"
+
+
+def sanitize_filename(filename):
+    """Sanitize the filename to remove characters that might cause issues."""
+    # Replace problematic characters with underscore
+    sanitized = re.sub(r'[\\/*?:"<>|]', "_", filename)
+    # Limit filename length
+    if len(sanitized) > 100:
+        name, ext = os.path.splitext(sanitized)
+        sanitized = name[:100] + ext
+    return sanitized
+
+
+def stream_input(url):
+    """ffmpeg/ffprobe input options for reading a stream URL through the job's proxy"""
+    if not url.startswith(("http://", "https://")):
+        return []
+    options = ["-user_agent", USER_AGENT]
+    proxy = current_proxy_url()
+    if proxy:
+        options += ["-http_proxy", proxy]
+    return options
+
+
+def probe_keyframes(video_url, start, end):
+    """
+    Codec and keyframe times of a video stream around a clip.
+
+    Only the packets from the keyframe at or before start to just past end
+    are read, so a remote stream is fetched for that range only.
+
+    Returns:
+        tuple: (codec name, keyframe times in seconds from the start of the video)
+    """
+    from pydub.utils import get_prober_name
+
+    output = run_process([
+        get_prober_name(), "-v", "error", *stream_input(video_url),
+        "-select_streams", "v:0", "-read_intervals", f"{start}%{end + 1}",
+        "-show_entries", "stream=codec_name:format=start_time:packet=pts_time,flags",
+        "-of", "json", video_url,
+    ])
+    info = json.loads(output)
+    # ffmpeg's -ss counts from the start time, which isn't always 0
+    offset = float(info.get("format", {}).get("start_time") or 0)
+    codec = info["streams"][0]["codec_name"] if info.get("streams") else None
+    keyframes = sorted(
+        float(packet["pts_time"]) - offset
+        for packet in info.get("packets", [])
+        if "K" in packet.get("flags", "") and "pts_time" in packet
+    )
+    return codec, keyframes
+
+
+def plan_clip(keyframes, start, end, exact=False):
+    """
+    Split a clip into stream-copied and re-encoded pieces.
+
+    Args:
+        keyframes (list): Sorted keyframe times around the clip
+        start (float): Clip start in seconds
+        end (float): Clip end in seconds
+        exact (bool): Cut at start and end precisely instead of at the keyframe before start
+
+    Returns:
+        list: ("copy" or "encode", start, end) pieces, in order
+    """
+    if not exact:
+        before = [k for k in keyframes if k <= start + KEYFRAME_TOLERANCE]
+        return [("copy", before[-1] if before else start, end)]
+
+    inside = [k for k in keyframes if start - KEYFRAME_TOLERANCE <= k <= end + KEYFRAME_TOLERANCE]
+    if not inside:
+        # Shorter than a GOP
+        return [("encode", start, end)]
+    first, last = inside[0], inside[-1]
+    pieces = []
+    if first - start > KEYFRAME_TOLERANCE:
+        pieces.append(("encode", start, first))
+    if last - first > KEYFRAME_TOLERANCE:
+        pieces.append(("copy", first, last))
+    if end - last > KEYFRAME_TOLERANCE:
+        pieces.append(("encode", last, end))
+    return pieces
+
+
+def cut_piece(video_url, kind, start, end, codec, output_file):
+    """Cut one piece of an exact clip's video, copied or re-encoded, into a Matroska file"""
+    from pydub import AudioSegment
+
+    if kind == "copy":
+        # Copying stops on decode order; packets shown at or after the next
+        # keyframe (B-frames) belong to the following piece
+        codec_options = ["-c:v", "copy", "-bsf:v", f"noise=drop=gte(pts*tb\\,{end - start})"]
+        slot = download_scheduler.slot("download")
+    else:
+        codec_options = EDGE_ENCODERS[codec]
+        slot = transcode_scheduler.slot("clip")
+    with slot, removed_on_failure(output_file):
+        run_process([
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            *stream_input(video_url), "-ss", str(start), "-i", video_url, "-t", str(end - start),
+            "-map", "0:v:0", *codec_options, "-f", "matroska", output_file,
+        ])
+
+
+def cut_clip(video_url, audio_url, output_file, start, end, exact=False, bytes_per_second=0):
+    """
+    Cut a clip of a video's separate video and audio streams into one MP4.
+
+    Args:
+        video_url (str): Video stream (a URL, or any file ffmpeg reads)
+        audio_url (str): Audio stream
+        output_file (str): The clip
+        start (float): Clip start in seconds
+        end (float): Clip end in seconds
+        exact (bool): Re-encode the partial GOPs at the edges to cut precisely
+        bytes_per_second (float): About how much video the streams carry, for placing the pieces
+
+    Returns:
+        float: Where the clip actually starts in the video, in seconds
+    """
+    from pydub import AudioSegment
+
+    codec, keyframes = probe_keyframes(video_url, start, end)
+    pieces = plan_clip(keyframes, start, end, exact)
+    if exact and codec not in EDGE_ENCODERS and any(kind == "encode" for kind, _, _ in pieces):
+        print(f"No encoder for {codec} edges, cutting {video_url} on keyframes")
+        exact = False
+        pieces = plan_clip(keyframes, start, end)
+
+    with stage("clip"), removed_on_failure(output_file):
+        if not exact:
+            clip_start = pieces[0][1]
+            # One pass of stream copies, fetching only the clip's range of each stream
+            with download_scheduler.slot("download"):
+                run_process([
+                    AudioSegment.converter, "-y", "-loglevel", "error",
+                    *stream_input(video_url), "-ss", str(clip_start), "-i", video_url,
+                    *stream_input(audio_url), "-ss", str(clip_start), "-i", audio_url,
+                    "-t", str(end - clip_start), "-map", "0:v:0", "-map", "1:a:0", "-c", "copy",
+                    "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", output_file,
+                ])
+            return clip_start
+
+        unique_id = uuid.uuid4().hex[:8]
+        home_dir = os.path.dirname(output_file)
+        home_files = []
+        piece_files = []
+        list_file = os.path.join(home_dir, f"{unique_id}-pieces.txt")
+        try:
+            for i, (kind, piece_start, piece_end) in enumerate(pieces):
+                # Pieces are read once by the join, so they stay in memory while there's room
+                home_file = os.path.join(home_dir, f"{unique_id}-{i}.mkv")
+                home_files.append(home_file)
+                with scratch.place(home_file, (piece_end - piece_start) * bytes_per_second) as piece_file:
+                    piece_files.append(piece_file)
+                    cut_piece(video_url, kind, piece_start, piece_end, codec, piece_file)
+            with open(list_file, "w", encoding="utf-8") as f:
+                for piece_file in piece_files:
+                    escaped = os.path.abspath(piece_file).replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            # Join the pieces by stream copy; only the audio is encoded
+            with transcode_scheduler.slot("clip"):
+                run_process([
+                    AudioSegment.converter, "-y", "-loglevel", "error",
+                    "-f", "concat", "-safe", "0", "-i", list_file,
+                    *stream_input(audio_url), "-ss", str(start), "-i", audio_url, "-t", str(end - start),
+                    "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", *CLIP_AUDIO_OPTIONS,
+                    "-movflags", "+faststart", output_file,
+                ])
+        finally:
+            for home_file in home_files:
+                scratch.release(home_file)
+            try:
+                os.remove(list_file)
+            except OSError:
+                pass
+    return start
+
+
+def clip_video(url, path, start, end, exact=False, policy=None):
+    """
+    Cut a clip of a YouTube video without downloading the rest of it.
+
+    Args:
+        url (str): The video
+        path (str): Directory for the clip
+        start (float): Clip start in seconds
+        end (float): Clip end in seconds (past the end of the video means up to its end)
+        exact (bool): Cut at start precisely rather than at the keyframe before it
+        policy (dict, optional): Overrides of the default stream policy (see StreamPolicy.from_dict)
+
+    Returns:
+        str: Path of the clip relative to the session, or None if it failed
+
+    Raises:
+        StreamRejected: If no streams fit the policy for the clip's length
+    """
+    try:
+        # Metadata and media go out through one proxy from the pool
+        with proxy_pool.lease():
+            # Reuses the stream manifest if this video was resolved recently
+            manifest = manifest_cache.get(url)
+            if manifest.duration:
+                end = min(end, float(manifest.duration))
+            if not 0 <= start < end:
+                raise ValueError(f"Clip {start}-{end} is outside the video")
+
+            # Same policy as a full download, with sizes for the clip's share of the streams
+            selection = select_streams(manifest, StreamPolicy.from_dict(policy), seconds=end - start)
+            video_stream, audio_stream = selection.video, selection.audio
+
+            video_title = sanitize_filename(manifest.title)
+            suffix = "-exact" if exact else ""
+            final_filename = sanitize_filename(f"{video_title}-{video_stream.resolution}-{start:g}-{end:g}{suffix}.mp4")
+
+            os.makedirs(path, exist_ok=True)
+            if final_filename in os.listdir(path):
+                print(f"Already available: {final_filename}")
+                return f"static/video_dl/{final_filename}"
+
+            print(f"Clipping: {video_title} ({video_stream.resolution}, {start:g}s to {end:g}s)")
+            clip_start = cut_clip(video_stream.url, audio_stream.url, os.path.join(path, final_filename),
+                                  start, end, exact, bytes_per_second=(video_stream.bitrate or 0) / 8)
+
+        print(f"Clipped: {final_filename} (from {clip_start:.3f}s)")
+        return f"static/video_dl/{final_filename}"
+
+    except (SchedulerBusy, Cancelled, StreamRejected):
+        # Let the API turn backpressure into a 503 and report cancellations and rejections
+        raise
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        return None
@@ -0,0 +1,306 @@
+"""
+Multi-resolution waveform peaks of sources and mixes.
+
+A peaks index holds the min and max sample of every bucket of audio at a
+few zoom levels, so the frontend can draw a waveform and let users scrub
+without downloading and decoding the audio. It is stored beside the audio
+file as <file>.peaks: a header naming the audio file it was made from
+(inode and size; mtimes change when the render cache touches a hardlinked
+mix), then one audiowaveform .dat (version 1, 8-bit) block per level,
+finest first. The same blocks are served as JSON or .dat, which peaks.js
+and similar players read directly.
+
+Peaks are computed from PCM in one vectorized pass as it streams by:
+
+- mixes: merge_audio tees the PCM it encodes into a PeakBuilder
+- sources: split_audio decodes the whole source once and both trims the
+  segment and feeds the peaks from that decode
+- anything else (cached or re-rendered mixes, downloads) is decoded on
+  first request and cached
+"""
+import os
+import struct
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cancellation import removed_on_failure, stream_process
+from scheduler import transcode_scheduler
+from single_flight import SingleFlight
+
+# Whether mixes also index their whole sources while trimming them. Costs
+# decoding the rest of each source past its segment; with this off, source
+# peaks are decoded on first request instead
+SOURCE_PEAKS = os.environ.get("INTELLIMIX_SOURCE_PEAKS", "1") != "0"
+# Buckets per second at the finest level
+PEAKS_PER_SECOND = 100
+# Each level has this many times fewer buckets than the one before
+LEVEL_FACTOR = 4
+LEVELS = 4
+# ffmpeg output arguments that decode the input's audio to mono WAV on
+# stdout, at its own sample rate (resampling costs more than the peaks)
+DECODE_OUTPUT = ["-map", "0:a:0", "-ac", "1", "-c:a", "pcm_s16le", "-f", "wav", "pipe:1"]
+# Bucket count aimed for when a request doesn't choose a level
+DEFAULT_PIXELS = 2000
+
+# Peaks file header: magic, inode and size of the audio file
+_FILE_HEADER = struct.Struct("<8sQQ")
+_MAGIC = b"IMPEAKS1"
+# audiowaveform .dat v1 header: version, flags (1 = 8-bit), sample rate, samples per pixel, length
+_DAT_HEADER = struct.Struct("<iIiiI")
+_DAT_VERSION = 1
+_DAT_8_BIT = 1
+
+# numpy dtype and shift to 8 bits by pydub/ffmpeg sample width
+_SAMPLE_FORMATS = {1: ("u1", 0), 2: ("<i2", 8), 4: ("<i4", 24)}
+
+_building = SingleFlight()
+
+
+def peaks_path(audio_file):
+    """Where the peaks of an audio file are cached"""
+    return f"{audio_file}.peaks"
+
+
+def _identity(audio_file):
+    stat = os.stat(audio_file)
+    return _FILE_HEADER.pack(_MAGIC, stat.st_ino, stat.st_size)
+
+
+class PeakLevel:
+    """Interleaved min/max pairs of one zoom level, as 8-bit samples"""
+
+    def __init__(self, sample_rate, samples_per_pixel, data):
+        self.sample_rate = sample_rate
+        self.samples_per_pixel = samples_per_pixel
+        self.data = data  # numpy int8 array [min0, max0, min1, max1, ...]
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def to_dat(self):
+        """The level as an audiowaveform .dat file"""
+        header = _DAT_HEADER.pack(_DAT_VERSION, _DAT_8_BIT, self.sample_rate, self.samples_per_pixel, len(self))
+        return header + self.data.tobytes()
+
+    def to_json(self):
+        """The level in audiowaveform's JSON format"""
+        return {
+            "version": 2,
+            "channels": 1,
+            "sample_rate": self.sample_rate,
+            "samples_per_pixel": self.samples_per_pixel,
+            "bits": 8,
+            "length": len(self),
+            "data": self.data.tolist(),
+        }
+
+
+class PeakBuilder:
+    """
+    Fold raw PCM into peaks as it's produced.
+
+    Args:
+        sample_rate (int): Frames per second of the PCM
+        channels (int): Interleaved channels; peaks cover all of them
+        sample_width (int): Bytes per sample, as in pydub
+    """
+
+    def __init__(self, sample_rate, channels=1, sample_width=2):
+        import numpy as np
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype, self.shift = _SAMPLE_FORMATS[sample_width]
+        self.samples_per_pixel = max(1, round(sample_rate / PEAKS_PER_SECOND))
+        self._bucket_bytes = self.samples_per_pixel * channels * sample_width
+        self._rest = b""
+        self._mins = []
+        self._maxs = []
+        self._np = np
+
+    def write(self, data):
+        """Add the next PCM bytes (any length)"""
+        if self._rest:
+            data = self._rest + data
+        usable = len(data) - len(data) % self._bucket_bytes
+        self._rest = data[usable:]
+        if usable:
+            self._fold(data[:usable])
+
+    def _fold(self, data):
+        buckets = self._np.frombuffer(data, dtype=self.dtype).reshape(-1, self.samples_per_pixel * self.channels)
+        self._mins.append(buckets.min(axis=1))
+        self._maxs.append(buckets.max(axis=1))
+
+    def finish(self):
+        """
+        Peaks of everything written.
+
+        Returns:
+            list: PeakLevel per zoom level, finest first
+        """
+        np = self._np
+        # The last, partial bucket
+        width = np.dtype(self.dtype).itemsize * self.channels
+        rest = self._rest[:len(self._rest) - len(self._rest) % width]
+        if rest:
+            samples = np.frombuffer(rest, dtype=self.dtype)
+            self._mins.append(samples.min(keepdims=True))
+            self._maxs.append(samples.max(keepdims=True))
+        self._rest = b""
+
+        mins = np.concatenate(self._mins) if self._mins else np.zeros(0, self.dtype)
+        maxs = np.concatenate(self._maxs) if self._maxs else np.zeros(0, self.dtype)
+        if self.dtype == "u1":
+            mins, maxs = mins.astype(np.int16) - 128, maxs.astype(np.int16) - 128
+        mins = (mins >> self.shift).astype(np.int8)
+        maxs = (maxs >> self.shift).astype(np.int8)
+
+        levels = []
+        samples_per_pixel = self.samples_per_pixel
+        for level in range(LEVELS):
+            if level:
+                # Coarser levels come from the finer one, not from the audio
+                padded = -len(mins) % LEVEL_FACTOR
+                mins = np.concatenate([mins, np.repeat(mins[-1:], padded)]).reshape(-1, LEVEL_FACTOR).min(axis=1)
+                maxs = np.concatenate([maxs, np.repeat(maxs[-1:], padded)]).reshape(-1, LEVEL_FACTOR).max(axis=1)
+                samples_per_pixel *= LEVEL_FACTOR
+            data = np.empty(len(mins) * 2, dtype=np.int8)
+            data[0::2] = mins
+            data[1::2] = maxs
+            levels.append(PeakLevel(self.sample_rate, samples_per_pixel, data))
+        return levels
+
+    def save(self, audio_file, path=None):
+        """Finish and write the peaks of the finished audio_file, atomically"""
+        levels = self.finish()
+        path = path or peaks_path(audio_file)
+        temp_path = f"{path}.tmp"
+        with removed_on_failure(temp_path):
+            with open(temp_path, "wb") as f:
+                f.write(_identity(audio_file))
+                for level in levels:
+                    f.write(level.to_dat())
+            os.replace(temp_path, path)
+        return levels
+
+
+class WavStream:
+    """
+    Parse a streamed WAV file and hand its PCM to sinks made for its format.
+
+    Args:
+        *factories: Called as factory(sample_rate, channels, sample_width)
+            once the header is read; each returns a sink with write(bytes)
+    """
+
+    def __init__(self, *factories):
+        self.factories = factories
+        self.sinks = None  # Set once the header has been read
+        self._header = b""
+
+    def write(self, data):
+        if self.sinks is not None:
+            for sink in self.sinks:
+                sink.write(data)
+            return
+        self._header += data
+        # RIFF header, then chunks up to "data"; ffmpeg writes no real sizes
+        # to a pipe, so the data chunk's size is ignored
+        offset = 12
+        sample_rate = channels = sample_width = None
+        while offset + 8 <= len(self._header):
+            chunk_id, size = struct.unpack_from("<4sI", self._header, offset)
+            if chunk_id == b"data":
+                if sample_rate is None:
+                    raise ValueError("WAV stream has no format chunk")
+                self.sinks = [factory(sample_rate, channels, sample_width) for factory in self.factories]
+                data, self._header = self._header[offset + 8:], b""
+                self.write(data)
+                return
+            if chunk_id == b"fmt ":
+                if offset + 24 > len(self._header):
+                    return
+                _, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", self._header, offset + 8)
+                sample_width = bits // 8
+            offset += 8 + size + size % 2
+
+    def finished_sinks(self, audio_file):
+        """The sinks, once the stream has ended"""
+        if self.sinks is None:
+            raise ValueError(f"No audio decoded from {audio_file}")
+        return self.sinks
+
+
+def load_peaks(audio_file):
+    """
+    Read the cached peaks of an audio file.
+
+    Returns:
+        list: PeakLevel per zoom level, finest first, or None if there are
+        none or they were made from a different file
+    """
+    import numpy as np
+
+    try:
+        with open(peaks_path(audio_file), "rb") as f:
+            content = f.read()
+        if content[:_FILE_HEADER.size] != _identity(audio_file):
+            return None
+    except OSError:
+        return None
+    levels = []
+    offset = _FILE_HEADER.size
+    while offset < len(content):
+        version, flags, sample_rate, samples_per_pixel, length = _DAT_HEADER.unpack_from(content, offset)
+        if version != _DAT_VERSION or flags != _DAT_8_BIT:
+            return None
+        offset += _DAT_HEADER.size
+        data = np.frombuffer(content, dtype=np.int8, count=length * 2, offset=offset)
+        levels.append(PeakLevel(sample_rate, samples_per_pixel, data))
+        offset += length * 2
+    return levels
+
+
+def build_peaks(audio_file):
+    """Decode audio_file once and write its peaks file"""
+    from pydub import AudioSegment
+
+    stream = WavStream(PeakBuilder)
+    # Decoding runs ffmpeg, so wait for a transcode slot
+    with transcode_scheduler.slot("peaks"):
+        stream_process([AudioSegment.converter, "-loglevel", "error", "-i", audio_file, *DECODE_OUTPUT],
+                       stream.write)
+    peaks, = stream.finished_sinks(audio_file)
+    return peaks.save(audio_file)
+
+
+def get_peaks(audio_file):
+    """
+    Peaks of an audio file, computed on first use and cached beside it.
+
+    Returns:
+        list: PeakLevel per zoom level, finest first
+    """
+    levels = load_peaks(audio_file)
+    if levels is None:
+        # Concurrent requests for the same file share one decode
+        levels, _ = _building.do(os.path.abspath(audio_file), build_peaks, audio_file)
+    return levels
+
+
+def pick_level(levels, pixels=None, level=None):
+    """
+    The level to serve: an explicit index, or the coarsest with at least pixels buckets.
+
+    Raises:
+        ValueError: If level is out of range
+    """
+    if level is not None:
+        if not 0 <= level < len(levels):
+            raise ValueError(f"level must be between 0 and {len(levels) - 1}")
+        return levels[level]
+    pixels = pixels or DEFAULT_PIXELS
+    for candidate in reversed(levels):
+        if len(candidate) >= pixels:
+            return candidate
+    return levels[0]
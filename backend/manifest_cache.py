@@ -0,0 +1,261 @@
+"""
+Cache of resolved YouTube video metadata and stream manifests.
+
+Resolving a video (watch page, player JS, innertube call, signature
+deciphering) costs several requests before a single media byte arrives.
+The result is kept per video id so repeated and retried downloads go
+straight to the media:
+
+    manifest = manifest_cache.get(url)
+    stream = manifest.streams.get_audio_only()
+    manifest.download(stream, output_path=..., filename=...)
+
+Stream URLs are signed and expire (their `expire` query parameter), so an
+entry lives only until shortly before its earliest URL expires. They are
+also tied to the IP that resolved them, so entries are kept per proxy. A
+403/410 while downloading drops the entry so the next attempt re-resolves.
+
+Title and duration don't depend on who asked, so they are also kept per
+video id alone. Callers that only need those (planning a mix, say) use
+manifest_cache.info(url), which answers from any proxy's resolution:
+
+    duration = manifest_cache.info(url).duration
+"""
+import copy
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import OrderedDict
+
+from cancellation import check_cancelled, is_cancelled, removed_on_failure
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_SECONDS
+from proxy_pool import current_proxy_url
+from single_flight import SingleFlight
+
+MAX_ENTRIES = int(os.environ.get("INTELLIMIX_MANIFEST_CACHE_SIZE", 256))
+MAX_TTL = float(os.environ.get("INTELLIMIX_MANIFEST_TTL", 3600))
+# Entries are dropped this long before their URLs expire, so a download
+# started from the cache has time to finish
+EXPIRY_MARGIN = 900
+
+
+def url_expiry(url):
+    """Unix time a signed stream URL stops working, or None if it isn't signed"""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    try:
+        return float(query["expire"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+class VideoManifest:
+    """Title, duration and streams of one video, as resolved through one proxy"""
+
+    def __init__(self, video_id, title, duration, streams, expires_at, proxy=None):
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.streams = streams  # pytubefix StreamQuery
+        self.expires_at = expires_at
+        self.proxy = proxy
+
+    def describe(self):
+        """Plain summary of the manifest, for logs and debug endpoints"""
+        return {
+            "video_id": self.video_id,
+            "title": self.title,
+            "duration": self.duration,
+            "expires_in_seconds": round(self.expires_at - time.time()),
+            "streams": [
+                {
+                    "itag": stream.itag,
+                    "mime_type": stream.mime_type,
+                    "bitrate": stream.bitrate,
+                    "abr": stream.abr,
+                    "resolution": stream.resolution,
+                    # Known without a request only if the manifest carried it
+                    "filesize": stream._filesize or None,
+                }
+                for stream in self.streams
+            ],
+        }
+
+    def download(self, stream, output_path=None, filename=None, on_progress=None, **kwargs):
+        """
+        Download one of this manifest's streams.
+
+        Streams are shared between everyone using the cached manifest, so the
+        download runs on a copy carrying this caller's progress callback.
+        It stops at the next chunk if the current job is cancelled, and a
+        partial file is never left behind (pytubefix would take it for a
+        finished download next time).
+
+        Returns:
+            str: Path of the downloaded file
+
+        Raises:
+            Cancelled: If the job was cancelled during the download
+        """
+        from pytubefix.monostate import Monostate
+
+        own_stream = copy.copy(stream)
+        own_stream._monostate = Monostate(on_progress, None, title=self.title, duration=self.duration)
+        # Same path pytubefix will write to
+        file_system = {"linux": "ext4", "darwin": "APFS"}.get(sys.platform, "NTFS")
+        file_path = own_stream.get_file_path(filename=filename, output_path=output_path, file_system=file_system)
+        check_cancelled()
+        existed = os.path.exists(file_path)  # pytubefix skips files it already has
+        started = time.perf_counter()
+        try:
+            with removed_on_failure(file_path):
+                path = own_stream.download(output_path=output_path, filename=filename,
+                                           interrupt_checker=is_cancelled, **kwargs)
+                check_cancelled()
+        except urllib.error.HTTPError as e:
+            if e.code in (403, 410):
+                # The signed URL expired or was refused; resolve again next time
+                manifest_cache.invalidate(self.video_id, self.proxy)
+            raise
+        if existed:
+            return path
+        # Recorded once per file; the progress callbacks stay untouched
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - started, kind=stream.type)
+        DOWNLOAD_BYTES.inc(os.path.getsize(path), kind=stream.type)
+        return path
+
+
+class VideoInfo:
+    """Title and duration of a video, the same whichever proxy resolved it"""
+
+    def __init__(self, video_id, title, duration, expires_at):
+        self.video_id = video_id
+        self.title = title
+        self.duration = duration
+        self.expires_at = expires_at
+
+
+class ManifestCache:
+    """
+    LRU cache of VideoManifest by (video id, proxy), and of VideoInfo by video id.
+
+    Args:
+        max_entries (int): Manifests kept before the least recently used is dropped
+        max_ttl (float): Longest an entry is kept, even if its URLs are valid longer
+        expiry_margin (float): Entries are dropped this many seconds before their URLs expire
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_ttl=MAX_TTL, expiry_margin=EXPIRY_MARGIN):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.expiry_margin = expiry_margin
+        self._entries = OrderedDict()
+        self._info = OrderedDict()
+        self._lock = threading.Lock()
+        self._resolving = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.info_hits = 0
+        self.info_misses = 0
+
+    def info(self, url):
+        """
+        Return the title and duration of a video, resolving it if no proxy has recently.
+
+        On a miss the video is resolved through the current proxy, so its
+        manifest is cached for that proxy as well.
+
+        Returns:
+            VideoInfo
+        """
+        from pytubefix import extract
+
+        video_id = extract.video_id(url)
+        with self._lock:
+            info = self._info.get(video_id)
+            if info is not None and info.expires_at > time.time():
+                self._info.move_to_end(video_id)
+                self.info_hits += 1
+                return info
+            self.info_misses += 1
+        manifest = self.get(url)
+        return VideoInfo(manifest.video_id, manifest.title, manifest.duration, manifest.expires_at)
+
+    def get(self, url):
+        """
+        Return the manifest for a video URL, resolving it if it isn't cached.
+
+        Must be called under the proxy lease that will download the streams.
+
+        Returns:
+            VideoManifest
+        """
+        from pytubefix import extract
+
+        video_id = extract.video_id(url)
+        key = (video_id, current_proxy_url())
+        with self._lock:
+            manifest = self._entries.get(key)
+            if manifest is not None and manifest.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return manifest
+            self.misses += 1
+
+        # Concurrent misses for the same video share one resolution
+        manifest, _ = self._resolving.do(key, self._resolve, url, video_id, key[1])
+        return manifest
+
+    def _resolve(self, url, video_id, proxy):
+        from pytubefix import YouTube
+
+        yt = YouTube(url)
+        streams = yt.streams
+        manifest = VideoManifest(video_id, yt.title, yt.length, streams, 0, proxy)
+
+        now = time.time()
+        with self._lock:
+            # Metadata outlives the signed URLs, so it's kept for the full TTL
+            self._info[video_id] = VideoInfo(video_id, yt.title, yt.length, now + self.max_ttl)
+            self._info.move_to_end(video_id)
+            while len(self._info) > self.max_entries:
+                self._info.popitem(last=False)
+
+        expiries = [e for e in (url_expiry(stream.url) for stream in streams) if e is not None]
+        ttl = self.max_ttl
+        if expiries:
+            ttl = min(ttl, min(expiries) - self.expiry_margin - now)
+        if ttl <= 0:
+            return manifest
+        manifest.expires_at = now + ttl
+
+        with self._lock:
+            self._entries[(video_id, proxy)] = manifest
+            self._entries.move_to_end((video_id, proxy))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return manifest
+
+    def invalidate(self, video_id, proxy=None):
+        with self._lock:
+            self._entries.pop((video_id, proxy), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            info_lookups = self.info_hits + self.info_misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "info_entries": len(self._info),
+                "info_hits": self.info_hits,
+                "info_misses": self.info_misses,
+                "info_hit_rate": round(self.info_hits / info_lookups, 3) if info_lookups else None,
+            }
+
+
+manifest_cache = ManifestCache()
@@ -0,0 +1,246 @@
+"""
+Opt-in CPU and memory profiling of single jobs.
+
+A request with the X-IntelliMix-Profile: 1 header (or "profile": true in
+its JSON body) runs its job under cProfile and tracemalloc. The profile
+follows the work through contextvars like the cancel token, so the
+segment workers of a mix are profiled too. When the job ends its
+artifacts are written to the session's profiles/ directory:
+
+- <id>.json: wall and CPU time, peak traced memory and the file list
+- <id>.pstats: the CPU profile, for pstats or snakeviz
+- <id>-cpu.txt: the CPU profile's top functions by cumulative time
+- <id>-memory.txt: peak memory and the lines whose allocations grew most
+
+Both profilers are process-wide underneath, so only one job per process
+is profiled at a time; a second request for a profile runs unprofiled.
+tracemalloc (and, since Python 3.12, cProfile) also sees whatever else
+the process does meanwhile, so each profile records the other jobs that
+overlapped it and is marked "exclusive": false if there were any; its
+numbers are then an upper bound for the job. Jobs that didn't ask for a
+profile cost one contextvar lookup per segment.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# Set to 0 to ignore profile requests
+PROFILING_ENABLED = os.environ.get("INTELLIMIX_PROFILING", "1") != "0"
+# Request header that asks for a profile of the request's job
+PROFILE_HEADER = "X-IntelliMix-Profile"
+# Where profiles go, relative to the session directory
+PROFILE_DIR = "profiles"
+# Stack depth tracemalloc records per allocation
+TRACEMALLOC_FRAMES = int(os.environ.get("INTELLIMIX_PROFILE_FRAMES", 10))
+# Lines of the text reports
+TOP_FUNCTIONS = 60
+TOP_ALLOCATIONS = 40
+
+_current_profile = contextvars.ContextVar("job_profile", default=None)
+_thread = threading.local()
+_profiling = threading.Lock()  # Held by the one job being profiled
+
+# Jobs running in this process, and the profile they'd overlap
+_jobs_lock = threading.Lock()
+_running_jobs = 0
+_active_profile = None
+
+
+class JobProfile:
+    """The CPU profile of one job, merged from every thread that worked on it"""
+
+    def __init__(self, directory, label):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.directory = directory
+        self.label = label
+        self.stats = None  # pstats.Stats
+        self.threads = 0
+        self.overlapping_jobs = 0  # Other jobs that ran during this one
+        self._lock = threading.Lock()
+
+    def add(self, profiler):
+        """Merge a finished thread's profiler into the job's profile"""
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.threads += 1
+
+    @property
+    def exclusive(self):
+        """Whether the job had the process to itself, so the profile is its alone"""
+        return self.overlapping_jobs == 0
+
+    def path(self, suffix):
+        return os.path.join(self.directory, f"{self.id}{suffix}")
+
+    def save(self, wall, cpu, peak, allocations):
+        """
+        Write the job's artifacts.
+
+        Returns:
+            dict: The summary, as saved in <id>.json
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        if self.stats is not None:
+            self.stats.dump_stats(self.path(".pstats"))
+            report = io.StringIO()
+            self.stats.stream = report
+            self.stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            with open(self.path("-cpu.txt"), "w") as f:
+                f.write(report.getvalue())
+            files += [f"{self.id}.pstats", f"{self.id}-cpu.txt"]
+
+        with open(self.path("-memory.txt"), "w") as f:
+            f.write(f"Peak traced memory: {peak / 2 ** 20:.1f} MiB\n")
+            f.write("Memory allocated during the job and still held at its end, by line:\n\n")
+            for stat in allocations[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        files.append(f"{self.id}-memory.txt")
+
+        summary = {
+            "id": self.id,
+            "label": self.label,
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "peak_traced_bytes": peak,
+            "threads": self.threads,
+            "exclusive": self.exclusive,
+            "overlapping_jobs": self.overlapping_jobs,
+            "files": files,
+        }
+        with open(self.path(".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+@contextmanager
+def job_profile(directory, label, enabled):
+    """
+    Profile the enclosed job if enabled.
+
+    Args:
+        directory (str): Where the artifacts are written
+        label (str): What the job is, e.g. the endpoint
+        enabled (bool): Whether the request asked for a profile
+
+    Yields:
+        JobProfile, or None if the job isn't profiled
+    """
+    with _running_job():
+        if not (enabled and PROFILING_ENABLED):
+            yield None
+            return
+        if not _profiling.acquire(blocking=False):
+            print(f"Another job is being profiled, running {label} without a profile")
+            yield None
+            return
+        with _recording(JobProfile(directory, label)) as profile:
+            yield profile
+
+
+@contextmanager
+def _running_job():
+    """Count a job as running, and as overlapping the profile being recorded if there is one"""
+    global _running_jobs
+    with _jobs_lock:
+        _running_jobs += 1
+        if _active_profile is not None:
+            _active_profile.overlapping_jobs += 1
+    try:
+        yield
+    finally:
+        with _jobs_lock:
+            _running_jobs -= 1
+
+
+@contextmanager
+def _recording(profile):
+    """Run the profilers over the enclosed job; the caller holds _profiling"""
+    global _active_profile
+    with _jobs_lock:
+        # Jobs already running overlap it too
+        profile.overlapping_jobs = _running_jobs - 1
+        _active_profile = profile
+    label = profile.label
+    token = _current_profile.set(profile)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        with thread_profile():
+            yield profile
+    finally:
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        _current_profile.reset(token)
+        with _jobs_lock:
+            _active_profile = None
+        try:
+            # The profilers' own bookkeeping isn't the job's memory
+            ignored = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, pstats, cProfile)]
+            allocations = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+            profile.save(wall, cpu, peak, allocations)
+            shared = "" if profile.exclusive else f", overlapped by {profile.overlapping_jobs} other job(s)"
+            print(f"Saved profile {profile.id} of {label} ({wall:.1f}s, peak {peak / 2 ** 20:.1f} MiB{shared})")
+        except Exception as e:
+            print(f"Saving profile {profile.id} failed: {e}")
+        finally:
+            _profiling.release()
+
+
+@contextmanager
+def thread_profile():
+    """Add this thread's work in the enclosed block to the current job's CPU profile, if any"""
+    profile = _current_profile.get()
+    if profile is None or getattr(_thread, "active", False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Since Python 3.12 one profiler already sees every thread
+        yield
+        return
+    _thread.active = True
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _thread.active = False
+        profile.add(profiler)
+
+
+def list_profiles(directory):
+    """Summaries of the profiles saved in a directory, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                pass  # Still being written
+    return summaries
@@ -0,0 +1,233 @@
+"""
+Cache of finished mixes, shared by every session.
+
+The same mix is often requested by many users (a CSV template, a shared
+playlist, the same AI plan). A mix is identified by a canonical hash of
+its ordered sources and segment times, the crossfade and the encode
+profile, and a finished render is kept under that hash:
+
+    key = mix_key(url_start_end, crossfade=3000, profile=ENCODE_PROFILE)
+    output_file = render_cache.get(key, output_dir)
+    if output_file is None:
+        output_file = build_mix(...)
+        render_cache.put(key, output_file)
+
+A hit hardlinks the cached file into the session's output directory, so
+serving it costs the same however long the mix is. What the render
+reported about its inputs (e.g. plan diagnostics) can be kept beside the
+mix with put(key, output_file, meta) and read back with meta(key). Renders never modify
+an output file in place, so sessions and the cache can share one inode.
+The least recently used entries are dropped once the cache is over size.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("INTELLIMIX_RENDER_CACHE_DIR", "render_cache")
+MAX_BYTES = int(float(os.environ.get("INTELLIMIX_RENDER_CACHE_MB", 2048)) * 2 ** 20)
+# Bump when a change to the pipeline changes what the same mix sounds like
+RENDER_VERSION = 1
+
+
+def link_or_copy(source, destination):
+    """Hardlink a file into place, falling back to a copy across filesystems"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def canonical_source(url):
+    """Identify a source by its video id, so different URL forms of one video match"""
+    url = str(url).strip()
+    try:
+        from pytubefix import extract
+        return f"youtube:{extract.video_id(url)}"
+    except Exception:
+        return url
+
+
+def mix_key(url_start_end, crossfade, profile):
+    """
+    Canonical hash of a mix specification.
+
+    Items are hashed as they're read, so a generator (e.g. a CSV being read)
+    is never held in memory.
+
+    Args:
+        url_start_end (iterable): [url, start_seconds, end_seconds] items in play order
+        crossfade (int): Crossfade in milliseconds
+        profile (dict): Encoder settings that affect the output bytes
+
+    Returns:
+        str: Hex digest identifying the mix
+    """
+    digest = hashlib.sha256()
+    header = {"version": RENDER_VERSION, "crossfade": crossfade, "profile": profile}
+    digest.update(json.dumps(header, sort_keys=True).encode())
+    for url, start, end in url_start_end:
+        # 90, "90" and 90.0 are the same segment
+        item = [canonical_source(url), round(float(start), 3), round(float(end), 3)]
+        digest.update(b"\n" + json.dumps(item).encode())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Size-bounded LRU store of finished mixes on disk.
+
+    Recency is kept in each file's modification time, so it survives
+    restarts and is shared by worker processes using the same directory.
+
+    Args:
+        cache_dir (str): Directory holding the cached mixes
+        max_bytes (int): Total size kept before the least recently used mixes are dropped
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self):
+        """Index mixes left by earlier runs, oldest use first"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".mp3") and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+            elif entry.name.startswith(".tmp-"):
+                os.remove(entry.path)  # Left by a put that didn't finish
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self._evict()
+
+    def get(self, key, output_dir):
+        """
+        Link a cached mix into output_dir.
+
+        Returns:
+            str: Path of the mix in output_dir, or None if it isn't cached
+        """
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries and os.path.exists(path):
+                # Cached by another worker process since we looked
+                self._entries[key] = os.path.getsize(path)
+                self._bytes += self._entries[key]
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_file = os.path.join(output_dir, f"combined_audio_{int(time.time())}.mp3")
+        if os.path.exists(output_file):
+            output_file = os.path.join(output_dir, f"combined_audio_{int(time.time())}_{uuid.uuid4().hex[:4]}.mp3")
+        try:
+            link_or_copy(path, output_file)
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker process
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        print(f"Serving cached mix {key[:12]}")
+        return output_file
+
+    def meta(self, key):
+        """What was stored with a cached mix by put(), or None"""
+        try:
+            with open(self._meta_path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, output_file, meta=None):
+        """
+        Keep a finished mix under its key, evicting old mixes if over size.
+
+        Args:
+            key (str): The mix's key
+            output_file (str): The rendered mix
+            meta (dict, optional): JSON-serializable details to keep with it, for meta()
+        """
+        size = os.path.getsize(output_file)
+        if size > self.max_bytes:
+            return
+        if meta is not None:
+            # Written first, so a reader that finds the mix finds its details too
+            temp_meta = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+            with open(temp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(temp_meta, self._meta_path(key))
+        temp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        link_or_copy(output_file, temp_path)
+        # Atomic, so readers never see a partial file
+        os.replace(temp_path, self._path(key))
+        os.utime(self._path(key))
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._bytes += size
+            self._evict()
+
+    def _forget(self, key):
+        """Drop an entry from the index (caller holds the lock)"""
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _evict(self):
+        """Remove least recently used mixes until under max_bytes (caller holds the lock or is __init__)"""
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            for path in (self._path(key), self._meta_path(key)):
+                try:
+                    # Sessions holding a hardlink keep their copy
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+render_cache = RenderCache()
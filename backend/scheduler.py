@@ -0,0 +1,253 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from cancellation import Cancelled, current_token
+
+# Priority classes, most urgent first
+PRIORITIES = {"interactive": 0, "normal": 1, "bulk": 2}
+# How often queued work checks whether its job was cancelled
+CANCEL_POLL_SECONDS = 0.5
+
+# (session_id, priority) of the job running in this thread
+_current_job = contextvars.ContextVar("current_job", default=(None, "normal"))
+
+
+class SchedulerBusy(Exception):
+    """Raised when a scheduler's queue is full and new work must back off"""
+
+    def __init__(self, name, queued, retry_after=5):
+        super().__init__(f"{name} queue is full ({queued} jobs waiting), try again shortly")
+        self.retry_after = retry_after
+
+
+@contextmanager
+def scheduled_job(session_id, priority="normal"):
+    """
+    Attribute all scheduled work in the enclosed block to a session.
+
+    Args:
+        session_id (str): Session the work is done for; sessions take turns
+        priority (str): One of PRIORITIES; more urgent classes go first
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}")
+    token = _current_job.set((session_id, priority))
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def default_transcode_slots():
+    """
+    Number of concurrent transcodes for this process.
+
+    INTELLIMIX_TRANSCODE_SLOTS wins if set; otherwise the machine's cores are
+    split evenly between the server's worker processes.
+    """
+    configured = os.environ.get("INTELLIMIX_TRANSCODE_SLOTS")
+    if configured:
+        return max(1, int(configured))
+    workers = max(1, int(os.environ.get("INTELLIMIX_WORKERS", 1)))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+class _Waiter:
+    def __init__(self, session_id, priority):
+        self.session_id = session_id
+        self.priority = priority
+        self.queued_at = time.perf_counter()
+        self.ready = threading.Event()
+
+
+class WorkScheduler:
+    """
+    Cap how many units of a kind of work run at once in this process.
+
+    When every slot is busy, waiting work is ordered by priority class and
+    then round-robin across sessions, so one session with hundreds of queued
+    units only gets every n-th free slot. Work that has waited longer than
+    aging_seconds is served next regardless of class so bulk jobs still
+    progress. Once max_queue units are waiting, new ones are rejected with
+    SchedulerBusy instead of piling up. Work of a cancelled job leaves the
+    queue within CANCEL_POLL_SECONDS rather than waiting for its turn.
+    """
+
+    def __init__(self, name, slots=default_transcode_slots, max_queue=64, aging_seconds=30):
+        self.name = name
+        self._slots = slots  # int, or a callable resolved on first use after serving config is known
+        self.max_queue = max_queue
+        self.aging_seconds = aging_seconds
+        self.active = 0
+        self.queued = 0
+        # priority -> OrderedDict(session_id -> deque of _Waiter); dict order is the turn order
+        self.queues = {rank: OrderedDict() for rank in PRIORITIES.values()}
+        self.lock = threading.Lock()
+
+        # Counters for stats()
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.active_by_kind = {}
+
+    @property
+    def slots(self):
+        if callable(self._slots):
+            self._slots = self._slots()
+        return self._slots
+
+    def _enqueue(self, waiter):
+        sessions = self.queues[PRIORITIES[waiter.priority]]
+        if waiter.session_id not in sessions:
+            sessions[waiter.session_id] = deque()
+        sessions[waiter.session_id].append(waiter)
+        self.queued += 1
+
+    def _remove(self, waiter):
+        """Take a waiter out of the queue before its turn"""
+        sessions = self.queues[PRIORITIES[waiter.priority]]
+        session_waiters = sessions[waiter.session_id]
+        session_waiters.remove(waiter)
+        if not session_waiters:
+            del sessions[waiter.session_id]
+        self.queued -= 1
+
+    def _dequeue(self):
+        """Pick the next waiter: aged work first, then by class, round-robin across sessions"""
+        chosen = None
+        cutoff = time.perf_counter() - self.aging_seconds
+        for sessions in self.queues.values():
+            for session_waiters in sessions.values():
+                head = session_waiters[0]
+                if head.queued_at < cutoff and (chosen is None or head.queued_at < chosen.queued_at):
+                    chosen = head
+
+        if chosen is None:
+            for sessions in self.queues.values():
+                if sessions:
+                    chosen = next(iter(sessions.values()))[0]
+                    break
+
+        sessions = self.queues[PRIORITIES[chosen.priority]]
+        session_waiters = sessions[chosen.session_id]
+        session_waiters.popleft()
+        # The session goes to the back of the line for its next unit
+        del sessions[chosen.session_id]
+        if session_waiters:
+            sessions[chosen.session_id] = session_waiters
+        self.queued -= 1
+        return chosen
+
+    def _acquire(self):
+        """
+        Take a slot, waiting for this session's turn if none is free.
+
+        Returns:
+            float: Seconds waited
+
+        Raises:
+            SchedulerBusy: If the queue is full
+            Cancelled: If the job is cancelled while its work is queued
+        """
+        session_id, priority = _current_job.get()
+        token = current_token()
+        with self.lock:
+            if self.active < self.slots and not self.queued:
+                self.active += 1
+                return 0.0
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy(self.name, self.queued)
+            waiter = _Waiter(session_id, priority)
+            self._enqueue(waiter)
+
+        # The releasing thread hands its slot straight to us
+        while not waiter.ready.wait(CANCEL_POLL_SECONDS):
+            if token is None or not token.cancelled:
+                continue
+            with self.lock:
+                handed_over = waiter.ready.is_set()
+                if not handed_over:
+                    self._remove(waiter)
+                self.cancelled += 1
+            if handed_over:
+                # The slot arrived along with the cancellation; pass it on
+                self._release(completed=False)
+            raise Cancelled(token)
+        return time.perf_counter() - waiter.queued_at
+
+    def _release(self, completed=True):
+        with self.lock:
+            self.completed += completed
+            if self.queued:
+                self._dequeue().ready.set()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self, kind="work"):
+        """
+        Run the enclosed block in one of the scheduler's slots.
+
+        The session and priority come from the surrounding scheduled_job() block.
+
+        Args:
+            kind (str): Label for the work, reported in stats()
+        """
+        waited = self._acquire()
+        with self.lock:
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.active_by_kind[kind] = self.active_by_kind.get(kind, 0) + 1
+        if waited > 1:
+            print(f"{self.name}: {kind} waited {waited:.1f}s for a slot")
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active_by_kind[kind] -= 1
+            self._release()
+
+    def stats(self):
+        """Return current load and wait-time figures"""
+        with self.lock:
+            started = self.completed + self.active
+            queued_by_priority = {
+                name: sum(len(w) for w in self.queues[rank].values())
+                for name, rank in PRIORITIES.items()
+            }
+            return {
+                "name": self.name,
+                "slots": self.slots,
+                "active": self.active,
+                "active_by_kind": {k: v for k, v in self.active_by_kind.items() if v},
+                "queued": self.queued,
+                "queued_by_priority": queued_by_priority,
+                "queued_sessions": sum(len(sessions) for sessions in self.queues.values()),
+                "max_queue": self.max_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_wait_ms": round(1000 * self.total_wait / started, 1) if started else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 1),
+            }
+
+
+# Process-wide limit on ffmpeg decode/encode work (pydub and moviepy)
+transcode_scheduler = WorkScheduler(
+    "transcode",
+    max_queue=int(os.environ.get("INTELLIMIX_TRANSCODE_QUEUE", 64)),
+)
+
+# Process-wide limit on concurrent media downloads
+download_scheduler = WorkScheduler(
+    "download",
+    slots=int(os.environ.get("INTELLIMIX_DOWNLOAD_SLOTS", 8)),
+    max_queue=int(os.environ.get("INTELLIMIX_DOWNLOAD_QUEUE", 256)),
+)
@@ -0,0 +1,243 @@
+"""
+Memory-backed scratch space for intermediate files, spilling to disk.
+
+Downloads, trimmed segments and the other intermediates of a render are
+written once, read back once or twice by ffmpeg and deleted minutes
+later, so they needn't touch the disk. Each such file has a home path in
+the session directory; while the RAM area has room, its bytes live at the
+same path mirrored under the RAM area instead:
+
+    with scratch.place(os.path.join(temp_dir, "0.m4a"), expected_bytes) as path:
+        download to path  # in RAM, or the home path once the budget is used up
+
+    source = scratch.locate(os.path.join(temp_dir, "0.m4a"))  # wherever it went
+
+Intermediates are handed to ffmpeg by path, so the RAM area is a tmpfs
+(/dev/shm on Linux) rather than buffers in this process. Its budget
+covers every file under it, so it's shared by all worker processes using
+the same directory. Without a tmpfs (Windows, macOS) or with a budget of
+0, every file goes to its home path.
+
+Each process keeps a running count of the area's bytes: a scan of the
+whole area, plus the files this process placed and released since. The
+scan is redone by the first place() after RESCAN_SECONDS (and by every
+prune()), so files of other workers are counted at most that late; the
+budget can be overshot by what the other workers write in that window,
+which MIN_FREE_BYTES keeps clear of the tmpfs running full.
+
+Deleting a session directory, or clearing one, must also clear its mirror
+(clear()), and an intermediate that's done with is deleted with release();
+mirrors whose home directory is gone are pruned periodically.
+"""
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# Where the RAM area lives; a tmpfs by default where there is one
+RAM_DIR = os.environ.get("INTELLIMIX_SCRATCH_DIR") or ("/dev/shm/intellimix" if os.path.isdir("/dev/shm") else None)
+# Bytes of intermediates kept in RAM before new ones go to disk
+BUDGET_BYTES = int(float(os.environ.get("INTELLIMIX_SCRATCH_MB", 256)) * 2 ** 20)
+# Free space left on the RAM filesystem, which other programs share
+MIN_FREE_BYTES = 64 * 2 ** 20
+# Longest a process goes without re-scanning the RAM area for other workers' files
+RESCAN_SECONDS = float(os.environ.get("INTELLIMIX_SCRATCH_RESCAN_SECONDS", 5))
+
+
+class ScratchSpace:
+    """
+    Places intermediate files in RAM up to a budget, and on disk beyond it.
+
+    Args:
+        ram_dir (str): Root of the RAM area, or None to keep everything on disk
+        budget_bytes (int): Bytes kept in the RAM area
+    """
+
+    def __init__(self, ram_dir=RAM_DIR, budget_bytes=BUDGET_BYTES):
+        self.ram_dir = os.path.abspath(ram_dir) if ram_dir and budget_bytes > 0 else None
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._reserved = 0  # Expected bytes of files this process is still writing to RAM
+        self._ram_bytes = 0  # Bytes in the RAM area as of the last scan, plus this process's changes since
+        self._placed = {}  # Mirror path -> bytes counted for it, of files this process placed in RAM
+        self._scanned_at = time.monotonic()
+        self.ram_files = 0
+        self.disk_files = 0
+        if self.ram_dir:
+            try:
+                os.makedirs(self.ram_dir, exist_ok=True)
+            except OSError as e:
+                print(f"Scratch space unavailable, intermediates go to disk: {e}")
+                self.ram_dir = None
+            else:
+                self._ram_bytes = self._scan()
+
+    def mirror(self, path):
+        """Where a home path's bytes live in the RAM area (whether or not they're there)"""
+        if not self.ram_dir:
+            return None
+        _, tail = os.path.splitdrive(os.path.abspath(path))
+        return os.path.join(self.ram_dir, tail.lstrip("\\/"))
+
+    def usage(self):
+        """Bytes of files in the RAM area, from every process using it as of the last scan"""
+        return self._ram_bytes
+
+    def _rescan(self):
+        """Start the running count over from what's in the RAM area (caller holds the lock)"""
+        placed = {}
+        for mirror in self._placed:
+            try:
+                placed[mirror] = os.lstat(mirror).st_size
+            except OSError:
+                pass  # Deleted without release()
+        self._placed = placed
+        self._ram_bytes = self._scan()
+        self._scanned_at = time.monotonic()
+
+    def _scan(self):
+        """Bytes of files in the RAM area, by walking it"""
+        if not self.ram_dir:
+            return 0
+        total = 0
+        for root, dirs, files in os.walk(self.ram_dir):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass  # Removed while walking
+        return total
+
+    def _forget(self, mirror):
+        """Take a mirror's bytes out of the count before it's deleted or rewritten (caller holds the lock)"""
+        size = self._placed.pop(mirror, None)
+        if size is None:
+            # Counted by the last scan, if it was there then
+            try:
+                size = os.lstat(mirror).st_size
+            except OSError:
+                size = 0
+        self._ram_bytes -= size
+
+    def _has_room(self, expected_bytes):
+        """Whether another expected_bytes fit in RAM (caller holds the lock)"""
+        if self.usage() + self._reserved + expected_bytes > self.budget_bytes:
+            return False
+        if not hasattr(os, "statvfs"):
+            return True
+        stat = os.statvfs(self.ram_dir)
+        return stat.f_bavail * stat.f_frsize - expected_bytes >= MIN_FREE_BYTES
+
+    @contextmanager
+    def place(self, path, expected_bytes):
+        """
+        Decide where a new intermediate file is written.
+
+        Args:
+            path (str): The file's home path
+            expected_bytes (int): About how big it will get
+
+        Yields:
+            str: The path to write it to, in RAM or the home path
+        """
+        expected_bytes = max(0, int(expected_bytes or 0))
+        mirror = self.mirror(path)
+        with self._lock:
+            if mirror is not None and time.monotonic() - self._scanned_at >= RESCAN_SECONDS:
+                # Pick up what the other workers wrote and deleted meanwhile
+                self._rescan()
+            in_ram = mirror is not None and self._has_room(expected_bytes)
+            if in_ram:
+                self._reserved += expected_bytes
+                self.ram_files += 1
+            else:
+                self.disk_files += 1
+            if mirror is not None and (mirror in self._placed or os.path.exists(mirror)):
+                # Rewritten in place, or removed below
+                self._forget(mirror)
+        # A file from an earlier render in the other place would shadow or duplicate this one
+        stale = path if in_ram else mirror
+        if stale and os.path.exists(stale):
+            os.remove(stale)
+        target = mirror if in_ram else path
+        # The home directory too, or prune() would take the mirror for an orphan
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        try:
+            yield target
+        finally:
+            if in_ram:
+                try:
+                    size = os.path.getsize(mirror)
+                except OSError:
+                    size = 0  # Not written, or already removed
+                with self._lock:
+                    self._reserved -= expected_bytes
+                    self._ram_bytes += size
+                    self._placed[mirror] = size
+
+    def locate(self, path):
+        """Where the file with this home path is: its mirror in RAM if it's there, else the path itself"""
+        mirror = self.mirror(path)
+        if mirror and os.path.exists(mirror):
+            return mirror
+        return path
+
+    def release(self, path):
+        """Delete an intermediate file, given its home path or the path place() yielded for it"""
+        path = os.path.abspath(path)
+        if self.ram_dir and path.startswith(self.ram_dir + os.sep):
+            mirror, candidates = path, [path]
+        else:
+            mirror = self.mirror(path)
+            candidates = [c for c in (mirror, path) if c]
+        if mirror:
+            with self._lock:
+                self._forget(mirror)
+        for candidate in candidates:
+            try:
+                os.remove(candidate)
+            except FileNotFoundError:
+                pass
+
+    def clear(self, directory):
+        """Delete the RAM mirror of a directory and everything in it"""
+        mirror = self.mirror(directory)
+        if mirror and os.path.isdir(mirror):
+            with self._lock:
+                for root, dirs, files in os.walk(mirror):
+                    for name in files:
+                        self._forget(os.path.join(root, name))
+                # Placed files already deleted by hand
+                prefix = mirror.rstrip(os.sep) + os.sep
+                for placed in [p for p in self._placed if p.startswith(prefix)]:
+                    self._forget(placed)
+            shutil.rmtree(mirror, ignore_errors=True)
+
+    def prune(self):
+        """Delete mirrors whose home directory no longer exists, e.g. of sessions deleted by another process"""
+        if not self.ram_dir:
+            return
+        for root, dirs, files in os.walk(self.ram_dir):
+            home = os.sep + os.path.relpath(root, self.ram_dir) if root != self.ram_dir else os.sep
+            if root != self.ram_dir and not os.path.isdir(home):
+                shutil.rmtree(root, ignore_errors=True)
+                dirs[:] = []
+
+        with self._lock:
+            self._rescan()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ram_dir": self.ram_dir,
+                "budget_bytes": self.budget_bytes if self.ram_dir else 0,
+                "ram_bytes": self.usage(),
+                "reserved_bytes": self._reserved,
+                "ram_files": self.ram_files,
+                "disk_files": self.disk_files,
+            }
+
+
+scratch = ScratchSpace()
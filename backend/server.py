@@ -0,0 +1,273 @@
+"""
+Production serving for the IntelliMix API.
+
+Runs the Flask app on a production WSGI server instead of the Werkzeug
+development server:
+
+- gunicorn with threaded workers when more than one worker process is
+  requested (Linux/macOS only)
+- waitress in a single process with a thread pool otherwise, or the
+  threaded Werkzeug server if waitress isn't installed
+
+Settings come from arguments or INTELLIMIX_* environment variables. On
+shutdown the server stops accepting connections and waits for in-flight
+requests to finish before exiting.
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+
+# Optional production servers
+try:
+    from gunicorn.app.base import BaseApplication
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    GUNICORN_AVAILABLE = False
+
+try:
+    from waitress.server import create_server as create_waitress_server
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+
+def get_config(**overrides):
+    """
+    Resolve serving settings from overrides, then environment, then defaults.
+
+    Returns:
+        dict: host, port, workers, threads, keepalive and graceful_timeout
+    """
+    defaults = {
+        "host": os.environ.get("INTELLIMIX_HOST", "127.0.0.1"),
+        "port": int(os.environ.get("INTELLIMIX_PORT", 5000)),
+        "workers": int(os.environ.get("INTELLIMIX_WORKERS", 1)),
+        "threads": int(os.environ.get("INTELLIMIX_THREADS", 8)),
+        "keepalive": int(os.environ.get("INTELLIMIX_KEEPALIVE", 5)),
+        "graceful_timeout": int(os.environ.get("INTELLIMIX_GRACEFUL_TIMEOUT", 30)),
+    }
+    defaults.update({k: v for k, v in overrides.items() if v is not None})
+    return defaults
+
+
+class InFlightTracker:
+    """Count requests currently being handled so shutdown can wait for them"""
+
+    def __init__(self):
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def install(self, app):
+        """Hook the tracker into a Flask app's request lifecycle"""
+        @app.before_request
+        def _request_started():
+            with self.condition:
+                self.count += 1
+
+        @app.teardown_request
+        def _request_finished(exc=None):
+            with self.condition:
+                self.count -= 1
+                self.condition.notify_all()
+
+        return self
+
+    def wait_idle(self, timeout):
+        """
+        Block until no requests are in flight.
+
+        Returns:
+            bool: True if drained, False if the timeout was hit
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.count > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+# Process-wide tracker; app.py installs it on the Flask app
+in_flight = InFlightTracker()
+
+# Seconds given to the server's I/O loop to send the last bytes before it's closed
+FLUSH_GRACE_SECONDS = 0.2
+
+
+class ThreadedServer:
+    """A single-process server with a thread pool and graceful shutdown"""
+
+    def __init__(self, app, host="127.0.0.1", port=5000, threads=8, keepalive=5, graceful_timeout=30):
+        self.graceful_timeout = graceful_timeout
+        self.closing = False
+        self.lock = threading.Lock()
+
+        if WAITRESS_AVAILABLE:
+            self.kind = "waitress"
+            # Idle keep-alive connections are closed after channel_timeout;
+            # channels with a request still running are never timed out.
+            # Reading ahead lets waitress notice a client that disconnects
+            # mid-request, so its job can be cancelled (see cancellation.py)
+            self.server = create_waitress_server(
+                app, host=host, port=port, threads=threads,
+                channel_timeout=keepalive, cleanup_interval=max(keepalive, 1),
+                channel_request_lookahead=1
+            )
+        else:
+            from werkzeug.serving import WSGIRequestHandler, make_server
+
+            # HTTP/1.1 enables keep-alive on the Werkzeug server
+            class KeepAliveHandler(WSGIRequestHandler):
+                protocol_version = "HTTP/1.1"
+
+            self.kind = "werkzeug"
+            self.server = make_server(host, port, app, threaded=True, request_handler=KeepAliveHandler)
+
+    def serve_forever(self):
+        """Serve until shutdown() is called"""
+        print(f"Serving with {self.kind} (single process)")
+        try:
+            if self.kind == "waitress":
+                self.server.run()
+            else:
+                self.server.serve_forever()
+        except OSError:
+            # Closing the sockets interrupts the waitress poll loop
+            if not self.closing:
+                raise
+
+    def shutdown(self):
+        """Stop accepting connections, drain in-flight requests, then close"""
+        with self.lock:
+            if self.closing:
+                return
+            self.closing = True
+
+        print("Shutting down: waiting for in-flight requests to finish...")
+        if self.kind == "waitress":
+            self.server.accepting = False
+        else:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+        deadline = time.time() + self.graceful_timeout
+        if not in_flight.wait_idle(self.graceful_timeout):
+            print(f"Graceful timeout ({self.graceful_timeout}s) reached with requests still running")
+        elif self.kind == "waitress":
+            self._wait_flushed(deadline)
+
+        if self.kind == "waitress":
+            self.server.close()
+        else:
+            self.server.server_close()
+        print("Server stopped")
+
+    def _wait_flushed(self, deadline):
+        """
+        Wait for waitress to finish writing the responses of drained requests.
+
+        A request leaves in_flight when the app returns, before waitress has
+        written the response; closing then would cut the response off and
+        fail the service thread's wake-up of the closed I/O loop.
+        """
+        while time.time() < deadline:
+            channels = list(self.server.active_channels.values())
+            if not any(channel.requests or channel.total_outbufs_len for channel in channels):
+                break
+            time.sleep(0.05)
+        time.sleep(FLUSH_GRACE_SECONDS)
+
+
+if GUNICORN_AVAILABLE:
+    class GunicornServer(BaseApplication):
+        """Embed gunicorn so the app can be served from Python with several workers"""
+
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def serve(app, **overrides):
+    """
+    Serve the app until interrupted, draining in-flight requests on exit.
+
+    Accepts the same keys as get_config(). Must be called from the main
+    thread because it installs signal handlers.
+    """
+    config = get_config(**overrides)
+    # Let other modules size their pools to the per-process share of the machine
+    os.environ["INTELLIMIX_WORKERS"] = str(config["workers"])
+
+    print(f"IntelliMix listening on http://{config['host']}:{config['port']} "
+          f"({config['workers']} worker(s) x {config['threads']} thread(s))")
+
+    if config["workers"] > 1:
+        if GUNICORN_AVAILABLE:
+            GunicornServer(app, {
+                "bind": f"{config['host']}:{config['port']}",
+                "workers": config["workers"],
+                "threads": config["threads"],
+                "worker_class": "gthread",
+                "keepalive": config["keepalive"],
+                "graceful_timeout": config["graceful_timeout"],
+                # Renders can run for minutes; rely on graceful_timeout for shutdown
+                "timeout": 0,
+            }).run()
+            return
+        print("Warning: gunicorn not available, falling back to a single process")
+
+    server = ThreadedServer(
+        app,
+        host=config["host"],
+        port=config["port"],
+        threads=config["threads"],
+        keepalive=config["keepalive"],
+        graceful_timeout=config["graceful_timeout"],
+    )
+
+    def handle_signal(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    server.serve_forever()
+
+
+def add_arguments(parser):
+    """Add the serving options to an argparse parser"""
+    parser.add_argument("--host", help="Interface to bind (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="Port to bind (default 5000)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default 1)")
+    parser.add_argument("--threads", type=int, help="Threads per worker (default 8)")
+    parser.add_argument("--keepalive", type=int, help="Seconds to keep idle connections open (default 5)")
+    parser.add_argument("--graceful-timeout", type=int, help="Seconds to wait for in-flight requests on shutdown (default 30)")
+    return parser
+
+
+def config_from_args(args):
+    """Turn parsed arguments into serve() overrides"""
+    return {
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "threads": args.threads,
+        "keepalive": args.keepalive,
+        "graceful_timeout": args.graceful_timeout,
+    }
+
+
+if __name__ == "__main__":
+    args = add_arguments(argparse.ArgumentParser(description="Serve the IntelliMix API")).parse_args()
+    from app import app
+    serve(app, **config_from_args(args))
@@ -2,244 +2,478 @@ import os
 import uuid
 import shutil
 import time
+import sqlite3
 import threading
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime
 import re
 
+from metrics import CLEANUP_SECONDS, SESSIONS_EXPIRED
+from scratch import scratch
+
+# A running job whose worker hasn't checked in for this long died with it
+JOB_HEARTBEAT_TIMEOUT = 15
+# Seconds a measurement of the sessions' disk usage is reused for
+DISK_USAGE_TTL = float(os.environ.get("INTELLIMIX_DISK_USAGE_TTL", 30))
+
 class SessionManager:
-    def __init__(self, base_dir="user_sessions", expiry_seconds=300):
+    """
+    Track user sessions in a SQLite registry shared by every server process.
+
+    The registry runs in WAL mode so readers never block the writer, and each
+    state change (touch, rehydrate, expire) is a single transaction. Only the
+    process holding the cleaner lease deletes expired sessions, so one worker
+    can never remove a session another worker is still using.
+    """
+
+    def __init__(self, base_dir="user_sessions", expiry_seconds=300, lease_seconds=30):
         self.base_dir = base_dir
         self.expiry_seconds = expiry_seconds
-        self.sessions = {}  # Dictionary to track active sessions
-        self.lock = threading.Lock()
-        
+        self.lease_seconds = lease_seconds
+        self.db_path = os.path.join(base_dir, "sessions.db")
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.local = threading.local()  # One SQLite connection per thread
+        self._disk_usage = None  # (monotonic time measured, bytes)
+        self._disk_usage_lock = threading.Lock()
+
         # Create base directory if it doesn't exist
         os.makedirs(base_dir, exist_ok=True)
-        
+        self._init_db()
+
         # Load existing sessions from disk
         self._load_existing_sessions()
-        
+
         # Start the cleanup thread
         self.cleanup_thread = threading.Thread(target=self._cleanup_expired_sessions, daemon=True)
         self.cleanup_thread.start()
-    
+
+        # Pre-forking servers copy this object into each worker process
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Give a forked worker its own identity, connections and cleanup thread"""
+        # SQLite connections must not be shared across a fork
+        self.local = threading.local()
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._disk_usage_lock = threading.Lock()
+        self.cleanup_thread = threading.Thread(target=self._cleanup_expired_sessions, daemon=True)
+        self.cleanup_thread.start()
+
+    def _connect(self):
+        """Get this thread's connection to the registry"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Autocommit mode; multi-statement updates use explicit transactions
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block under the registry's write lock"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _init_db(self):
+        """Create the registry tables if they don't exist"""
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " dir TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_accessed ON sessions (last_accessed)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cleaner_lease ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1),"
+            " holder TEXT NOT NULL,"
+            " expires REAL NOT NULL)"
+        )
+        # Running jobs, so a supersede or cancel reaches them from any worker
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " session_id TEXT NOT NULL,"
+            " worker TEXT NOT NULL,"
+            " seen REAL NOT NULL,"
+            " cancel_reason TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id)")
+
     def _load_existing_sessions(self):
-        """Load existing session directories if server was restarted"""
+        """Register session directories left on disk if the server was restarted"""
         print("Loading existing sessions from disk...")
         try:
             if os.path.exists(self.base_dir):
-                session_dirs = [d for d in os.listdir(self.base_dir) 
-                              if os.path.isdir(os.path.join(self.base_dir, d)) 
+                session_dirs = [d for d in os.listdir(self.base_dir)
+                              if os.path.isdir(os.path.join(self.base_dir, d))
                               and self._is_valid_uuid(d)]
-                
+
+                conn = self._connect()
                 loaded_count = 0
                 for session_id in session_dirs:
                     session_dir = os.path.join(self.base_dir, session_id)
-                    
+
                     # Try to determine last access time from directory metadata
                     try:
                         # Get the most recent file modification time in the session directory
                         last_modified = self._get_latest_modified_time(session_dir)
-                        
-                        # Add session to in-memory dictionary
-                        self.sessions[session_id] = {
-                            "created": datetime.fromtimestamp(os.path.getctime(session_dir)),
-                            "last_accessed": datetime.fromtimestamp(last_modified),
-                            "dir": session_dir
-                        }
-                        loaded_count += 1
+
+                        # Another worker may already have registered it; keep its entry
+                        cursor = conn.execute(
+                            "INSERT OR IGNORE INTO sessions (session_id, dir, created, last_accessed) VALUES (?, ?, ?, ?)",
+                            (session_id, session_dir, os.path.getctime(session_dir), last_modified)
+                        )
+                        loaded_count += cursor.rowcount
                     except Exception as e:
                         print(f"Error loading session {session_id}: {e}")
-                
+
                 print(f"Loaded {loaded_count} existing sessions")
         except Exception as e:
             print(f"Error scanning session directory: {e}")
-    
+
     def _is_valid_uuid(self, uuid_string):
         """Check if string is a valid UUID"""
         pattern = re.compile(
-            r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', 
+            r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$',
             re.IGNORECASE
         )
         return bool(pattern.match(uuid_string))
-    
+
     def _get_latest_modified_time(self, directory):
         """Get the most recent file modification time in a directory tree"""
         latest_time = os.path.getmtime(directory)
-        
+
         for root, dirs, files in os.walk(directory):
             for name in files:
                 file_path = os.path.join(root, name)
                 mod_time = os.path.getmtime(file_path)
                 if mod_time > latest_time:
                     latest_time = mod_time
-                    
+
             for name in dirs:
                 dir_path = os.path.join(root, name)
                 mod_time = os.path.getmtime(dir_path)
                 if mod_time > latest_time:
                     latest_time = mod_time
-                    
+
         return latest_time
-    
+
+    def _touch(self, session_id):
+        """Atomically refresh a session's last access time and return its directory"""
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE sessions SET last_accessed = ? WHERE session_id = ?",
+            (time.time(), session_id)
+        )
+        if cursor.rowcount == 0:
+            return None
+        row = conn.execute("SELECT dir FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
     def create_session(self):
         """Create a new session with unique directories"""
-        with self.lock:
-            session_id = str(uuid.uuid4())
-            session_dir = os.path.join(self.base_dir, session_id)
-            
-            # Create session directory structure
-            os.makedirs(session_dir, exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "temp"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "temp", "split"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "temp", "output"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "static", "video_dl"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "static", "audio_dl"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "static", "output"), exist_ok=True)
-            os.makedirs(os.path.join(session_dir, "csv"), exist_ok=True)
-            
-            # Record session with timestamp
-            self.sessions[session_id] = {
-                "created": datetime.now(),
-                "last_accessed": datetime.now(),
-                "dir": session_dir
-            }
-            
-            print(f"Created new session: {session_id}")
-            return session_id
-    
+        session_id = str(uuid.uuid4())
+        session_dir = os.path.join(self.base_dir, session_id)
+
+        # Create session directory structure
+        os.makedirs(session_dir, exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "temp"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "temp", "split"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "temp", "output"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "static", "video_dl"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "static", "audio_dl"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "static", "output"), exist_ok=True)
+        os.makedirs(os.path.join(session_dir, "csv"), exist_ok=True)
+
+        # Record session with timestamp
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO sessions (session_id, dir, created, last_accessed) VALUES (?, ?, ?, ?)",
+            (session_id, session_dir, now, now)
+        )
+
+        print(f"Created new session: {session_id}")
+        return session_id
+
     def get_session_dir(self, session_id):
         """Get the directory for a session and update last access time"""
-        with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id]["last_accessed"] = datetime.now()
-                # Also update the directory modification time to reflect access
-                try:
-                    os.utime(self.sessions[session_id]["dir"], None)
-                except Exception:
-                    pass  # Ignore errors updating directory time
-                return self.sessions[session_id]["dir"]
-                
-            # Session not found in dictionary, try to locate on disk
-            potential_dir = os.path.join(self.base_dir, session_id)
-            if os.path.exists(potential_dir) and self._is_valid_uuid(session_id):
-                # Rehydrate the session object
-                self.sessions[session_id] = {
-                    "created": datetime.fromtimestamp(os.path.getctime(potential_dir)),
-                    "last_accessed": datetime.now(),
-                    "dir": potential_dir
-                }
-                print(f"Rehydrated lost session: {session_id}")
-                return potential_dir
-                
+        session_dir = self._touch(session_id)
+        if session_dir:
+            # Also update the directory modification time to reflect access
+            try:
+                os.utime(session_dir, None)
+            except Exception:
+                pass  # Ignore errors updating directory time
+            return session_dir
+
+        # Session not in the registry, try to locate on disk
+        potential_dir = os.path.join(self.base_dir, session_id)
+        if not self._is_valid_uuid(session_id):
             return None
-    
+
+        # The write lock keeps the cleaner from removing the directory between
+        # the existence check and the insert
+        with self._transaction() as conn:
+            if not os.path.exists(potential_dir):
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, dir, created, last_accessed) VALUES (?, ?, ?, ?)",
+                (session_id, potential_dir, os.path.getctime(potential_dir), time.time())
+            )
+
+        print(f"Rehydrated lost session: {session_id}")
+        return potential_dir
+
+    def list_sessions(self):
+        """Return the ids of all registered sessions"""
+        rows = self._connect().execute("SELECT session_id FROM sessions ORDER BY created").fetchall()
+        return [row[0] for row in rows]
+
+    def disk_usage(self, max_age=DISK_USAGE_TTL):
+        """
+        Bytes taken by all session directories, including ones being deleted.
+
+        Walking every session is slow once there are many, so a measurement
+        is reused for max_age seconds; concurrent callers share one walk.
+        """
+        with self._disk_usage_lock:
+            if self._disk_usage is not None and time.monotonic() - self._disk_usage[0] < max_age:
+                return self._disk_usage[1]
+            total = self._measure_disk_usage()
+            self._disk_usage = (time.monotonic(), total)
+            return total
+
+    def _measure_disk_usage(self):
+        total = 0
+        for root, dirs, files in os.walk(self.base_dir):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass  # Removed while walking
+        return total
+
     def clear_session_temp(self, session_id):
         """Clear temporary files for a specific session"""
-        with self.lock:
-            if session_id in self.sessions:
-                temp_dir = os.path.join(self.sessions[session_id]["dir"], "temp")
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        try:
-                            os.remove(os.path.join(root, file))
-                        except Exception as e:
-                            print(f"Error removing file in session {session_id}: {e}")
-                            
-                # Update last access time
-                self.sessions[session_id]["last_accessed"] = datetime.now()
-    
+        session_dir = self._touch(session_id)
+        if session_dir:
+            temp_dir = os.path.join(session_dir, "temp")
+            for root, dirs, files in os.walk(temp_dir):
+                for file in files:
+                    try:
+                        os.remove(os.path.join(root, file))
+                    except Exception as e:
+                        print(f"Error removing file in session {session_id}: {e}")
+            # Intermediates kept in memory
+            scratch.clear(temp_dir)
+
     def clear_session_output(self, session_id):
         """Clear output files for a specific session"""
-        with self.lock:
-            if session_id in self.sessions:
-                session_dir = self.sessions[session_id]["dir"]
-                output_paths = [
-                    os.path.join(session_dir, "static", "video_dl"),
-                    os.path.join(session_dir, "static", "audio_dl"),
-                    os.path.join(session_dir, "static", "output"),
-                    os.path.join(session_dir, "temp", "output")
-                ]
-                
-                for path in output_paths:
-                    if os.path.exists(path):
-                        for root, dirs, files in os.walk(path):
-                            for file in files:
-                                try:
-                                    os.remove(os.path.join(root, file))
-                                except Exception as e:
-                                    print(f"Error removing output file in session {session_id}: {e}")
-                
-                # Update last access time
-                self.sessions[session_id]["last_accessed"] = datetime.now()
-    
-    def delete_session(self, session_id):
-        """Delete a session and its directories"""
-        with self.lock:
-            if session_id in self.sessions:
-                try:
-                    session_dir = self.sessions[session_id]["dir"]
-                    if os.path.exists(session_dir):
-                        shutil.rmtree(session_dir)
-                    del self.sessions[session_id]
-                    print(f"Deleted session {session_id}")
-                    return True
-                except Exception as e:
-                    print(f"Error deleting session {session_id}: {e}")
-            elif os.path.exists(os.path.join(self.base_dir, session_id)):
-                # Session exists on disk but not in memory
-                try:
-                    shutil.rmtree(os.path.join(self.base_dir, session_id))
-                    print(f"Deleted orphaned session directory {session_id}")
-                    return True
-                except Exception as e:
-                    print(f"Error deleting orphaned session {session_id}: {e}")
+        session_dir = self._touch(session_id)
+        if session_dir:
+            output_paths = [
+                os.path.join(session_dir, "static", "video_dl"),
+                os.path.join(session_dir, "static", "audio_dl"),
+                os.path.join(session_dir, "static", "output"),
+                os.path.join(session_dir, "temp", "output")
+            ]
+
+            for path in output_paths:
+                if os.path.exists(path):
+                    for root, dirs, files in os.walk(path):
+                        for file in files:
+                            try:
+                                os.remove(os.path.join(root, file))
+                            except Exception as e:
+                                print(f"Error removing output file in session {session_id}: {e}")
+
+    def delete_session(self, session_id, expired_before=None):
+        """
+        Delete a session and its directories.
+
+        Args:
+            session_id (str): Session to delete
+            expired_before (float, optional): Only delete a registered session if it
+                was last accessed before this timestamp, so a touch from another
+                worker wins over the cleaner
+
+        Returns:
+            bool: True if the session was deleted
+        """
+        graveyard = None
+        try:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT dir, last_accessed FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is not None and expired_before is not None and row[1] >= expired_before:
+                    return False
+
+                session_dir = row[0] if row else os.path.join(self.base_dir, session_id)
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+                # Rename under the write lock so a concurrent rehydrate can no
+                # longer find the directory once the row is gone
+                if os.path.exists(session_dir):
+                    graveyard = os.path.join(self.base_dir, f".{session_id}.{uuid.uuid4().hex[:8]}.deleting")
+                    os.rename(session_dir, graveyard)
+        except Exception as e:
+            print(f"Error deleting session {session_id}: {e}")
             return False
-    
+
+        if graveyard:
+            shutil.rmtree(graveyard, ignore_errors=True)
+        scratch.clear(session_dir)
+        if row is not None:
+            print(f"Deleted session {session_id}")
+            return True
+        if graveyard:
+            print(f"Deleted orphaned session directory {session_id}")
+            return True
+        return False
+
+    def start_job(self, session_id, job_id):
+        """
+        Record a job as running for a session, asking the session's other jobs to stop.
+
+        Returns:
+            list: Ids of the jobs it supersedes, in any worker
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE seen < ?", (now - JOB_HEARTBEAT_TIMEOUT,))
+            superseded = [row[0] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE session_id = ?", (session_id,)
+            ).fetchall()]
+            conn.execute(
+                "UPDATE jobs SET cancel_reason = ? WHERE session_id = ? AND cancel_reason IS NULL",
+                ("superseded by a newer request", session_id)
+            )
+            conn.execute(
+                "INSERT INTO jobs (job_id, session_id, worker, seen) VALUES (?, ?, ?, ?)",
+                (job_id, session_id, self.worker_id, now)
+            )
+        return superseded
+
+    def job_cancel_reason(self, job_id):
+        """Mark a running job as alive, and return why it was cancelled, or None if it wasn't"""
+        conn = self._connect()
+        cursor = conn.execute("UPDATE jobs SET seen = ? WHERE job_id = ?", (time.time(), job_id))
+        if cursor.rowcount == 0:
+            # Taken for dead after missing its heartbeats
+            return "lost track of by the session registry"
+        row = conn.execute("SELECT cancel_reason FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def cancel_jobs(self, session_id, reason):
+        """
+        Ask the session's running jobs to stop.
+
+        Returns:
+            bool: False if the session has no job running in any worker
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET cancel_reason = ? WHERE session_id = ? AND cancel_reason IS NULL AND seen >= ?",
+            (reason, session_id, time.time() - JOB_HEARTBEAT_TIMEOUT)
+        )
+        return cursor.rowcount > 0
+
+    def running_jobs(self, job_ids):
+        """How many of these jobs are still running (or cleaning up) in any worker"""
+        placeholders = ", ".join("?" * len(job_ids))
+        row = self._connect().execute(
+            f"SELECT COUNT(*) FROM jobs WHERE job_id IN ({placeholders}) AND seen >= ?",
+            (*job_ids, time.time() - JOB_HEARTBEAT_TIMEOUT)
+        ).fetchone()
+        return row[0]
+
+    def finish_job(self, job_id):
+        """Remove a job that has finished and cleaned up"""
+        self._connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def _acquire_cleaner_lease(self):
+        """Try to become (or stay) the single process that runs cleanup"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT holder, expires FROM cleaner_lease WHERE id = 1").fetchone()
+            if row is not None and row[0] != self.worker_id and row[1] >= now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cleaner_lease (id, holder, expires) VALUES (1, ?, ?)",
+                (self.worker_id, now + self.lease_seconds)
+            )
+        if row is None or row[0] != self.worker_id:
+            print(f"Worker {self.worker_id} elected as session cleaner")
+        return True
+
     def _cleanup_expired_sessions(self):
         """Background thread to clean up expired sessions"""
         print("Cleanup thread started!")
         cleanup_count = 0
-        
+
         while True:
             time.sleep(5)  # Check every 5 seconds for easier testing
+            try:
+                if not self._acquire_cleaner_lease():
+                    continue
+            except Exception as e:
+                print(f"Error acquiring cleaner lease: {e}")
+                continue
+
             cleanup_count += 1
-            now = datetime.now()
-            expired_sessions = []
-            
-            # First check in-memory sessions
-            with self.lock:
-                for session_id, session_data in list(self.sessions.items()):
-                    if now - session_data["last_accessed"] > timedelta(seconds=self.expiry_seconds):
-                        expired_sessions.append(session_id)
-            
-            # Delete expired in-memory sessions
+            started = time.perf_counter()
+            now = time.time()
+            cutoff = now - self.expiry_seconds
+
+            # First check registered sessions
+            expired_sessions = [row[0] for row in self._connect().execute(
+                "SELECT session_id FROM sessions WHERE last_accessed < ?", (cutoff,)
+            ).fetchall()]
+
+            # Delete expired sessions unless another worker touched them meanwhile
             for session_id in expired_sessions:
                 print(f"Cleaning up expired session: {session_id} (cleanup cycle #{cleanup_count})")
-                self.delete_session(session_id)
-            
-            # Now scan directory for orphaned sessions not in our dictionary
+                if self.delete_session(session_id, expired_before=cutoff):
+                    SESSIONS_EXPIRED.inc()
+
+            # Now scan directory for orphaned sessions not in the registry
             if cleanup_count % 12 == 0:  # Check disk every minute (12 * 5 seconds)
                 print("Scanning disk for orphaned sessions...")
                 try:
+                    registered = set(self.list_sessions())
                     for item in os.listdir(self.base_dir):
                         item_path = os.path.join(self.base_dir, item)
-                        if os.path.isdir(item_path) and self._is_valid_uuid(item) and item not in self.sessions:
+                        if item.startswith(".") and item.endswith(".deleting"):
+                            # Left behind by a crash between rename and rmtree
+                            shutil.rmtree(item_path, ignore_errors=True)
+                        elif os.path.isdir(item_path) and self._is_valid_uuid(item) and item not in registered:
                             # Check if directory is old based on modification time
                             last_modified = self._get_latest_modified_time(item_path)
-                            age_seconds = (now - datetime.fromtimestamp(last_modified)).total_seconds()
-                            
+                            age_seconds = (datetime.now() - datetime.fromtimestamp(last_modified)).total_seconds()
+
                             if age_seconds > self.expiry_seconds:
                                 print(f"Removing orphaned session directory: {item} (age: {age_seconds:.1f}s)")
-                                try:
-                                    shutil.rmtree(item_path)
-                                except Exception as e:
-                                    print(f"Error removing orphaned session: {e}")
+                                self.delete_session(item, expired_before=cutoff)
                 except Exception as e:
                     print(f"Error scanning for orphaned sessions: {e}")
-                
+                # Intermediates in memory of sessions deleted by a process that died first
+                scratch.prune()
+
+            CLEANUP_SECONDS.observe(time.perf_counter() - started)
+
             # Log activity periodically even if no sessions were removed
             if not expired_sessions and cleanup_count % 12 == 0:
-                active_count = len(self.sessions)
+                active_count = len(self.list_sessions())
                 print(f"Cleanup thread active, cycle #{cleanup_count}, {active_count} active sessions")
-
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+
+class _Call:
+    """A single in-flight execution that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.holders = 0  # Callers still using the result, for SingleFlight.hold()
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls onto one execution.
+
+    The first caller for a key runs the function; every caller that arrives
+    with the same key while it is still running blocks until it finishes and
+    receives the same result (or the same exception).
+
+    Calls are only coalesced within this process; identical calls in other
+    worker processes run on their own.
+    """
+
+    def __init__(self):
+        self.calls = {}  # key -> _Call for executions still in flight
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) once per key among concurrent callers.
+
+        Returns:
+            tuple: (result, shared) where shared is True if this caller joined
+            an execution started by someone else
+        """
+        result, shared, _ = self._do(key, fn, args, kwargs)
+        return result, shared
+
+    @contextmanager
+    def hold(self, key, fn, on_release, *args, **kwargs):
+        """
+        Like do(), but the result stays valid until every caller that got it is done with it.
+
+        Use it when the result is a resource the leader would otherwise free
+        or lose (e.g. a file in its own directory) before the callers that
+        joined it have copied it.
+
+        Args:
+            on_release (callable): Called with the result once, after the last
+                caller has left the block
+
+        Yields:
+            tuple: (result, shared), as do() returns
+        """
+        result, shared, call = self._do(key, fn, args, kwargs, holding=True)
+        try:
+            yield result, shared
+        finally:
+            with self.lock:
+                call.holders -= 1
+                last = call.holders == 0
+            if last:
+                on_release(result)
+
+    def _do(self, key, fn, args, kwargs, holding=False):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+            if holding:
+                # Counted on joining, so the leader can't release before a joiner is done
+                call.holders += 1
+
+        if not leader:
+            print(f"Joining in-flight job {key[:12]}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True, call
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, False, call
+
+    def in_flight(self):
+        """Return the number of executions currently running"""
+        with self.lock:
+            return len(self.calls)
+
+
+def make_key(namespace, payload, session_id=None):
+    """
+    Build a canonical key for a request payload.
+
+    Args:
+        namespace (str): Name of the operation, e.g. the endpoint
+        payload: JSON-serialisable request data
+        session_id (str, optional): Scope the key to one session; leave out to
+            coalesce across sessions
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    canonical = json.dumps(
+        {"op": namespace, "session": session_id, "payload": payload},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
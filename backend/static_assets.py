@@ -0,0 +1,132 @@
+"""
+In-memory serving of the built React bundle (static/dist).
+
+At startup every file in the bundle is read once, fingerprinted and, if it's
+compressible, gzip- and brotli-encoded once. Requests are then answered from
+the manifest without touching the filesystem:
+
+- content negotiation picks br, gzip or identity from Accept-Encoding
+- strong ETags per encoding, with 304 for a matching If-None-Match
+- hashed files under assets/ are cached as immutable for a year; everything
+  else (index.html) is revalidated on every load
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request
+
+# Optional brotli support
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "application/wasm",
+)
+MIN_COMPRESS_SIZE = 1024  # Smaller files aren't worth the extra header bytes
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+
+class _Asset:
+    def __init__(self, content_type, immutable):
+        self.content_type = content_type
+        self.immutable = immutable
+        self.variants = {}  # encoding ("identity", "gzip", "br") -> (body, etag)
+
+
+class StaticBundle:
+    """Manifest of pre-encoded static files, built once from a directory"""
+
+    def __init__(self, dist_dir):
+        self.dist_dir = dist_dir
+        self.assets = {}  # relative path (forward slashes) -> _Asset
+        self._build()
+
+    def _build(self):
+        if not os.path.isdir(self.dist_dir):
+            print(f"No frontend bundle at {self.dist_dir}, skipping static manifest")
+            return
+
+        raw_bytes = encoded_bytes = 0
+        for root, dirs, files in os.walk(self.dist_dir):
+            for name in files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self.dist_dir).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    body = f.read()
+
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                # Vite emits content-hashed file names under assets/
+                asset = _Asset(content_type, immutable=rel_path.startswith("assets/"))
+
+                digest = hashlib.sha1(body).hexdigest()[:20]
+                asset.variants["identity"] = (body, f'"{digest}"')
+                raw_bytes += len(body)
+
+                if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+                    gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+                    if len(gzipped) < len(body):
+                        asset.variants["gzip"] = (gzipped, f'"{digest}-gz"')
+                    if BROTLI_AVAILABLE:
+                        compressed = brotli.compress(body, quality=11)
+                        if len(compressed) < len(body):
+                            asset.variants["br"] = (compressed, f'"{digest}-br"')
+                    encoded_bytes += min(len(v[0]) for v in asset.variants.values())
+                else:
+                    encoded_bytes += len(body)
+
+                self.assets[rel_path] = asset
+
+        print(f"Static manifest: {len(self.assets)} files, "
+              f"{raw_bytes // 1024} KB raw, {encoded_bytes // 1024} KB best-encoded")
+
+    def __contains__(self, path):
+        return path in self.assets
+
+    def _choose_encoding(self, asset):
+        accepted = request.accept_encodings
+        for encoding in ("br", "gzip"):
+            if encoding in asset.variants and accepted[encoding] > 0:
+                return encoding
+        return "identity"
+
+    def response(self, path):
+        """
+        Build the response for a file in the bundle.
+
+        Returns:
+            flask.Response or None if the path isn't in the bundle
+        """
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+
+        encoding = self._choose_encoding(asset)
+        body, etag = asset.variants[encoding]
+
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE if asset.immutable else REVALIDATE_CACHE,
+            "ETag": etag,
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if request.if_none_match.contains(etag.strip('"')):
+            return Response(status=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, status=200, headers=headers, content_type=asset.content_type)
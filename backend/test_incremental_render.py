@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Splicing a re-rendered segment into an existing mix.
+
+Renders a short mix of synthetic tones, replaces its middle segment with
+one of a different length, and checks that the spliced MP3 decodes and is
+as long as a full render of the edited mix. Needs ffmpeg.
+"""
+import os
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from features.audio_merge import MP3_OPTIONS, crossfade_frames, merge_audio
+from features.incremental_render import RenderManifest, rerender_segment
+from features.mp3_frames import scan_frames
+
+CROSSFADE_MS = 500
+
+
+def tone(directory, name, frequency, seconds):
+    """A stereo segment file, encoded the way trimmed segments are"""
+    path = os.path.join(directory, f"{name}.mp3")
+    audio = Sine(frequency).to_audio_segment(duration=seconds * 1000, volume=-12).set_channels(2)
+    audio.export(path, format="mp3", parameters=MP3_OPTIONS)
+    return path
+
+
+def frames(path):
+    return int(AudioSegment.from_file(path, format="mp3").frame_count())
+
+
+def render(directory, files, manifest=None):
+    output_dir = os.path.join(directory, "output")
+    return merge_audio(files, crossfade_duration=CROSSFADE_MS, output_dir=output_dir, manifest=manifest)
+
+
+def test_rerendered_segment_is_spliced_into_the_mix(tmp_path):
+    segments_dir = str(tmp_path / "segments")
+    os.makedirs(segments_dir)
+    files = [tone(segments_dir, str(i), frequency, 3) for i, frequency in enumerate((220, 330, 440))]
+    items = [[f"tone-{i}", 0, 3] for i in range(len(files))]
+
+    manifest = RenderManifest(str(tmp_path / "render" / "manifest.json"))
+    output = render(str(tmp_path / "first"), files, manifest)
+    manifest.save(items, sources=files)
+    old_bytes = open(output, "rb").read()
+    # Where the stored tail before the middle segment starts; the mix before it can't change
+    untouched = manifest.segments[1]["tail_start"]
+
+    # The middle segment becomes a longer one of another pitch
+    edited = tone(segments_dir, "1-edit", 550, 4)
+    new_output = rerender_segment(manifest, 1, ["tone-1", 0, 4], edited, edited, str(tmp_path / "first" / "output"))
+    assert new_output != output and not os.path.exists(output)
+    assert RenderManifest.load(manifest.path).output == new_output
+
+    # The spliced file is a clean run of frames from start to end
+    new_bytes = open(new_output, "rb").read()
+    offsets, frame_size = scan_frames(new_bytes)
+    assert offsets[-1] == len(new_bytes)
+    # Everything before the edited segment is the old mix, byte for byte
+    prefix = scan_frames(old_bytes)[0][untouched // frame_size]
+    assert prefix > 0 and new_bytes[:prefix] == old_bytes[:prefix]
+
+    # It decodes to the length of the edited mix rendered from scratch, less
+    # the trim that aligns the edit to whole frames
+    full = render(str(tmp_path / "full"), [files[0], edited, files[2]])
+    trim = manifest.segments[1]["trim"]
+    assert 0 <= trim < frame_size
+    assert frames(new_output) == frames(full) - trim
+    assert manifest.data["total_frames"] == sum(frames(path) for path in (files[0], edited, files[2])) \
+        - 2 * crossfade_frames(CROSSFADE_MS, 44100) - trim
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Superseding and cancelling a session's job from another worker process.
+
+Two SessionManagers on one registry file stand in for two workers; each
+has its own JobRegistry, as each worker process would.
+"""
+import threading
+import time
+
+import cancellation
+from cancellation import Cancelled, JobRegistry, check_cancelled
+from session_manager import SessionManager
+
+
+def start_job(registry, session_id, events):
+    """Run a job in a thread that works until it's cancelled, then takes a while to clean up"""
+    started = threading.Event()
+
+    def run():
+        with registry.job(session_id):
+            started.set()
+            try:
+                while True:
+                    time.sleep(0.05)
+                    check_cancelled()
+            except Cancelled as e:
+                time.sleep(0.3)  # Removing partial files
+                events.append((str(e), time.monotonic()))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    return thread
+
+
+def make_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(cancellation, "JOB_POLL_SECONDS", 0.1)
+    first, second = SessionManager(str(tmp_path)), SessionManager(str(tmp_path))
+    return first, JobRegistry(shared=first), second, JobRegistry(shared=second)
+
+
+def test_cancel_reaches_a_job_in_another_worker(tmp_path, monkeypatch):
+    first, first_jobs, second, second_jobs = make_workers(tmp_path, monkeypatch)
+    session_id = first.create_session()
+    events = []
+    thread = start_job(first_jobs, session_id, events)
+
+    assert second_jobs.cancel(session_id)
+    thread.join(5)
+    assert events and "cancelled by the user" in events[0][0]
+    # Nothing left to cancel anywhere
+    assert not second_jobs.cancel(session_id)
+    assert not first_jobs.cancel(session_id)
+
+
+def test_new_job_waits_for_the_job_it_supersedes_in_another_worker(tmp_path, monkeypatch):
+    first, first_jobs, second, second_jobs = make_workers(tmp_path, monkeypatch)
+    session_id = first.create_session()
+    events = []
+    thread = start_job(first_jobs, session_id, events)
+
+    with second_jobs.job(session_id):
+        # Only starts once the other worker's job has cleaned up
+        started = time.monotonic()
+        assert events and "superseded" in events[0][0]
+        assert events[0][1] <= started
+    thread.join(5)
+
+
+def test_jobs_of_dead_workers_are_not_waited_for(tmp_path, monkeypatch):
+    first, first_jobs, second, second_jobs = make_workers(tmp_path, monkeypatch)
+    session_id = first.create_session()
+    # A job whose worker died without finishing it
+    first.start_job(session_id, "dead-job")
+    first._connect().execute("UPDATE jobs SET seen = 0 WHERE job_id = 'dead-job'")
+
+    assert not second_jobs.cancel(session_id)
+    started = time.monotonic()
+    with second_jobs.job(session_id):
+        assert time.monotonic() - started < 1
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Planning mixes against their sources' durations, with metadata lookups stubbed.
+
+manifest_cache.info is replaced by a table of fake videos, so planning makes
+no requests; a URL missing from the table behaves like an unavailable video.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from features.mix_plan import PlanError, iter_plan, plan_mix
+from manifest_cache import manifest_cache
+
+DURATIONS = {"short": 60, "long": 600}
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """URLs resolved so far, in order"""
+    resolved = []
+
+    def info(url):
+        resolved.append(url)
+        if url not in DURATIONS:
+            raise Exception("Video unavailable")
+        return SimpleNamespace(duration=DURATIONS[url])
+
+    monkeypatch.setattr(manifest_cache, "info", info)
+    return resolved
+
+
+def test_ends_past_the_video_are_clamped(lookups):
+    items, diagnostics = plan_mix([["short", "0:30", "2:00"], ["long", 10, 70]])
+    assert items == [["short", 30, 60], ["long", 10, 70]]
+    assert [d["status"] for d in diagnostics] == ["fixed", "ok"]
+    assert diagnostics[0]["duration"] == 60 and "clamped" in diagnostics[0]["issues"][0]
+
+
+def test_bad_items_are_rejected_and_the_rest_mixed(lookups):
+    items, diagnostics = plan_mix([
+        ["long", 10, 5],            # Ends before it starts
+        ["short", 90, 120],         # Starts past the end of the video
+        ["long", 0, 0.5],           # Too short
+        ["gone", 0, 30],            # Unavailable
+        ["long", "x", 30],          # Not a time
+        [None, 0, 30],              # No URL
+        ["long", 100, 160],
+    ])
+    assert items == [["long", 100, 160]]
+    assert [d["status"] for d in diagnostics] == ["rejected"] * 6 + ["ok"]
+    assert "unavailable" in diagnostics[3]["issues"][0]
+    # Items whose times are wrong anyway are never looked up
+    assert sorted(lookups) == ["gone", "long", "short"]
+
+
+def test_strict_rejects_the_plan_if_anything_needed_fixing(lookups):
+    with pytest.raises(PlanError) as e:
+        plan_mix([["long", 0, 60], ["short", 0, 90]], strict=True)
+    assert [d["status"] for d in e.value.diagnostics] == ["ok", "fixed"]
+
+    items, _ = plan_mix([["long", 0, 60], ["short", 0, 30]], strict=True)
+    assert items == [["long", 0, 60], ["short", 0, 30]]
+
+
+def test_nothing_to_mix_is_an_error(lookups):
+    with pytest.raises(PlanError) as e:
+        plan_mix([["gone", 0, 30]])
+    assert e.value.diagnostics[0]["status"] == "rejected"
+
+
+def test_long_plans_are_read_and_resolved_a_window_at_a_time(lookups):
+    read = []
+
+    def rows():
+        for i in range(10):
+            read.append(i)
+            yield ["gone" if i == 4 else "long", i * 10, i * 10 + 20]
+
+    problems = []
+    plan = iter_plan(rows(), problems, window=3)
+    assert next(plan) == ["long", 0, 20]
+    # Only the first window has been read and resolved
+    assert read == [0, 1, 2] and len(lookups) == 3
+
+    rest = list(plan)
+    assert len(rest) == 8 and rest[-1] == ["long", 90, 110]
+    assert len(read) == 10
+    assert [(d["index"], d["status"]) for d in problems] == [(4, "rejected")]
+
+
+def test_streamed_plan_with_nothing_to_mix_fails_once_the_rows_run_out(lookups):
+    problems = []
+    with pytest.raises(PlanError):
+        list(iter_plan([["gone", 0, 30], ["long", 5, 1]], problems, window=1))
+    assert [d["index"] for d in problems] == [0, 1]
+
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Rotation, ejection and recovery of the proxy pool against local proxies.
+
+Starts a local origin server and a few forwarding HTTP proxies on
+127.0.0.1, one of which fails every request until it's told to recover,
+and drives the pool the way downloads do: requests made under leases
+through urllib's global opener.
+"""
+import http.server
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import proxy_pool as pp
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every request with the name of the proxy that forwarded it"""
+
+    def do_GET(self):
+        if self.path.endswith("/generate_204"):
+            self.send_response(204)
+            self.end_headers()
+            return
+        body = self.headers.get("X-Via", "direct").encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ForwardProxyHandler(http.server.BaseHTTPRequestHandler):
+    """Plain-HTTP forward proxy; answers 502 while its server is failing"""
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.requests += 1
+        if self.server.failing:
+            self.send_error(502)
+            return
+        request = urllib.request.Request(self.path, headers={"X-Via": self.server.name})
+        # Straight to the origin, never through the proxy handler under test
+        with urllib.request.build_opener(urllib.request.ProxyHandler({})).open(request, timeout=5) as response:
+            body = response.read()
+            status = response.status
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(handler, **attributes):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.stats_lock = threading.Lock()
+    server.requests = 0
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def fetch(url):
+    """One request through urllib's global opener, as pytubefix makes them"""
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def make_pool():
+    origin = start(OriginHandler)
+    proxies = {
+        "good-a": start(ForwardProxyHandler, name="good-a", failing=False),
+        "good-b": start(ForwardProxyHandler, name="good-b", failing=False),
+        "flaky": start(ForwardProxyHandler, name="flaky", failing=True),
+    }
+    pool = pp.ProxyPool([url_of(server) for server in proxies.values()], max_failures=3,
+                        base_backoff=0.2, probe_url=f"{url_of(origin)}/generate_204")
+    names = {proxy.url: name for proxy, name in zip(pool.proxies, proxies)}
+    return origin, proxies, pool, names
+
+
+def fetch_concurrently(pool, url, jobs=3):
+    """One request from each of several jobs holding leases at once; returns (proxies, answers) in lease order"""
+    if not jobs:
+        return [], []
+    with pool.lease() as proxy:
+        answer = fetch(url)
+        leased, answers = fetch_concurrently(pool, url, jobs - 1)
+    return [proxy] + leased, [answer] + answers
+
+
+def test_rotation_ejection_and_recovery():
+    origin, proxies, pool, names = make_pool()
+    origin_url = f"{url_of(origin)}/watch"
+
+    # Concurrent jobs each get a proxy of their own
+    leased, answers = fetch_concurrently(pool, origin_url)
+    assert {proxy.url for proxy in leased} == set(names)
+    assert sorted(answers, key=str) == [502, "good-a", "good-b"]
+
+    # The failing proxy ranks last, so it's only used while the others are
+    # busy, until it's ejected
+    flaky = next(p for p in pool.proxies if names[p.url] == "flaky")
+    for _ in range(2):
+        leased, answers = fetch_concurrently(pool, origin_url)
+        assert leased[-1] is flaky and answers[-1] == 502
+    assert flaky.state == pp.Proxy.EJECTED
+    assert proxies["flaky"].requests == 3
+
+    # Ejected, it gets no traffic even though the others are busier
+    for _ in range(3):
+        leased, answers = fetch_concurrently(pool, origin_url)
+        assert flaky not in leased and 502 not in answers
+    assert proxies["flaky"].requests == 3
+
+    # Once its backoff is over, a successful probe re-admits it
+    proxies["flaky"].failing = False
+    time.sleep(0.3)
+    with pool.lease():
+        pass
+    deadline = time.monotonic() + 5
+    while flaky.state != pp.Proxy.HEALTHY and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert flaky.state == pp.Proxy.HEALTHY
+    leased, answers = fetch_concurrently(pool, origin_url)
+    assert sorted(answers) == ["flaky", "good-a", "good-b"]
+
+
+def test_failing_proxy_without_latency_ranks_last():
+    origin, proxies, pool, names = make_pool()
+    flaky = next(p for p in pool.proxies if names[p.url] == "flaky")
+    # Two failures: still healthy, but it has never answered
+    for _ in range(2):
+        pool.record(flaky, ok=False)
+    for proxy in pool.proxies:
+        if proxy is not flaky:
+            pool.record(proxy, ok=True, latency=0.5)
+    assert flaky.state == pp.Proxy.HEALTHY and flaky.latency_ms is None
+    for _ in range(5):
+        with pool.lease() as proxy:
+            assert proxy is not flaky
+
+
+def test_environment_proxy_honours_no_proxy(monkeypatch):
+    origin, proxies, pool, names = make_pool()
+    monkeypatch.setenv("http_proxy", url_of(proxies["good-a"]))
+    monkeypatch.setenv("no_proxy", "127.0.0.1")
+    opener = urllib.request.build_opener(pp.PoolProxyHandler())
+    with opener.open(f"{url_of(origin)}/watch", timeout=5) as response:
+        assert response.read() == b"direct"
+    assert proxies["good-a"].requests == 0
+
+    monkeypatch.setenv("no_proxy", "example.invalid")
+    with opener.open(f"{url_of(origin)}/watch", timeout=5) as response:
+        assert response.read() == b"good-a"
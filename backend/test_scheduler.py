@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Ordering, aging, back-pressure and cancellation of queued scheduler work.
+
+A scheduler with a single slot is held busy while work is queued one unit
+at a time, so the order units are served in is fully determined by the
+scheduler rather than by thread timing. Aging runs on a fake clock.
+"""
+import threading
+import time
+
+import pytest
+
+import scheduler as sch
+from cancellation import Cancelled, CancelToken, cancel_scope
+
+
+class FakeClock:
+    """Stands in for the time module inside the scheduler"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def perf_counter(self):
+        return self.now
+
+
+class Harness:
+    """Keeps a one-slot scheduler busy and queues labelled units behind it"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.served = []
+        self.errors = []
+        self.threads = []
+        self.release = threading.Event()
+        holding = threading.Event()
+
+        def hold():
+            with sch.scheduled_job("holder"), scheduler.slot():
+                holding.set()
+                self.release.wait(5)
+
+        self.start(hold)
+        assert holding.wait(5)
+
+    def start(self, target):
+        thread = threading.Thread(target=target)
+        thread.start()
+        self.threads.append(thread)
+
+    def queue(self, session_id, label, priority="normal", token=None):
+        """Queue one unit and wait until the scheduler has it in line"""
+        queued = self.scheduler.queued
+
+        def run():
+            with sch.scheduled_job(session_id, priority), cancel_scope(token):
+                try:
+                    with self.scheduler.slot():
+                        self.served.append(label)
+                except (Cancelled, sch.SchedulerBusy) as e:
+                    self.errors.append((label, e))
+
+        self.start(run)
+        wait_until(lambda: self.scheduler.queued > queued or self.errors)
+
+    def finish(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(5)
+        return self.served
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_sessions_take_turns():
+    harness = Harness(sch.WorkScheduler("test", slots=1))
+    for i in range(3):
+        harness.queue("batch", f"batch-{i}")
+    harness.queue("other", "other-0")
+    harness.queue("other", "other-1")
+
+    # The session with more queued work only gets every other free slot
+    assert harness.finish() == ["batch-0", "other-0", "batch-1", "other-1", "batch-2"]
+
+
+def test_interactive_work_goes_first():
+    harness = Harness(sch.WorkScheduler("test", slots=1))
+    harness.queue("batch", "bulk-0", "bulk")
+    harness.queue("batch", "normal-0")
+    harness.queue("user", "interactive-0", "interactive")
+
+    assert harness.finish() == ["interactive-0", "normal-0", "bulk-0"]
+
+
+def test_aged_bulk_work_is_promoted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sch, "time", clock)
+    harness = Harness(sch.WorkScheduler("test", slots=1, aging_seconds=30))
+    harness.queue("batch", "bulk-0", "bulk")
+    clock.now += 31
+    harness.queue("user", "interactive-0", "interactive")
+
+    # Waiting longer than aging_seconds beats a more urgent class
+    assert harness.finish() == ["bulk-0", "interactive-0"]
+
+
+def test_full_queue_rejects_new_work():
+    scheduler = sch.WorkScheduler("test", slots=1, max_queue=2)
+    harness = Harness(scheduler)
+    harness.queue("a", "a-0")
+    harness.queue("b", "b-0")
+    harness.queue("c", "c-0")
+
+    [(label, error)] = harness.errors
+    assert label == "c-0" and isinstance(error, sch.SchedulerBusy)
+    assert error.retry_after > 0
+    assert scheduler.stats()["rejected"] == 1
+    assert harness.finish() == ["a-0", "b-0"]
+
+
+def test_cancelled_work_leaves_the_queue(monkeypatch):
+    monkeypatch.setattr(sch, "CANCEL_POLL_SECONDS", 0.01)
+    scheduler = sch.WorkScheduler("test", slots=1)
+    harness = Harness(scheduler)
+    token = CancelToken("a")
+    harness.queue("a", "a-0", token=token)
+    harness.queue("b", "b-0")
+
+    token.cancel()
+    wait_until(lambda: harness.errors)
+    [(label, error)] = harness.errors
+    assert label == "a-0" and isinstance(error, Cancelled)
+    assert scheduler.queued == 1
+    assert harness.finish() == ["b-0"]
+    assert scheduler.stats()["cancelled"] == 1
+    assert scheduler.active == 0
+
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(ValueError):
+        with sch.scheduled_job("a", "urgent"):
+            pass
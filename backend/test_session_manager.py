@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Sessions shared by several worker processes through one registry file.
+
+Two SessionManagers on the same base directory stand in for two workers.
+"""
+import os
+import threading
+import time
+
+from session_manager import SessionManager
+
+
+def make_workers(tmp_path, **options):
+    return SessionManager(str(tmp_path), **options), SessionManager(str(tmp_path), **options)
+
+
+def test_session_created_in_one_worker_is_seen_by_the_other(tmp_path):
+    first, second = make_workers(tmp_path)
+    session_id = first.create_session()
+
+    assert session_id in second.list_sessions()
+    assert second.get_session_dir(session_id) == first.get_session_dir(session_id)
+
+    # A touch from either worker is what both see
+    first._connect().execute("UPDATE sessions SET last_accessed = 0 WHERE session_id = ?", (session_id,))
+    second.get_session_dir(session_id)
+    row = first._connect().execute(
+        "SELECT last_accessed FROM sessions WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    assert row[0] > time.time() - 60
+
+
+def test_only_one_worker_holds_the_cleaner_lease(tmp_path):
+    first, second = make_workers(tmp_path)
+
+    assert first._acquire_cleaner_lease()
+    assert not second._acquire_cleaner_lease()
+    # The holder renews it
+    assert first._acquire_cleaner_lease()
+    assert not second._acquire_cleaner_lease()
+
+    # Once it lapses, e.g. because its worker died, the other takes over
+    first._connect().execute("UPDATE cleaner_lease SET expires = 0")
+    assert second._acquire_cleaner_lease()
+    assert not first._acquire_cleaner_lease()
+
+
+def test_expired_session_is_removed_exactly_once(tmp_path):
+    first, second = make_workers(tmp_path)
+    session_id = first.create_session()
+    session_dir = first.get_session_dir(session_id)
+    first._connect().execute("UPDATE sessions SET last_accessed = 0 WHERE session_id = ?", (session_id,))
+    cutoff = time.time() - first.expiry_seconds
+
+    # Both workers try to expire it at the same moment
+    start = threading.Barrier(2)
+    deleted = []
+
+    def expire(manager):
+        start.wait()
+        deleted.append(manager.delete_session(session_id, expired_before=cutoff))
+
+    threads = [threading.Thread(target=expire, args=(manager,)) for manager in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(deleted) == [False, True]
+    assert not os.path.exists(session_dir)
+    assert not [item for item in os.listdir(tmp_path) if item.endswith(".deleting")]
+    assert session_id not in first.list_sessions() + second.list_sessions()
+
+
+def test_session_touched_by_another_worker_is_not_expired(tmp_path):
+    first, second = make_workers(tmp_path)
+    session_id = first.create_session()
+    first._connect().execute("UPDATE sessions SET last_accessed = 0 WHERE session_id = ?", (session_id,))
+    cutoff = time.time() - first.expiry_seconds
+
+    # In use in the other worker after the cleaner picked it as expired
+    second.get_session_dir(session_id)
+    assert not first.delete_session(session_id, expired_before=cutoff)
+    assert os.path.isdir(second.get_session_dir(session_id))
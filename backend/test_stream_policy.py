@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Stream selection within a StreamPolicy, against stub manifests.
+
+The stubs carry only the manifest fields select_streams reads, so nothing
+is requested from YouTube.
+"""
+import pytest
+
+from features.stream_policy import StreamPolicy, StreamRejected, select_streams
+
+MB = 2 ** 20
+
+
+class Stream:
+    def __init__(self, type, codec, kbps, height=None, fps=30, size=None):
+        self.type = type
+        self.video_codec = codec if type == "video" else None
+        self.audio_codec = codec if type == "audio" else None
+        self.height = height
+        self.resolution = f"{height}p" if height else None
+        self.fps = fps if type == "video" else None
+        self.abr = f"{kbps}kbps" if type == "audio" else None
+        self.bitrate = kbps * 1000
+        self._filesize = size
+
+
+class Streams:
+    def __init__(self, streams):
+        self.streams = streams
+
+    def filter(self, progressive=None, type=None):
+        return [s for s in self.streams if type is None or s.type == type]
+
+
+class Manifest:
+    def __init__(self, streams, duration=600):
+        self.streams = Streams(streams)
+        self.duration = duration
+
+
+def video(height, codec="avc1.640028", kbps=None, **kwargs):
+    return Stream("video", codec, kbps or height * 4, height=height, **kwargs)
+
+
+def audio(codec="mp4a.40.2", kbps=128, **kwargs):
+    return Stream("audio", codec, kbps, **kwargs)
+
+
+def policy(**limits):
+    base = StreamPolicy(max_height=0, max_kbps=0, max_bytes=0, video_codecs=("vp9", "h264", "av1"),
+                        audio_codecs=("aac", "opus"), over_limit="downgrade")
+    return StreamPolicy.from_dict(limits, base=base)
+
+
+def test_best_streams_within_the_height_cap():
+    manifest = Manifest([video(2160), video(1080), video(720), audio()])
+    assert select_streams(manifest, policy()).video.height == 2160
+    selection = select_streams(manifest, policy(max_height=1080))
+    assert selection.video.height == 1080 and not selection.downgraded
+
+
+def test_preferred_codec_wins_at_the_same_resolution():
+    manifest = Manifest([video(1080, "avc1.640028"), video(1080, "vp09.00.40.08"), video(1080, "av01.0.08M.08"),
+                         audio("opus", 160), audio("mp4a.40.2", 128)])
+    selection = select_streams(manifest, policy())
+    assert selection.video.video_codec.startswith("vp09")
+    # aac is preferred even over the higher-bitrate opus
+    assert selection.audio.audio_codec.startswith("mp4a")
+
+    selection = select_streams(manifest, policy(video_codecs=["av1", "h264"], audio_codecs="opus"))
+    assert selection.video.video_codec.startswith("av01")
+    assert selection.audio.audio_codec == "opus"
+
+
+def test_over_the_size_limit_downgrades():
+    manifest = Manifest([video(1080, size=300 * MB), video(720, size=150 * MB), video(480, size=60 * MB),
+                         audio(size=10 * MB)])
+    selection = select_streams(manifest, policy(max_mb=200))
+    assert selection.video.height == 720 and selection.downgraded
+    assert selection.estimated_bytes == 160 * MB
+
+
+def test_over_the_size_limit_rejects_when_asked():
+    manifest = Manifest([video(1080, size=300 * MB), video(720, size=150 * MB), audio(size=10 * MB)])
+    with pytest.raises(StreamRejected) as e:
+        select_streams(manifest, policy(max_mb=200, over_limit="reject"))
+    assert e.value.details["preferred"]["resolution"] == "1080p"
+    assert e.value.details["policy"]["max_mb"] == 200
+
+
+def test_nothing_fits_rejects_even_when_downgrading():
+    manifest = Manifest([video(720, size=150 * MB), audio(size=10 * MB)])
+    with pytest.raises(StreamRejected):
+        select_streams(manifest, policy(max_mb=100))
+    with pytest.raises(StreamRejected) as e:
+        select_streams(manifest, policy(video_codecs=["av1"]))
+    assert e.value.details["available"]
+
+
+def test_clip_size_scales_with_its_seconds():
+    manifest = Manifest([video(1080, size=300 * MB), video(720, size=150 * MB), audio(size=10 * MB)], duration=600)
+    # A minute of a ten-minute video is a tenth of its size
+    selection = select_streams(manifest, policy(max_mb=50), seconds=60)
+    assert selection.video.height == 1080 and selection.estimated_bytes == 31 * MB
+
+
+def test_size_estimated_from_bitrate_without_content_length():
+    manifest = Manifest([audio(kbps=128), audio("opus", kbps=64)], duration=100)
+    selection = select_streams(manifest, policy(max_kbps=100), video=False)
+    assert selection.video is None and selection.audio.audio_codec == "opus"
+    assert selection.estimated_bytes == 64000 * 100 // 8
+
+
+def test_from_dict_keeps_unset_limits_and_validates():
+    base = policy(max_height=720, max_mb=100)
+    overridden = StreamPolicy.from_dict({"max_kbps": 2000}, base=base)
+    assert (overridden.max_height, overridden.max_kbps, overridden.max_bytes) == (720, 2000, 100 * MB)
+    assert StreamPolicy.from_dict(overridden.to_dict(), base=policy()).to_dict() == overridden.to_dict()
+
+    for bad in ({"max_height": -1}, {"max_mb": "lots"}, {"max_kbps": True}, {"video_codecs": [1]},
+                {"over_limit": "ignore"}, {"min_height": 360}, ["max_height"]):
+        with pytest.raises(ValueError):
+            StreamPolicy.from_dict(bad, base=base)
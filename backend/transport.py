@@ -0,0 +1,334 @@
+"""
+Process-wide HTTP transport for media and metadata fetches.
+
+urllib opens a new connection for every request and asks for it to be
+closed afterwards, so each YouTube page, player, innertube call and media
+range request paid for its own DNS lookup, TCP connect and TLS handshake.
+These handlers replace urllib's HTTP and HTTPS handlers in the global opener
+(see proxy_pool.install) and add:
+
+- keep-alive connection pools per host (and per proxy tunnel), so a
+  connection is reused once its response has been read to the end
+- a bound on concurrent requests per host
+- a DNS cache, so repeated lookups of the same host are answered in-process
+"""
+import http.client
+import os
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import weakref
+from collections import deque
+
+MAX_PER_HOST = int(os.environ.get("INTELLIMIX_HTTP_PER_HOST", 6))
+IDLE_TIMEOUT = float(os.environ.get("INTELLIMIX_HTTP_IDLE_TIMEOUT", 30))
+DNS_TTL = float(os.environ.get("INTELLIMIX_DNS_TTL", 300))
+# Longest a request waits for a per-host slot before going ahead anyway, so a
+# response that's never closed can't starve its host for good
+HOST_WAIT_TIMEOUT = 30
+
+# Errors that mean a reused keep-alive connection was closed by the server while idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class DnsCache:
+    """getaddrinfo results cached per (host, port) for ttl seconds"""
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[(host, port)] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        """Drop-in for socket.create_connection that resolves through the cache"""
+        host, port = address
+        error = None
+        for family, type_, proto, _, sockaddr in self.resolve(host, port):
+            sock = socket.socket(family, type_, proto)
+            try:
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        # Don't keep handing out addresses that no longer answer
+        self.forget(host, port)
+        raise error or OSError(f"getaddrinfo returned no addresses for {host}")
+
+
+class PooledResponse(http.client.HTTPResponse):
+    """Response that hands its connection back to the pool once it's finished"""
+
+    on_finished = None
+
+    def close(self):
+        # Closing before the body was read to the end leaves unread bytes on the socket
+        if self.fp is not None and self.length != 0:
+            self.closed_early = True
+        super().close()
+
+    def _close_conn(self):
+        # Called by http.client at the end of the body, or by close()
+        super()._close_conn()
+        if self.on_finished is not None:
+            on_finished, self.on_finished = self.on_finished, None
+            on_finished(reusable=not getattr(self, "closed_early", False) and not self.will_close)
+
+
+class PooledHTTPConnection(http.client.HTTPConnection):
+    response_class = PooledResponse
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    response_class = PooledResponse
+
+
+class _Request:
+    """Bookkeeping for one request until its response is finished"""
+
+    def __init__(self, key, connection, host_slot):
+        self.key = key
+        self.connection = connection
+        self.host_slot = host_slot
+        self.done = False
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections and per-host request slots.
+
+    Args:
+        max_per_host (int): Concurrent requests per host, and idle connections kept per key
+        idle_timeout (float): Seconds an idle connection is kept before it's closed
+        dns_ttl (float): Seconds a DNS answer is reused
+    """
+
+    def __init__(self, max_per_host=MAX_PER_HOST, idle_timeout=IDLE_TIMEOUT, dns_ttl=DNS_TTL):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.dns = DnsCache(dns_ttl)
+        self._idle = {}  # key -> deque of (idle_since, connection)
+        self._host_slots = {}  # host -> BoundedSemaphore
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.reused = 0
+        self.stale_retries = 0
+        self.host_waits = 0
+
+    def host_slot(self, host):
+        """Take a request slot for a host; returns the semaphore to release, or None"""
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+        if slot.acquire(blocking=False):
+            return slot
+        with self._lock:
+            self.host_waits += 1
+        if slot.acquire(timeout=HOST_WAIT_TIMEOUT):
+            return slot
+        print(f"Waited {HOST_WAIT_TIMEOUT}s for a connection slot to {host}, going ahead anyway")
+        return None
+
+    def get(self, key, connection_class, host, **kwargs):
+        """
+        Return (connection, reused): the most recently used idle connection for
+        key, or a new one.
+        """
+        now = time.monotonic()
+        stale = []
+        connection = None
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                idle_since, candidate = idle.pop()
+                if now - idle_since < self.idle_timeout and candidate.sock is not None:
+                    connection = candidate
+                    break
+                stale.append(candidate)
+            self.requests += 1
+            if connection is not None:
+                self.reused += 1
+            else:
+                self.connections_opened += 1
+        for candidate in stale:
+            candidate.close()
+        if connection is not None:
+            return connection, True
+
+        connection = connection_class(host, **kwargs)
+        connection._create_connection = self.dns.create_connection
+        return connection, False
+
+    def put(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.max_per_host:
+                idle.append((time.monotonic(), connection))
+                return
+        connection.close()
+
+    def finish(self, request, reusable):
+        """Release a finished request's slot and keep its connection if it can be reused"""
+        with self._lock:
+            if request.done:
+                return
+            request.done = True
+        if request.host_slot is not None:
+            request.host_slot.release()
+        if reusable and request.connection.sock is not None:
+            self.put(request.key, request.connection)
+        else:
+            request.connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "reused": self.reused,
+                "reuse_rate": round(self.reused / self.requests, 3) if self.requests else None,
+                "stale_retries": self.stale_retries,
+                "host_waits": self.host_waits,
+                "idle_connections": sum(len(idle) for idle in self._idle.values()),
+                "dns_hits": self.dns.hits,
+                "dns_misses": self.dns.misses,
+            }
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, connection in connections:
+                connection.close()
+
+
+class _KeepAliveMixin:
+    """do_open() replacement shared by the HTTP and HTTPS handlers"""
+
+    def _keepalive_open(self, connection_class, req, **connection_kwargs):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError("no host given")
+        pool = self.pool
+
+        # Same header handling as urllib's do_open, minus "Connection: close"
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): value for name, value in headers.items()}
+        tunnel_headers = {}
+        if req._tunnel_host and "Proxy-Authorization" in headers:
+            tunnel_headers["Proxy-Authorization"] = headers.pop("Proxy-Authorization")
+
+        timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+
+        key = (connection_class.__name__, host, req._tunnel_host, tunnel_headers.get("Proxy-Authorization"))
+        origin = urllib.parse.urlsplit(req.full_url).netloc
+        host_slot = pool.host_slot(origin)
+        # Only bodies that can be sent again are retried on a stale connection
+        retryable = req.data is None or isinstance(req.data, bytes)
+        try:
+            while True:
+                connection, reused = pool.get(key, connection_class, host, timeout=timeout, **connection_kwargs)
+                if reused:
+                    connection.timeout = timeout
+                    if connection.sock is not None:
+                        connection.sock.settimeout(timeout)
+                elif req._tunnel_host:
+                    connection.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+                try:
+                    try:
+                        connection.request(req.get_method(), req.selector, req.data, headers,
+                                           encode_chunked=req.has_header("Transfer-encoding"))
+                    except STALE_CONNECTION_ERRORS:
+                        raise
+                    except OSError as err:
+                        raise urllib.error.URLError(err)
+                    response = connection.getresponse()
+                except STALE_CONNECTION_ERRORS as err:
+                    connection.close()
+                    if reused and retryable:
+                        with pool._lock:
+                            pool.stale_retries += 1
+                        continue
+                    if isinstance(err, http.client.RemoteDisconnected):
+                        raise
+                    raise urllib.error.URLError(err)
+                except BaseException:
+                    connection.close()
+                    raise
+                break
+            # http.client remembers the last response on the connection; the pool
+            # tracks it instead, so the response doesn't keep itself alive
+            connection._HTTPConnection__response = None
+        except BaseException:
+            if host_slot is not None:
+                host_slot.release()
+            raise
+
+        request = _Request(key, connection, host_slot)
+        response.on_finished = lambda reusable: pool.finish(request, reusable)
+        # A response dropped without being read or closed must not hold its slot forever
+        weakref.finalize(response, pool.finish, request, False)
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib.request.HTTPHandler):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def http_open(self, req):
+        return self._keepalive_open(PooledHTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib.request.HTTPSHandler):
+    def __init__(self, pool, context=None):
+        super().__init__()
+        self.pool = pool
+        self.ssl_context = context or ssl.create_default_context()
+
+    def https_open(self, req):
+        return self._keepalive_open(PooledHTTPSConnection, req, context=self.ssl_context)
+
+
+connection_pool = ConnectionPool()
+
+
+def handlers(pool=None):
+    """urllib handlers that send requests through the connection pool"""
+    pool = pool or connection_pool
+    return [KeepAliveHTTPHandler(pool), KeepAliveHTTPSHandler(pool)]
@@ -0,0 +1,59 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+# Heavy dependencies the feature modules import on first use
+HEAVY_MODULES = [
+    "pydub",
+    "pytubefix",
+    "tqdm",
+    "google.genai",
+    "moviepy.editor",
+]
+
+_timings = {}  # module name -> seconds the pre-warm import took
+_errors = {}  # module name -> import error message
+_started = threading.Event()
+
+
+def _import_all(modules):
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            _timings[name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            _errors[name] = str(e)
+    print("Pre-warm finished: " + ", ".join(f"{name} ({_timings.get(name, 'failed')}s)" for name in modules))
+
+
+def prewarm(modules=HEAVY_MODULES):
+    """
+    Import heavy dependencies in a background thread so the first request
+    doesn't pay for them. Does nothing if INTELLIMIX_PREWARM=0 or if already
+    started.
+    """
+    if os.environ.get("INTELLIMIX_PREWARM", "1") == "0" or _started.is_set():
+        return
+    _started.set()
+    threading.Thread(target=_import_all, args=(list(modules),), daemon=True).start()
+
+
+def status():
+    """
+    Report which heavy modules are loaded.
+
+    Returns:
+        dict: module name -> {"loaded": bool, "seconds": float, "error": str}
+    """
+    report = {}
+    for name in HEAVY_MODULES:
+        entry = {"loaded": name in sys.modules}
+        if name in _timings:
+            entry["seconds"] = _timings[name]
+        if name in _errors:
+            entry["error"] = _errors[name]
+        report[name] = entry
+    return report